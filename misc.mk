@@ -64,3 +64,16 @@ $(foreach SUFFIX,$(SUFFIXES) otf, \
 
 $(FONTS): $(FONT_DIR)/%: %
 	cp "$^" "$@"
+
+
+##### Static file manifest #####
+# This needs to stay last, so it runs after all the other static files exist.
+PYTHON ?= python
+
+static::
+	PYTHONPATH="$(PROJECT_ROOT)src" $(PYTHON) -m evesrp.util.build_static \
+		--gzip "$(STATIC_DIR)"
+
+clean::
+	rm -f $(STATIC_DIR)/manifest.json
+	find $(STATIC_DIR) -name '*.gz' -delete
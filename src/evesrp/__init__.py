@@ -1,21 +1,25 @@
 from __future__ import absolute_import
+from collections import deque
 from decimal import Decimal
 import locale
 import os
-import requests
 import sys
+import time
 import warnings
-from flask import current_app, g
+from flask import current_app, g, request
 import flask_sqlalchemy
 from flask_babel import Babel, get_locale
+from flask_login import current_user
 from flask_wtf.csrf import CsrfProtect
+from jinja2 import FileSystemBytecodeCache
 import six
 from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.schema import MetaData
 from werkzeug.utils import import_string
+from .routing import RoutingSQLAlchemy
 from .transformers import Transformer
-from .versioned_static import static_file, VersionedStaticFlask
+from .versioned_static import static_file, load_manifest, VersionedStaticFlask
 
 try:
     import raven.contrib.flask as raven_flask
@@ -24,7 +28,7 @@ except ImportError:
     sentry = None
 
 
-db = flask_sqlalchemy.SQLAlchemy()
+db = RoutingSQLAlchemy()
 # Patch Flask-SQLAlchemy to use a custom Metadata instance with a naming scheme
 # for constraints.
 def _patch_metadata():
@@ -59,17 +63,17 @@ def _patch_httplib():
             six.moves.http_client.HTTPResponse.read)
 _patch_httplib()
 
-from .util import DB_STATS, AcceptRequest, WeakCiphersAdapter
+from .util import DbStats, AcceptRequest, WeakCiphersAdapter, LRUCache,\
+        FragmentCache, FragmentCacheExtension
+from .util.broadcast import Broadcaster
+from .util import metrics
+from .util.transport import TransportSession, CircuitBreaker, ErrorBudget
 
 
 __version__ = u'0.12.12.dev'
 
 
-requests_session = requests.Session()
-
-
-# Set default locale
-locale.setlocale(locale.LC_ALL, '')
+requests_session = TransportSession()
 
 
 csrf = CsrfProtect()
@@ -102,6 +106,9 @@ def create_app(config=None, **kwargs):
         module name containing the configuration.
     :type config: str, dict
     """
+    # Set the default locale here instead of when this module is imported, so
+    # importing it (like the tests and tools do) has no side effects.
+    locale.setlocale(locale.LC_ALL, '')
     # Default instance_relative_config to True to let the config fallback work
     kwargs.setdefault('instance_relative_config', True)
     app = VersionedStaticFlask('evesrp', **kwargs)
@@ -135,7 +142,15 @@ def create_app(config=None, **kwargs):
                                " installed.")
 
     # Register SQLAlchemy monitoring before the DB is connected
+    app.sql_profiles = deque(maxlen=app.config['SRP_SQL_PROFILE_HISTORY'])
     app.before_request(sqlalchemy_before)
+    app.after_request(sqlalchemy_after)
+
+    # Record request latencies
+    metrics.registry.configure(app.config['SRP_METRICS_DIR'],
+            app.config['SRP_METRICS_FLUSH_INTERVAL'])
+    app.before_request(metrics_before)
+    app.after_request(metrics_after)
 
     db.init_app(app)
 
@@ -150,8 +165,10 @@ def create_app(config=None, **kwargs):
 
     # Connect views
     from .views import index, error_page, update_navbar, divisions, login,\
-            requests, api, detect_language, locale_selector
+            requests, api, detect_language, locale_selector,\
+            prometheus_metrics
     app.add_url_rule(rule=u'/', view_func=index)
+    app.add_url_rule(rule=u'/metrics', view_func=prometheus_metrics)
     for error_code in (400, 403, 404, 500):
         app.register_error_handler(error_code, error_page)
     app.after_request(update_navbar)
@@ -196,6 +213,7 @@ def create_app(config=None, **kwargs):
             'get_locale': get_locale,
         }
     app.template_filter('currencyfmt')(jinja_locale.currencyfmt)
+    app.template_filter('currencyfmt_list')(jinja_locale.currencyfmt_list)
     app.template_filter('percentfmt')(jinja_locale.percentfmt)
     app.template_filter('numberfmt')(jinja_locale.numberfmt)
     # Auto-trim whitespace
@@ -212,16 +230,64 @@ def init_app(app):
     _config_url_converters(app)
     _config_authmethods(app)
     _config_killmails(app)
+    _config_broadcast(app)
+    _config_caches(app)
+    _config_read_replica(app)
+    _config_static(app)
+    _config_locales(app)
 
 
 # SQLAlchemy performance logging
 def sqlalchemy_before():
-    if DB_STATS.total_queries > 0:
+    g.db_stats = DbStats(request.path)
+
+
+def sqlalchemy_after(response):
+    stats = g.get('db_stats')
+    if stats is None:
+        return response
+    config = current_app.config
+    if stats.total_queries > 0:
         current_app.logger.debug(u"{} queries in {} ms.".format(
-                DB_STATS.total_queries,
-                round(DB_STATS.total_time * 1000, 3)))
-    DB_STATS.clear()
-    g.DB_STATS = DB_STATS
+                stats.total_queries, round(stats.total_time * 1000, 3)))
+    for shape in stats.repeated(config['SRP_SQL_REPEAT_THRESHOLD']):
+        current_app.logger.warning(u"Possible N+1 query: {} ran {} times "
+                u"for {} (from {}).".format(shape.statement, shape.count,
+                    stats.path, u', '.join(six.text_type(site) for site in
+                        shape.call_sites)))
+    # Like the query count in the page footer, only shown to administrators
+    if getattr(current_user, 'admin', False):
+        response.headers.add('Server-Timing', stats.server_timing())
+    current_app.sql_profiles.append(stats)
+    return response
+
+
+# Request metrics
+def metrics_before():
+    g.request_start = time.time()
+
+
+def metrics_after(response):
+    start = g.get('request_start')
+    if start is None:
+        return response
+    if request.is_json:
+        response_format = u'json'
+    elif request.is_xml:
+        response_format = u'xml'
+    elif request.is_rss:
+        response_format = u'rss'
+    else:
+        response_format = u'html'
+    endpoint = request.endpoint or u''
+    metrics.request_latency.observe(time.time() - start, endpoint=endpoint,
+            method=request.method, format=response_format,
+            status=response.status_code)
+    stats = g.get('db_stats')
+    if stats is not None:
+        metrics.request_db_time.observe(stats.total_time, endpoint=endpoint)
+    metrics.registry.flush()
+    return response
 
 
 # Utility function for creating instances from dicts
@@ -301,10 +367,21 @@ def _config_requests_session(app):
                     version=__version__)
         except KeyError as inner_exc:
             raise inner_exc
-    requests_session = requests.Session()
+    config = app.config
+    requests_session = TransportSession(timeout=config['SRP_HTTP_TIMEOUT'],
+            retries=config['SRP_HTTP_RETRIES'],
+            backoff=config['SRP_HTTP_BACKOFF'],
+            circuit_breaker=CircuitBreaker(config['SRP_HTTP_CIRCUIT_THRESHOLD'],
+                config['SRP_HTTP_CIRCUIT_RESET']),
+            error_budget=ErrorBudget(config['SRP_ESI_ERROR_LIMIT_FLOOR'],
+                config['SRP_ESI_MAX_PAUSE']),
+            esi_hosts=config['SRP_ESI_HOSTS'])
     requests_session.headers.update({'User-Agent': ua_string})
+    requests_session.hooks['response'].append(metrics.record_http_response)
+    requests_session.mount_pools(config['SRP_HTTP_POOL_SIZE'],
+            config['SRP_HTTP_POOL_SIZES'])
     requests_session.mount('https://crest-tq.eveonline.com',
-            WeakCiphersAdapter())
+            WeakCiphersAdapter(pool_maxsize=config['SRP_HTTP_POOL_SIZE']))
     app.requests_session = requests_session
 
 
@@ -322,6 +399,61 @@ def _config_killmails(app):
     app.killmail_sources = killmail_sources
 
 
+# Change notifications for request listings
+def _config_broadcast(app):
+    fanout = app.config['SRP_BROADCAST_FANOUT']
+    if isinstance(fanout, dict):
+        fanout = _instance_from_dict(dict(fanout))
+    app.request_broadcast = Broadcaster(fanout)
+
+
+# Available translations
+def _config_locales(app):
+    from .util.locale import load_locales
+    load_locales(app)
+
+
+# Hashed static file names
+def _config_static(app):
+    if app.config['SRP_STATIC_FILE_HASH']:
+        app.static_manifest = load_manifest(app)
+    else:
+        app.static_manifest = None
+
+
+# Caches of rendered responses
+def _config_caches(app):
+    app.feed_cache = LRUCache(app.config['SRP_FEED_CACHE_SIZE'])
+    app.transformer_cache = LRUCache(app.config['SRP_TRANSFORMER_CACHE_SIZE'])
+    shared = app.config['SRP_FRAGMENT_CACHE_STORE']
+    if isinstance(shared, dict):
+        shared = _instance_from_dict(dict(shared))
+    app.fragment_cache = FragmentCache(app.config['SRP_FRAGMENT_CACHE_SIZE'],
+            shared, app.config['SRP_FRAGMENT_CACHE_TIMEOUT'])
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache = app.fragment_cache
+    from .auth.user_cache import UserCache
+    app.user_cache = UserCache(app.config['SRP_USER_CACHE_SIZE'],
+            app.config['SRP_USER_CACHE_TTL'])
+    bytecode_cache = app.config['SRP_TEMPLATE_BYTECODE_CACHE']
+    if bytecode_cache:
+        if bytecode_cache is True:
+            # Use a directory under the system's temporary directory
+            bytecode_cache = FileSystemBytecodeCache()
+        elif isinstance(bytecode_cache, six.string_types):
+            bytecode_cache = FileSystemBytecodeCache(bytecode_cache)
+        app.jinja_env.bytecode_cache = bytecode_cache
+
+
+# Read replica routing
+def _config_read_replica(app):
+    if app.config['SRP_READ_REPLICA_BIND'] is None:
+        return
+    from . import routing
+    app.before_request(routing.choose_bind)
+    app.after_request(routing.pin_to_primary)
+
+
 # Work around DBAPI-specific issues with Decimal subclasses.
 # Specifically, almost everything besides pysqlite and psycopg2 raise
 # exceptions if an instance of a Decimal subclass as opposed to an instance of
@@ -1,11 +1,13 @@
 from __future__ import absolute_import
 import re
 
-from flask import redirect, url_for, current_app
+from flask import redirect, url_for, current_app, session
 from flask_babel import gettext, lazy_gettext
 import flask_login
 from flask_wtf import Form
 from wtforms.fields import SubmitField, HiddenField
+import six
+from .. import db
 from ..util import DeclEnum, classproperty, ensure_unicode
 
 
@@ -64,6 +66,8 @@ class AuthMethod(object):
         :type user: :py:class:`~models.User`
         """
         flask_login.login_user(user)
+        # Start with fresh values in the user cache
+        session['user_generation'] = session.get('user_generation', 0) + 1
 
     @property
     def safe_name(self):
@@ -83,7 +87,7 @@ class AuthMethod(object):
         lowered = no_space.lower()
         return lowered
 
-    def refresh(self, user):
+    def refresh(self, user, cache=None):
         """Refresh a user's information (if possible).
 
         The :py:class:`~.AuthMethod` should attmept to refresh the given user's
@@ -91,11 +95,90 @@ class AuthMethod(object):
 
         :param user: The user to refresh.
         :type user: :py:class:`~models.User`
+        :param dict cache: When refreshing many users at once (from the
+            ``sync_users`` command), a :py:class:`dict` shared between all of
+            them, for keeping lookups that are the same for many users.
         :returns: Wether or not the refresh attempt succeeded.
         :rtype: :py:class:`bool`
         """
         return False
 
+    def get_or_create_pilots(self, characters):
+        """Return the :py:class:`~.models.Pilot`\s for the given characters,
+        creating any that do not exist yet.
+
+        The existing pilots are loaded with a single query, and the new ones
+        are added to the session together (so they are inserted in one flush).
+        Nothing is committed.
+
+        :param dict characters: Character names, keyed by their IDs.
+        :rtype: :py:class:`list` of :py:class:`~.models.Pilot`\s
+        """
+        from .models import Pilot
+        characters = dict((int(id_), name) for id_, name in
+                six.iteritems(characters))
+        if not characters:
+            return []
+        pilots = Pilot.query.filter(Pilot.id.in_(list(characters))).all()
+        existing_ids = set(pilot.id for pilot in pilots)
+        new_pilots = [Pilot(None, name, id_) for id_, name in
+                six.iteritems(characters) if id_ not in existing_ids]
+        db.session.add_all(new_pilots)
+        return pilots + new_pilots
+
+    def get_or_create_groups(self, names, group_class=None):
+        """Return the groups from this authentication method with the given
+        names, creating any that do not exist yet.
+
+        Like :py:meth:`get_or_create_pilots`, the existing groups are loaded
+        with a single query and nothing is committed.
+
+        :param names: The names of the groups.
+        :param group_class: The :py:class:`~.models.Group` subclass to look
+            for and create. Defaults to :py:class:`~.models.Group`.
+        :rtype: :py:class:`list` of :py:class:`~.models.Group`\s
+        """
+        if group_class is None:
+            from .models import Group
+            group_class = Group
+        names = set(ensure_unicode(name) for name in names)
+        if not names:
+            return []
+        groups = group_class.query.filter(
+                group_class.authmethod == self.name,
+                group_class.name.in_(names)).all()
+        existing_names = set(group.name for group in groups)
+        new_groups = [group_class(name, self.name) for name in names
+                if name not in existing_names]
+        db.session.add_all(new_groups)
+        return groups + new_groups
+
+    def sync_user(self, user, pilots=None, groups=None):
+        """Update a user's pilots and group memberships, and commit once.
+
+        Pilots no longer in ``pilots`` are removed from the user, and the
+        group memberships are changed with
+        :py:meth:`~.models.User.sync_groups`.
+
+        :param user: The user to update.
+        :type user: :py:class:`~.models.User`
+        :param pilots: The user's current :py:class:`~.models.Pilot`\s (like
+            from :py:meth:`get_or_create_pilots`), or ``None`` to leave them
+            unchanged.
+        :param groups: The user's current :py:class:`~.models.Group`\s (like
+            from :py:meth:`get_or_create_groups`), or ``None`` to leave them
+            unchanged.
+        """
+        if pilots is not None:
+            pilots = set(pilots)
+            for pilot in set(user.pilots) - pilots:
+                pilot.user = None
+            for pilot in pilots:
+                pilot.user = user
+        if groups is not None:
+            user.sync_groups(groups)
+        db.session.commit()
+
 
 class AnonymousUser(flask_login.AnonymousUserMixin):
 
@@ -5,12 +5,11 @@ from sqlalchemy.orm.exc import NoResultFound
 from flask import flash, url_for, redirect, abort, current_app, request
 from hashlib import sha256
 from binascii import unhexlify
-from copy import deepcopy
 
 from .. import db
 from ..util import ensure_unicode
 from . import AuthMethod
-from .models import User, Group, Pilot
+from .models import User, Group
 
 
 class BraveCore(AuthMethod):
@@ -96,27 +95,13 @@ class BraveCore(AuthMethod):
                 db.session.add(user)
             # Apply admin flag
             user.admin = user.name in self.admins
-            # Sync up group membership
-            for group_name in info.tags:
-                try:
-                    group = CoreGroup.query.filter_by(name=group_name,
-                            authmethod=self.name).one()
-                except NoResultFound:
-                    group = CoreGroup(group_name, self.name)
-                    db.session.add(group)
-                user.groups.add(group)
-            user_groups = deepcopy(user.groups)
-            for group in user_groups:
-                if group.name not in info.tags and group in user.groups:
-                    user.groups.remove(group)
             # Sync pilot (just the primary for now)
-            pilot = Pilot.query.get(info.character.id)
-            if not pilot:
-                pilot = Pilot(user, char_name, info.character.id)
-                db.session.add(pilot)
-            else:
+            for pilot in self.get_or_create_pilots(
+                    {info.character.id: char_name}):
                 pilot.user = user
-            db.session.commit()
+            # Sync up group membership, and save everything
+            groups = self.get_or_create_groups(info.tags, CoreGroup)
+            self.sync_user(user, groups=groups)
             self.login_user(user)
             return redirect(url_for('index'))
         else:
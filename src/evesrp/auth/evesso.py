@@ -2,14 +2,18 @@ from __future__ import absolute_import
 
 import xml.etree.ElementTree as ET
 from flask import request, current_app, abort, flash
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.exc import NoResultFound
 from flask_wtf import Form
 from flask_login import current_user
 from oauthlib.oauth2 import OAuth2Error
+from requests.exceptions import RequestException
+import six
 
 from .oauth import OAuthMethod, OAuthUser
 from .. import db
-from .models import Group, Pilot
+from .models import Group
 from ..util.fields import ImageField
 from ..util.crest import check_crest_response
 from ..versioned_static import static_file
@@ -84,56 +88,114 @@ class EveSSO(OAuthMethod):
         # The EVE SSO API only authenticates one character at a time, so we're
         # going to have a 1-to-1 mapping of Users to Pilots
         character = self._get_user_data()
-        pilot = Pilot.query.get(int(character['id']))
-        if pilot is None:
-            pilot = Pilot(None, character['name'], character['id'])
-            db.session.add(pilot)
-            db.session.commit()
-        return [pilot]
+        return self.get_or_create_pilots({character['id']: character['name']})
 
-    def get_groups(self):
-        """Set the user's groups for their pilot.
+    def _character_affiliation(self, character_id):
+        """Look up the corporation and alliance of a character.
 
-        At this time, Eve SSO only gives us character access, so they're just
-        set to the pilot's corporation, and if they have on their alliance as
-        well. In the future, this method may also add groups for mailing lists.
+        :returns: The ``(id, name)`` pairs of the character's corporation and
+            alliance. The alliance is ``None`` if the corporation is not in
+            one.
         """
-        character = self._get_user_data()
         info_url = self.xml_root + 'eve/CharacterInfo.xml.aspx'
         info_response = current_app.requests_session.get(info_url,
-                params={'characterID': character['id']})
+                params={'characterID': character_id})
         api_tree = ET.fromstring(info_response.text).find('result')
         corp_name = api_tree.find('corporation')
         corp_id = api_tree.find('corporationID')
-        corporation = {
-            'name': corp_name.text,
-            'id': int(corp_id.text),
-        }
-        try:
-            corp_group = EveSSOGroup.query.filter_by(alliance=False,
-                    ccp_id=int(corp_id.text),
-                    authmethod=self.name).one()
-        except NoResultFound:
-            corp_group = EveSSOGroup(corp_name.text, int(corp_id.text), False,
-                    self.name)
-            db.session.add(corp_group)
-        groups = [corp_group]
-
+        corporation = (int(corp_id.text), corp_name.text)
         alliance_name = api_tree.find('alliance')
         alliance_id = api_tree.find('allianceID')
-        # If there's an alliance, set it up
         if alliance_name is not None and alliance_id is not None:
-            try:
-                alliance_group = EveSSOGroup.query.filter_by(alliance=True,
-                        ccp_id=int(alliance_id.text),
-                        authmethod=self.name).one()
-            except NoResultFound:
-                alliance_group = EveSSOGroup(alliance_name.text,
-                        int(alliance_id.text), True, self.name)
-                db.session.add(alliance_group)
-            groups.append(alliance_group)
-        db.session.commit()
-        return groups
+            alliance = (int(alliance_id.text), alliance_name.text)
+        else:
+            alliance = None
+        return corporation, alliance
+
+    def _affiliation_groups(self, affiliations, cache=None):
+        # Like get_or_create_groups, the existing groups are loaded with one
+        # query (ccp_id is unique on its own) and nothing is committed.
+        # affiliations is a list of (ccp_id, name, alliance) tuples. The
+        # column values of existing groups are kept in cache (when given,
+        # keyed by (ccp_id, alliance)) so that other users in the same
+        # corporations and alliances do not need to look them up again.
+        if not affiliations:
+            return []
+        existing = {}
+        if cache is not None:
+            for ccp_id, name, alliance in affiliations:
+                values = cache.get((ccp_id, alliance))
+                if values is not None:
+                    existing[(alliance, ccp_id)] = _restore_group(values)
+        missing = set(a[0] for a in affiliations
+                if (a[2], a[0]) not in existing)
+        if missing:
+            groups = EveSSOGroup.query.filter(
+                    EveSSOGroup.authmethod == self.name,
+                    EveSSOGroup.ccp_id.in_(missing)).all()
+            for group in groups:
+                existing[(group.alliance, group.ccp_id)] = group
+                if cache is not None:
+                    mapper = db.inspect(group).mapper
+                    cache[(group.ccp_id, group.alliance)] = dict(
+                            (attr.key, getattr(group, attr.key))
+                            for attr in mapper.column_attrs)
+        affiliation_groups = []
+        for ccp_id, name, alliance in affiliations:
+            group = existing.get((alliance, ccp_id))
+            if group is None:
+                group = EveSSOGroup(name, ccp_id, alliance, self.name)
+                db.session.add(group)
+                existing[(alliance, ccp_id)] = group
+            affiliation_groups.append(group)
+        return affiliation_groups
+
+    def _character_affiliations(self, character_id):
+        corporation, alliance = self._character_affiliation(character_id)
+        affiliations = [(corporation[0], corporation[1], False)]
+        # If there's an alliance, set it up
+        if alliance is not None:
+            affiliations.append((alliance[0], alliance[1], True))
+        return affiliations
+
+    def get_groups(self):
+        """Set the user's groups for their pilot.
+
+        At this time, Eve SSO only gives us character access, so they're just
+        set to the pilot's corporation, and if they have on their alliance as
+        well. In the future, this method may also add groups for mailing lists.
+        """
+        character = self._get_user_data()
+        return self._affiliation_groups(
+                self._character_affiliations(character['id']))
+
+    def refresh_groups(self, user, cache=None):
+        """Set the groups of a user from the corporations and alliances of
+        their pilots.
+
+        The character information is public, so no access token is needed.
+        """
+        affiliations = []
+        try:
+            for pilot in user.pilots:
+                affiliations.extend(self._character_affiliations(pilot.id))
+        except (RequestException, ET.ParseError, AttributeError) as e:
+            current_app.logger.warning(u"Unable to refresh groups for '{}': "
+                                       u"{}".format(user, e))
+            return False
+        user.admin = self.is_admin(user)
+        user.sync_groups(set(self._affiliation_groups(affiliations, cache)))
+        return True
+
+
+def _restore_group(values):
+    # Attach a group to the session from cached column values, as if it had
+    # just been loaded
+    group = db.inspect(EveSSOGroup).class_manager.new_instance()
+    for key, value in six.iteritems(values):
+        set_committed_value(group, key, value)
+    make_transient_to_detached(group)
+    return db.session.merge(group, load=False)
 
 
 class EveSSOUser(OAuthUser):
@@ -4,7 +4,6 @@ from sqlalchemy.orm.exc import NoResultFound
 
 from .. import db
 from .oauth import OAuthMethod, OAuthUser
-from .models import Group, Pilot
 
 
 class J4OAuth(OAuthMethod):
@@ -57,35 +56,15 @@ class J4OAuth(OAuthMethod):
         return user
 
     def get_pilots(self):
-        pilots = []
         resp = self.session.get(self.base_url + 'characters').json()
-        auth_characters = resp[u'characters']
-        for character in auth_characters:
-            pilot = Pilot.query.get(int(character[u'characterID']))
-            if pilot is None:
-                # Pass 'None' as the user, it will get set later
-                pilot = Pilot(None, character[u'characterName'],
-                        character[u'characterID'])
-                db.session.add(pilot)
-            pilots.append(pilot)
-        db.session.commit()
-        return pilots
+        characters = dict((c[u'characterID'], c[u'characterName']) for c in
+                resp[u'characters'])
+        return self.get_or_create_pilots(characters)
 
     def get_groups(self):
-        groups = []
         resp = self.session.get(self.base_url + 'auth_groups').json()
         auth_groups = resp[u'groups']
         # Append the user's alliance to the normal list of groups
-        auth_user = self._get_user_data(token)
+        auth_user = self._get_user_data()
         auth_groups.append(u'{} alliance'.format(auth_user[u'alliance']))
-        # Create/Retrieve Group objects for every group name
-        for group_name in auth_groups:
-            try:
-                group = Group.query.filter_by(name=group_name,
-                        authmethod=self.name).one()
-            except NoResultFound:
-                group = Group(group_name, self.name)
-                db.session.add(group)
-            groups.append(group)
-        db.session.commit()
-        return groups
+        return self.get_or_create_groups(auth_groups)
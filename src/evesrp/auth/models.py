@@ -1,20 +1,25 @@
 from __future__ import absolute_import
 from base64 import urlsafe_b64encode
+from collections import defaultdict
 from itertools import groupby
+import json
 import os
 import pickle
-from flask import url_for
+from flask import current_app, url_for
 import six
 from six.moves import filter
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.event import listens_for
+from sqlalchemy.orm import Session as SessionBase
 from sqlalchemy.orm.collections import attribute_mapped_collection, collection
 
 from .. import db
 from . import AuthMethod, PermissionType
 from ..util import AutoID, Timestamped, AutoName, unistr, ensure_unicode
 from ..models import Action, Modifier, Request
+from ..transformers import from_spec
 
 
 if six.PY3:
@@ -206,6 +211,29 @@ class User(Entity):
                 .where(Permission.entity_id==cls.id)
         return user_permissions.union(group_permissions)
 
+    def division_permissions(self):
+        """Get every permission granted to this user (directly or through
+        their groups) in a single query.
+
+        Useful for checking the permissions for many requests at once, instead
+        of calling :py:meth:`has_permission` for each one.
+
+        :returns: A mapping of division IDs to sets of
+            :py:class:`~.PermissionType`\s.
+        :rtype: dict
+        """
+        groups = db.select([users_groups.c.group_id])\
+                .where(users_groups.c.user_id == self.id).alias()
+        permissions = db.session.query(Permission.division_id,
+                    Permission.permission)\
+                .filter(db.or_(
+                    Permission.entity_id == self.id,
+                    Permission.entity_id.in_(groups)))
+        division_permissions = defaultdict(set)
+        for division_id, permission in permissions:
+            division_permissions[division_id].add(permission)
+        return division_permissions
+
     @property
     def is_authenticated(self):
         """Part of the interface for Flask-Login."""
@@ -243,6 +271,43 @@ class User(Entity):
             choices.append((six.next(group).id, name))
         return choices
 
+    def sync_groups(self, groups):
+        """Make this user a member of exactly the given groups.
+
+        Instead of changing :py:attr:`groups` one group at a time, the
+        memberships are changed with (at most) one ``DELETE`` and one
+        ``INSERT`` on the ``users_groups`` table. :py:attr:`groups` is expired
+        so it is loaded again the next time it is used.
+
+        :param groups: The :py:class:`Group`\s this user should be in.
+        :returns: The IDs of the groups the user was added to and removed
+            from.
+        :rtype: tuple of two :py:class:`set`\s
+        """
+        # Make sure new groups have IDs
+        db.session.flush()
+        group_ids = set(group.id for group in groups)
+        current_ids = set(row.group_id for row in
+                db.session.query(users_groups.c.group_id)\
+                        .filter(users_groups.c.user_id == self.id))
+        added = group_ids - current_ids
+        removed = current_ids - group_ids
+        if removed:
+            db.session.execute(users_groups.delete()\
+                    .where(users_groups.c.user_id == self.id)\
+                    .where(users_groups.c.group_id.in_(removed)))
+        if added:
+            db.session.execute(users_groups.insert(),
+                    [{'user_id': self.id, 'group_id': group_id}
+                        for group_id in added])
+        if added or removed:
+            from .user_cache import user_changed
+            user_changed(db.session, self.id)
+            db.session.expire(self, ['groups'])
+            for group in groups:
+                db.session.expire(group, ['users'])
+        return added, removed
+
     def _json(self, extended=False):
         try:
             parent = super(User, self)._json(extended)
@@ -393,6 +458,31 @@ class Permission(db.Model, AutoID, AutoName):
                "{x.division})").format(x=self)
 
 
+class TransformerSpec(db.TypeDecorator):
+    """Stores :py:class:`~.Transformer`\s as their JSON
+    :py:attr:`~.Transformer.spec`.
+
+    Values pickled by older versions are still read.
+    """
+
+    impl = db.Text
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return json.dumps(value.spec, sort_keys=True, separators=(',', ':'))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, bytes):
+            try:
+                value = value.decode('utf-8')
+            except UnicodeDecodeError:
+                return pickle.loads(value)
+        return from_spec(json.loads(value))
+
+
 class TransformerRef(db.Model, AutoID, AutoName):
     """Stores associations between :py:class:`~.Transformer`\s and
     :py:class:`.Division`\s.
@@ -407,9 +497,7 @@ class TransformerRef(db.Model, AutoID, AutoName):
     attribute_name = db.Column(db.String(50), nullable=False)
 
     #: The transformer instance.
-    # Force pickle protocol to version 2, to support the same DB across Py3 and
-    # Py2.
-    transformer = db.Column(db.PickleType(protocol=2), nullable=True)
+    transformer = db.Column(TransformerSpec, nullable=True)
 
     division_id = db.Column(db.Integer, db.ForeignKey('division.id'),
             nullable=False)
@@ -461,6 +549,28 @@ class Division(db.Model, AutoID, AutoName):
             creator=lambda attr, trans:
                     TransformerRef(attribute_name=attr, transformer=trans))
 
+    #: Incremented every time :py:attr:`transformers` is changed.
+    transformer_generation = db.Column(db.Integer, nullable=False, default=1,
+            server_default='1')
+
+    @property
+    def transformer_map(self):
+        """A plain :py:class:`dict` of :py:attr:`transformers`.
+
+        The map is cached in the application's ``transformer_cache`` for each
+        :py:attr:`transformer_generation` of a division, so the transformers
+        are only loaded again after they have been changed.
+        """
+        if self.id is None:
+            return dict(self.transformers)
+        cache = current_app.transformer_cache
+        key = (self.id, self.transformer_generation)
+        transformers = cache.get(key)
+        if transformers is None:
+            transformers = dict(self.transformers)
+            cache.set(key, transformers)
+        return transformers
+
     @property
     def permissions(self):
         """The permissions objects for this division, mapped via their
@@ -499,3 +609,21 @@ class Division(db.Model, AutoID, AutoName):
                 entities[perm.name] = members
             parent[u'entities'] = entities
         return parent
+
+
+@listens_for(SessionBase, 'before_flush')
+def _increment_transformer_generations(session, flush_context, instances):
+    changed = {}
+    for instance in session.dirty:
+        if isinstance(instance, Division) and \
+                db.inspect(instance).attrs.division_transformers\
+                .history.has_changes():
+            changed[id(instance)] = instance
+    for instance in session.new | session.dirty:
+        if isinstance(instance, TransformerRef) and \
+                instance.division is not None and \
+                instance.division not in session.new:
+            changed[id(instance.division)] = instance.division
+    for division in six.itervalues(changed):
+        division.transformer_generation = \
+                (division.transformer_generation or 0) + 1
@@ -1,6 +1,7 @@
 from __future__ import absolute_import
 import datetime as dt
-from flask import flash, redirect, current_app, url_for, request, session
+from flask import flash, redirect, current_app, url_for, request, session,\
+        has_request_context
 from flask_babel import gettext
 from flask_login import current_user, login_user, login_fresh
 from requests_oauthlib import OAuth2Session
@@ -179,28 +180,11 @@ class OAuthMethod(AuthMethod):
     def _update_user_info(self):
         current_app.logger.debug(
                 "Updating information for '{}' with OAuth".format(current_user))
+        user = current_user._get_current_object()
         # Set the site-wide admin flag
-        current_user.admin = self.is_admin(current_user)
-        # Add new Pilots
-        current_pilots = self.get_pilots()
-        for pilot in current_pilots:
-            pilot.user = current_user
-        # Remove old pilots
-        user_pilots = set(current_user.pilots)
-        for pilot in user_pilots:
-            if pilot not in current_pilots:
-                pilot.user = None
-        # Add new groups
-        current_groups = self.get_groups()
-        for group in current_groups:
-            current_user.groups.add(group)
-        # Remove old groups
-        user_groups = set(current_user.groups)
-        for group in user_groups:
-            if group not in current_groups and group in current_user.groups:
-                current_user.groups.remove(group)
-        # Save all changes
-        db.session.commit()
+        user.admin = self.is_admin(user)
+        # Update pilots and groups, and save all changes
+        self.sync_user(user, self.get_pilots(), self.get_groups())
 
     def get_user(self):
         """Returns the :py:class:`~.OAuthUser` instance for the current token.
@@ -253,13 +237,20 @@ class OAuthMethod(AuthMethod):
         """
         raise NotImplementedError
 
-    def refresh(self, user):
+    def refresh(self, user, cache=None):
         """Refreshes the current user's information.
 
         Attempts to refresh the pilots and groups for the given user. If the
         current access token has expired, the refresh token is used to get a
         new access token.
+
+        Users other than the logged in user (like when run from the
+        ``sync_users`` command) are refreshed with :py:meth:`refresh_groups`
+        instead, as there is no token to use for them.
         """
+        if not has_request_context() or current_user.is_anonymous or \
+                current_user.get_id() != user.get_id():
+            return self.refresh_groups(user, cache)
         try:
             self._update_user_info()
         except OAuth2Error:
@@ -267,6 +258,21 @@ class OAuthMethod(AuthMethod):
         else:
             return True
 
+    def refresh_groups(self, user, cache=None):
+        """Refreshes the groups of a user that is not logged in.
+
+        Implementing classes that can look up a user's groups without an access
+        token should override this method. The default implementation does
+        nothing.
+
+        :param user: The user to refresh.
+        :type user: :py:class:`~.OAuthUser`
+        :param dict cache: The cache given to :py:meth:`refresh`, if any.
+        :returns: Wether or not the user was refreshed.
+        :rtype: :py:class:`bool`
+        """
+        return False
+
     @property
     def session(self):
         if not hasattr(self, '_oauth_session'):
@@ -0,0 +1,85 @@
+"""Refresh every user's information in the background.
+
+Users are normally only refreshed by their :py:class:`~.AuthMethod` when
+they log in, so the groups (and so the permissions) of users who stay logged
+in for a long time can be out of date. :py:func:`sync_users` (run by
+``evesrp -c config.py sync_users``, for example from cron) walks through all
+users in batches and calls :py:meth:`~.AuthMethod.refresh` for each one,
+using a fixed number of threads so that slow lookups overlap.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from collections import Counter
+from functools import partial
+import logging
+from multiprocessing.pool import ThreadPool
+from sqlalchemy.exc import IntegrityError
+
+from .. import db
+from .models import User
+
+
+log = logging.getLogger(__name__)
+
+
+def _refresh_user(app, cache, user_id):
+    user = User.query.get(user_id)
+    if user is None:
+        return 'missing'
+    auth_methods = dict((m.name, m) for m in app.auth_methods)
+    auth_method = auth_methods.get(user.authmethod)
+    if auth_method is None or not auth_method.refresh(user, cache=cache):
+        db.session.rollback()
+        return 'skipped'
+    db.session.commit()
+    return 'refreshed'
+
+
+def _refresh(app, cache, user_id):
+    # Each thread has its own app context, and so its own database session
+    with app.app_context():
+        try:
+            try:
+                return _refresh_user(app, cache, user_id)
+            except IntegrityError:
+                # Another thread created the same new group first, so it is
+                # found the second time.
+                db.session.rollback()
+                return _refresh_user(app, cache, user_id)
+        except Exception:
+            log.exception("Error refreshing user %d.", user_id)
+            db.session.rollback()
+            return 'failed'
+        finally:
+            db.session.remove()
+
+
+def sync_users(app, threads=4, batch_size=100):
+    """Refresh all users, ``batch_size`` at a time, with ``threads``
+    threads.
+
+    This is a generator, yielding a :py:class:`~collections.Counter` of the
+    results so far (``'refreshed'``, ``'skipped'`` or ``'failed'``) after each
+    batch.
+    """
+    pool = ThreadPool(threads)
+    results = Counter()
+    # Shared by every refresh in this run, for lookups that are the same for
+    # many users (like the groups for corporations and alliances)
+    cache = {}
+    last_id = 0
+    try:
+        while True:
+            user_ids = [row.id for row in db.session.query(User.id)\
+                    .filter(User.id > last_id)\
+                    .order_by(User.id)\
+                    .limit(batch_size)]
+            if not user_ids:
+                break
+            results.update(pool.imap_unordered(partial(_refresh, app, cache),
+                    user_ids))
+            last_id = user_ids[-1]
+            yield results
+    finally:
+        pool.close()
+        pool.join()
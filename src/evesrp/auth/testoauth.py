@@ -5,7 +5,7 @@ from sqlalchemy.orm.exc import NoResultFound
 
 from .oauth import OAuthMethod, OAuthUser
 from .. import db
-from .models import Group, Pilot
+from .models import Group
 
 
 class TestOAuth(OAuthMethod):
@@ -89,15 +89,9 @@ class TestOAuth(OAuthMethod):
     def get_pilots(self):
         data = self._get_user_data()
         # The Auth API will duplicate characters when there's more than one API
-        # key for them.
-        pilots = {}
-        for character in data[u'characters']:
-            pilot = Pilot.query.get(int(character[u'id']))
-            if pilot is None:
-                pilot = Pilot(None, character[u'name'], character[u'id'])
-            pilots[character[u'id']] = pilot
-        pilots = list(pilots.values())
-        return pilots
+        # key for them, which are merged here.
+        characters = dict((c[u'id'], c[u'name']) for c in data[u'characters'])
+        return self.get_or_create_pilots(characters)
 
     def get_groups(self):
         data = self._get_user_data()
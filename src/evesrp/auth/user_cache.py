@@ -0,0 +1,136 @@
+"""A short-lived cache of logged in users.
+
+Flask-Login loads the current user on every request, and for most users that
+is a query joining every table of the user's class (like ``entity``,
+``user``, ``o_auth_user`` and ``eve_sso_user`` for :py:class:`~.EveSSOUser`).
+Instead, the column values of each logged in user are kept for
+``SRP_USER_CACHE_TTL`` seconds in each process, and ``current_user`` is
+rebuilt from them without a query. Relationships (like groups and pilots)
+are not cached, they are loaded from the database when used.
+
+Cached values are dropped when the user is changed in this process, and a
+user logging in again starts with fresh values, as the cache is keyed by a
+generation stored in the user's session.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from itertools import chain
+import threading
+import time
+
+from flask import current_app, has_app_context
+import six
+from sqlalchemy import inspect
+from sqlalchemy.event import listens_for
+from sqlalchemy.orm import Session as SessionBase
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+from .. import db
+from ..util import LRUCache
+from .models import User
+
+
+class UserCache(object):
+    """Keeps the column values of recently loaded users.
+
+    :param int maxsize: The most users to keep.
+    :param ttl: How many seconds to keep values for. ``0`` or ``None``
+        disables the cache.
+    """
+
+    def __init__(self, maxsize=1000, ttl=30):
+        self.ttl = ttl
+        self._snapshots = LRUCache(maxsize)
+        # Bumped for a user whenever they change, making older snapshots
+        # invalid.
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def _version(self, user_id):
+        with self._lock:
+            return self._versions.get(user_id, 0)
+
+    def invalidate(self, user_id):
+        """Drop the cached values for a user."""
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def load(self, user_id, generation=0):
+        """Return the :py:class:`~.User` with the given ID, or ``None``.
+
+        :param int user_id: The ID of the user.
+        :param generation: The generation from the user's session.
+        """
+        if not self.ttl:
+            return User.query.get(user_id)
+        key = (user_id, generation)
+        snapshot = self._snapshots.get(key)
+        if snapshot is not None:
+            user_class, values, version, expires = snapshot
+            if expires > time.time() and version == self._version(user_id):
+                return self._restore(user_class, values)
+            self._snapshots.delete(key)
+        # Check the version before loading, so a change made while loading
+        # invalidates what is loaded
+        version = self._version(user_id)
+        user = User.query.get(user_id)
+        if user is not None:
+            mapper = inspect(user).mapper
+            values = dict((attr.key, getattr(user, attr.key)) for attr in
+                    mapper.column_attrs)
+            self._snapshots.set(key, (mapper.class_, values, version,
+                    time.time() + self.ttl))
+        return user
+
+    @staticmethod
+    def _restore(user_class, values):
+        user = inspect(user_class).class_manager.new_instance()
+        for key, value in six.iteritems(values):
+            set_committed_value(user, key, value)
+        # Attach to the session as if it had just been loaded
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+
+def user_changed(session, user_id):
+    """Record that a user has changed in ``session``, so they are dropped
+    from the cache when it is committed. Only needed for changes made without
+    the ORM (like changing the ``users_groups`` table directly).
+    """
+    session.info.setdefault('changed_users', set()).add(user_id)
+
+
+def _invalidate(user_ids):
+    if not user_ids or not has_app_context():
+        return
+    cache = getattr(current_app, 'user_cache', None)
+    if cache is None:
+        return
+    for user_id in user_ids:
+        cache.invalidate(user_id)
+
+
+@listens_for(SessionBase, 'after_flush')
+def _record_changed_users(session, flush_context):
+    # Only column changes matter, as relationships are not cached (adding a
+    # request for a user also marks them as dirty, for example).
+    dirty = (obj for obj in session.dirty
+            if session.is_modified(obj, include_collections=False))
+    user_ids = set(obj.id for obj in chain(dirty, session.deleted)
+            if isinstance(obj, User))
+    if user_ids:
+        session.info.setdefault('changed_users', set()).update(user_ids)
+        # Also drop them now, so this process does not cache the old values
+        # again before the commit.
+        _invalidate(user_ids)
+
+
+@listens_for(SessionBase, 'after_commit')
+def _invalidate_changed_users(session):
+    _invalidate(session.info.pop('changed_users', None))
+
+
+@listens_for(SessionBase, 'after_rollback')
+def _discard_changed_users(session):
+    session.info.pop('changed_users', None)
@@ -24,7 +24,10 @@ SRP_DETAILS_DESCRIPTION = 'Supporting details about your loss.'
 SRP_SKIP_VALIDATION = False
 
 # Add a hash of the files contents to the filename (useful for working around
-# caching issues).
+# caching issues). The hashes are read from static/manifest.json (written by
+# 'python -m evesrp.util.build_static --gzip path/to/static'), or calculated
+# when the app starts if it is missing. Hashed files are sent with headers
+# allowing browsers to cache them forever.
 SRP_STATIC_FILE_HASH = False
 
 # Currently, just show the two English locales until other translations are
@@ -33,4 +36,152 @@ SRP_LOCALES = ['en_US', 'en_GB']
 
 BABEL_DEFAULT_LOCALE = 'en_US'
 
+# Backend used to send request change notifications to every worker process.
+# The default only reaches listeners in the same process, and change streams
+# refuse to start with it when the server runs more than one process. Give an
+# instance dictionary (with a 'type' key) to use something else.
+SRP_BROADCAST_FANOUT = None
+
+# Seconds between keep-alive messages on idle request change streams.
+SRP_STREAM_KEEPALIVE = 15
+
+# Seconds a request change stream is kept open before it is closed and the
+# client has to reconnect.
+SRP_STREAM_LIFETIME = 300
+
+# The maximum number of changed requests returned per call of the
+# /api/requests/changes endpoint.
+SRP_CHANGES_BATCH_SIZE = 500
+
+# Changes more recent than this many seconds are held back from the changes
+# API so that slower, concurrent transactions are not skipped over.
+SRP_CHANGES_SETTLE_SECONDS = 2
+
+# Seconds a payout manifest can be used to mark its requests as paid for.
+SRP_MANIFEST_MAX_AGE = 3600
+
+# The maximum number of request IDs that can be fetched at once from the
+# /api/requests/ endpoint.
+SRP_BATCH_REQUEST_LIMIT = 500
+
+# The number of rows sent in each chunk of a columnar filter listing.
+SRP_COLUMNAR_CHUNK_SIZE = 1000
+
+# The number of rows read from the database at a time when exporting requests.
+SRP_EXPORT_CHUNK_SIZE = 1000
+
+# The number of rendered RSS feeds to keep cached.
+SRP_FEED_CACHE_SIZE = 100
+
+# The number of rows in each batch of a batched data migration.
+SRP_MIGRATION_BATCH_SIZE = 5000
+
+# The number of divisions to keep loaded transformers for.
+SRP_TRANSFORMER_CACHE_SIZE = 256
+
+# The number of rendered template fragments to keep cached in each process.
+SRP_FRAGMENT_CACHE_SIZE = 5000
+
+# An optional cache shared between processes for rendered template fragments.
+# Any object with get(key) and set(key, value, timeout) methods can be used
+# (like the Werkzeug cache classes), or a dict with the import path of the
+# class as 'type' and the rest of the keys as arguments to it.
+SRP_FRAGMENT_CACHE_STORE = None
+
+# Seconds fragments are kept in the shared fragment cache.
+SRP_FRAGMENT_CACHE_TIMEOUT = 86400
+
+# Where compiled templates are cached. True uses a directory in the system's
+# temporary directory, a string is used as the path to a directory, and False
+# disables the cache.
+SRP_TEMPLATE_BYTECODE_CACHE = True
+
+# The key in SQLALCHEMY_BINDS of a read replica of the database. When set,
+# GET requests to the blueprints in SRP_READ_REPLICA_BLUEPRINTS read from the
+# replica.
+SRP_READ_REPLICA_BIND = None
+
+# The names of the blueprints whose GET requests can be served from the read
+# replica.
+SRP_READ_REPLICA_BLUEPRINTS = ['requests', 'api', 'filters']
+
+# Seconds a user's requests keep using the primary database after they have
+# changed something, so they see their own changes.
+SRP_READ_REPLICA_PIN_SECONDS = 10
+
+# Statements taking at least this many seconds are logged along with their
+# EXPLAIN output. None disables logging slow statements.
+SRP_SQL_SLOW_THRESHOLD = 0.5
+
+# Statements with the same shape run at least this many times in one request
+# are logged as possible N+1 queries.
+SRP_SQL_REPEAT_THRESHOLD = 10
+
+# The number of recent requests whose SQL statistics are kept for the
+# /api/debug/sql/ endpoint.
+SRP_SQL_PROFILE_HISTORY = 50
+
+# A token that has to be sent as a bearer token (in an 'Authorization: Bearer'
+# header) to read /metrics without logging in. Administrators can always read
+# it, and only they can when this is None.
+SRP_METRICS_TOKEN = None
+
+# If not empty, the token is only accepted from these addresses. Behind a
+# reverse proxy the address is the proxy's, see the deployment documentation.
+SRP_METRICS_ALLOWED_IPS = []
+
+# A directory shared by all worker processes to combine their metrics in. Each
+# process keeps its own metrics when this is None.
+SRP_METRICS_DIR = None
+
+# The minimum number of seconds between each worker process writing its
+# metrics to SRP_METRICS_DIR.
+SRP_METRICS_FLUSH_INTERVAL = 5
+
+# The default (connect, read) timeouts in seconds for requests to other sites
+# (like zKillboard, ESI and EVE SSO).
+SRP_HTTP_TIMEOUT = (3.05, 15)
+
+# How many times idempotent requests to other sites are retried after a
+# connection error or server error, and the base number of seconds to wait
+# before retrying (doubled for each retry, and randomized).
+SRP_HTTP_RETRIES = 2
+SRP_HTTP_BACKOFF = 0.5
+
+# The number of connections kept open to each host, and the number for
+# specific hosts (given as URL prefixes, like 'https://esi.tech.ccp.is').
+SRP_HTTP_POOL_SIZE = 10
+SRP_HTTP_POOL_SIZES = {}
+
+# After this many failures in a row, requests to a host fail immediately for
+# SRP_HTTP_CIRCUIT_RESET seconds.
+SRP_HTTP_CIRCUIT_THRESHOLD = 5
+SRP_HTTP_CIRCUIT_RESET = 30
+
+# The hosts to track the ESI error limit for. Requests to them are paused
+# (for at most SRP_ESI_MAX_PAUSE seconds, otherwise they fail) once only
+# SRP_ESI_ERROR_LIMIT_FLOOR errors are left before the limit resets.
+SRP_ESI_HOSTS = ['esi.tech.ccp.is', 'esi.evetech.net']
+SRP_ESI_ERROR_LIMIT_FLOOR = 10
+SRP_ESI_MAX_PAUSE = 10
+
+# Verify submitted killmails in the background instead of while the user
+# waits. Requires running 'evesrp -c config.py process_killmails'.
+SRP_ASYNC_KILLMAILS = False
+
+# Killmails that cannot be retrieved are retried up to SRP_KILLMAIL_RETRIES
+# times, waiting about SRP_KILLMAIL_RETRY_DELAY seconds the first time and
+# twice as long each time after that.
+SRP_KILLMAIL_RETRIES = 5
+SRP_KILLMAIL_RETRY_DELAY = 30
+
+# How long a worker has to verify a killmail before another worker tries it.
+SRP_KILLMAIL_CLAIM_SECONDS = 300
+
+# How many seconds each process keeps the details of logged in users for,
+# instead of loading them for every request (0 to always load them), and how
+# many users to keep.
+SRP_USER_CACHE_TTL = 30
+SRP_USER_CACHE_SIZE = 1000
+
 SENTRY_USER_ATTRS = ['name', 'authmethod']
@@ -105,9 +105,17 @@ class Killmail(object):
 
         The name of the constellation where the kill occured.
 
+    .. py:attribute:: constellation_id
+
+        The ID of the constellation where the kill occured.
+
     .. py:attribute:: region
 
         The name of the region where the kill occured.
+
+    .. py:attribute:: region_id
+
+        The ID of the region where the kill occured.
     """
 
     def __init__(self, **kwargs):
@@ -123,7 +131,7 @@ class Killmail(object):
         for attr in ('kill_id', 'ship_id', 'ship', 'pilot_id', 'pilot',
                      'corp_id', 'corp', 'alliance_id', 'alliance', 'verified',
                      'url', 'value', 'timestamp', 'system', 'constellation',
-                     'region', 'system_id'):
+                     'region', 'system_id', 'constellation_id', 'region_id'):
             try:
                 setattr(self, attr, kwargs[attr])
             except KeyError:
@@ -177,6 +185,12 @@ class Killmail(object):
         yield ('constellation', self.constellation)
         yield ('region', self.region)
         yield ('pilot_id', self.pilot_id)
+        yield ('ship_type_id', self.ship_id)
+        yield ('corporation_id', self.corp_id)
+        yield ('alliance_id', self.alliance_id)
+        yield ('system_id', self.system_id)
+        yield ('constellation_id', self.constellation_id)
+        yield ('region_id', self.region_id)
 
 
     # TRANS: This is a description of the killmail processor. This specific
@@ -229,6 +243,18 @@ class LocationMixin(object):
         region_id = systems.constellations_regions[constellation_id]
         return systems.region_names[region_id]
 
+    @property
+    def constellation_id(self):
+        """Provides the constellation ID using :py:attr:`Killmail.system_id`.
+        """
+        return systems.systems_constellations[self.system_id]
+
+    @property
+    def region_id(self):
+        """Provides the region ID using :py:attr:`Killmail.system_id`.
+        """
+        return systems.constellations_regions[self.constellation_id]
+
 
 class RequestsSessionMixin(object):
     """Mixin for providing a :py:class:`requests.Session`.
@@ -0,0 +1,137 @@
+"""Helpers for data migrations over large tables.
+
+Instead of one large ``UPDATE`` in a single transaction, rows are processed in
+ranges of primary keys holding a fixed number of rows each, with the work for
+each range committed along with a checkpoint. If a migration is interrupted, running it again continues after
+the last committed range::
+
+    from evesrp.migrate.batch import run_batched
+
+    def fill_payout(bind, start, end):
+        return bind.execute(update(request)\\
+                .where(request.c.id >= start)\\
+                .where(request.c.id < end)\\
+                .where(request.c.payout == None)\\
+                .values(payout=request.c.base_payout)).rowcount
+
+    with engine.connect() as conn:
+        run_batched(conn, 'fill-payout', request, fill_payout)
+
+Each batch is committed in its own transaction, so the connection must not
+already be in one. Long running data migrations are best run as management
+commands (like ``recompute_payouts``) instead of from an Alembic revision, as
+Alembic runs revisions inside a transaction on databases with transactional
+DDL.
+"""
+from __future__ import absolute_import
+from __future__ import division
+import datetime as dt
+import logging
+import time
+
+from flask import current_app
+import sqlalchemy as sa
+
+
+log = logging.getLogger(__name__)
+
+
+checkpoints = sa.Table('migration_checkpoint', sa.MetaData(),
+        sa.Column('name', sa.String(128), primary_key=True),
+        sa.Column('last_key', sa.BigInteger, nullable=False),
+        sa.Column('rows', sa.BigInteger, nullable=False, default=0),
+        sa.Column('updated', sa.DateTime, nullable=False),
+)
+
+
+def _load_checkpoint(bind, name):
+    row = bind.execute(sa.select([checkpoints.c.last_key, checkpoints.c.rows])\
+            .where(checkpoints.c.name == name)).first()
+    if row is None:
+        return None, 0
+    return row
+
+
+def _save_checkpoint(bind, name, last_key, rows, existing):
+    values = dict(last_key=last_key, rows=rows, updated=dt.datetime.utcnow())
+    if existing:
+        bind.execute(checkpoints.update()\
+                .where(checkpoints.c.name == name).values(**values))
+    else:
+        bind.execute(checkpoints.insert().values(name=name, **values))
+
+
+def run_batched(bind, name, table, process, batch_size=None, key='id'):
+    """Call ``process`` over ranges of the primary key of ``table``, each
+    with up to ``batch_size`` rows.
+
+    ``process(bind, start, end)`` should do the work for the rows with keys
+    from ``start`` (inclusive) to ``end`` (exclusive), and return the number
+    of rows processed (or ``None``). After each range the work done and the
+    checkpoint for ``name`` are committed. Once every range has been processed
+    the checkpoint is removed, so ``name`` only needs to be unique among the
+    batched migrations that could be interrupted at the same time.
+
+    The end of each range is found from the keys themselves (the key after
+    the next ``batch_size`` rows), so sparse keys do not lead to empty
+    ranges.
+
+    :param bind: The connection to use, usually ``op.get_bind()``.
+    :param str name: Identifies this migration in the checkpoint table.
+    :param table: The :py:class:`~sqlalchemy.schema.Table` (or
+        :py:func:`~sqlalchemy.sql.expression.table`) to process.
+    :param process: The function doing the work for each range.
+    :param int batch_size: The number of rows in each range. Defaults to the
+        ``SRP_MIGRATION_BATCH_SIZE`` config value.
+    :param str key: The name of the integer primary key column.
+    :returns: The number of rows processed.
+    :rtype: int
+    :raises RuntimeError: If ``bind`` is already in a transaction, as the
+        batches could not be committed separately.
+    """
+    if bind.in_transaction():
+        raise RuntimeError(u"Batched migrations commit each batch, and cannot"
+                           u" be run inside another transaction.")
+    if batch_size is None:
+        batch_size = current_app.config['SRP_MIGRATION_BATCH_SIZE']
+    key_column = table.c[key]
+    checkpoints.create(bind, checkfirst=True)
+    last_key, rows = _load_checkpoint(bind, name)
+    resumed = last_key is not None
+    low, high = bind.execute(sa.select([sa.func.min(key_column),
+            sa.func.max(key_column)])).first()
+    if low is None:
+        log.info(u"%s: no rows to process.", name)
+        return 0
+    if resumed:
+        log.info(u"%s: resuming after %s (%d rows already done).", name,
+                last_key, rows)
+        start = last_key + 1
+    else:
+        start = low
+    started = time.time()
+    processed = 0
+    while start <= high:
+        # The last key in this batch, found by skipping over the keys in it
+        last = bind.execute(sa.select([key_column])\
+                .where(key_column >= start)\
+                .where(key_column <= high)\
+                .order_by(key_column)\
+                .limit(1)\
+                .offset(batch_size - 1)).scalar()
+        end = (high if last is None else last) + 1
+        with bind.begin():
+            count = process(bind, start, end)
+            if count is not None:
+                processed += count
+            _save_checkpoint(bind, name, end - 1, rows + processed, resumed)
+        resumed = True
+        elapsed = time.time() - started
+        log.info(u"%s: processed keys up to %d of %d (%d rows, %.0f rows/s).",
+                name, min(end - 1, high), high, rows + processed,
+                processed / elapsed if elapsed else 0)
+        if last is None:
+            break
+        start = end
+    bind.execute(checkpoints.delete().where(checkpoints.c.name == name))
+    return rows + processed
@@ -0,0 +1,54 @@
+"""Add integer ID columns for the ship, location and organizations of requests
+
+The new columns are filled in for existing requests by running
+'evesrp -c config.py backfill_ids', which can be run (and resumed) after the
+upgrade.
+
+Revision ID: 1d9a6c3e8f25
+Revises: 5c8e1f0a7b42
+Create Date: 2026-10-19 18:12:44.093610
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1d9a6c3e8f25'
+down_revision = '5c8e1f0a7b42'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# Columns to add, and the table they reference (if any)
+columns = (
+    ('ship_type_id', None),
+    ('system_id', None),
+    ('constellation_id', None),
+    ('region_id', None),
+    ('corporation_id', 'corporation'),
+    ('alliance_id', 'alliance'),
+)
+
+
+def upgrade():
+    for table in ('corporation', 'alliance'):
+        op.create_table(table,
+                sa.Column('id', sa.Integer(), nullable=False),
+                sa.Column('name', sa.String(length=150), nullable=False),
+                sa.PrimaryKeyConstraint('id'))
+    for column, foreign_table in columns:
+        args = []
+        if foreign_table is not None:
+            args.append(sa.ForeignKey(foreign_table + '.id'))
+        op.add_column('request', sa.Column(column, sa.Integer(), *args,
+                nullable=True))
+        op.create_index(op.f('ix_request_{}'.format(column)), 'request',
+                [column], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('request') as batch_op:
+        for column, _ in reversed(columns):
+            batch_op.drop_index('ix_request_{}'.format(column))
+            batch_op.drop_column(column)
+    op.drop_table('alliance')
+    op.drop_table('corporation')
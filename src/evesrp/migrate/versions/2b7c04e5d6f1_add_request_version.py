@@ -0,0 +1,24 @@
+"""Add a version counter to requests
+
+Revision ID: 2b7c04e5d6f1
+Revises: 4a1e2c7b9d30
+Create Date: 2026-10-19 14:03:26.518840
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2b7c04e5d6f1'
+down_revision = '4a1e2c7b9d30'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('request',
+            sa.Column('version', sa.Integer(), nullable=False,
+                server_default='1'))
+
+
+def downgrade():
+    op.drop_column('request', 'version')
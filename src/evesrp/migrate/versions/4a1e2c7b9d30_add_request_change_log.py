@@ -0,0 +1,70 @@
+"""Add a change log for requests
+
+Revision ID: 4a1e2c7b9d30
+Revises: 3f453bb4f2d7
+Create Date: 2026-10-19 10:12:41.302212
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4a1e2c7b9d30'
+down_revision = '3f453bb4f2d7'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.sql import select, table, column
+
+
+request = table('request',
+        column('id', sa.Integer),
+        column('division_id', sa.Integer),
+        column('submitter_id', sa.Integer))
+
+
+request_change = table('request_change',
+        column('id', sa.Integer),
+        column('request_id', sa.Integer),
+        column('division_id', sa.Integer),
+        column('submitter_id', sa.Integer),
+        column('deleted', sa.Boolean),
+        column('timestamp', sa.DateTime))
+
+
+def upgrade():
+    op.create_table('request_change',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('request_id', sa.Integer(), nullable=False),
+            sa.Column('division_id', sa.Integer(), nullable=False),
+            sa.Column('submitter_id', sa.Integer(), nullable=True),
+            sa.Column('deleted', sa.Boolean(name='deleted'), nullable=False),
+            sa.Column('timestamp', sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint('id', name=op.f('pk_request_change')))
+    op.create_index(op.f('ix_request_change_request_id'), 'request_change',
+            ['request_id'], unique=False)
+    op.create_index(op.f('ix_request_change_division_id'), 'request_change',
+            ['division_id'], unique=False)
+    op.create_index(op.f('ix_request_change_submitter_id'), 'request_change',
+            ['submitter_id'], unique=False)
+    # Seed the log with every existing request so that clients can do an
+    # initial sync starting from 0.
+    existing = select([
+                request.c.id,
+                request.c.division_id,
+                request.c.submitter_id,
+                sa.literal(False),
+                sa.func.current_timestamp()])\
+            .order_by(request.c.id)
+    op.execute(request_change.insert().from_select(
+            ['request_id', 'division_id', 'submitter_id', 'deleted',
+                'timestamp'],
+            existing))
+
+
+def downgrade():
+    op.drop_index(op.f('ix_request_change_submitter_id'),
+            table_name='request_change')
+    op.drop_index(op.f('ix_request_change_division_id'),
+            table_name='request_change')
+    op.drop_index(op.f('ix_request_change_request_id'),
+            table_name='request_change')
+    op.drop_table('request_change')
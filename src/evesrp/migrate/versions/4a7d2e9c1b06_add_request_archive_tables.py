@@ -0,0 +1,75 @@
+"""Add archive tables for finalized requests
+
+The archive tables mirror the columns of the request, action and modifier
+tables. Requests are moved into them with 'evesrp -c config.py archive'.
+
+Revision ID: 4a7d2e9c1b06
+Revises: 1d9a6c3e8f25
+Create Date: 2026-10-19 19:36:20.518832
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4a7d2e9c1b06'
+down_revision = '1d9a6c3e8f25'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.types import SchemaType
+
+
+# The tables to archive, in the order they have to be created.
+archive_names = (
+    ('request', 'request_archive'),
+    ('action', 'action_archive'),
+    ('modifier', 'modifier_archive'),
+    ('absolute_modifier', 'absolute_modifier_archive'),
+    ('relative_modifier', 'relative_modifier_archive'),
+)
+
+
+indexes = {
+    'request_archive': ('division_id', 'submitter_id', 'pilot_id', 'status',
+            'timestamp', 'kill_timestamp'),
+    'action_archive': ('request_id',),
+    'modifier_archive': ('request_id',),
+}
+
+
+def upgrade():
+    conn = op.get_bind()
+    renamed = dict(archive_names)
+    metadata = sa.MetaData()
+    for name, archive_name in archive_names:
+        # Copy the current columns of the table, pointing foreign keys at the
+        # other archive tables where needed.
+        table = sa.Table(name, metadata, autoload=True,
+                autoload_with=conn)
+        columns = []
+        for column in table.columns:
+            foreign_keys = []
+            for foreign_key in column.foreign_keys:
+                target_table, target_column = foreign_key.target_fullname\
+                        .split('.')
+                target_table = renamed.get(target_table, target_table)
+                foreign_keys.append(sa.ForeignKey(
+                        target_table + '.' + target_column))
+            column_type = column.type
+            if isinstance(column_type, SchemaType):
+                column_type = column_type.copy()
+            columns.append(sa.Column(column.name, column_type, *foreign_keys,
+                    primary_key=column.primary_key,
+                    nullable=column.nullable))
+        archive = sa.Table(archive_name, metadata, *columns)
+        archive.create(conn, checkfirst=True)
+        for column in indexes.get(archive_name, ()):
+            op.create_index(op.f('ix_{}_{}'.format(archive_name, column)),
+                    archive_name, [column], unique=False)
+    if conn.dialect.name == 'mysql':
+        op.execute('CREATE FULLTEXT INDEX ix_request_archive_details_fulltext '
+                   'ON request_archive (details);')
+
+
+def downgrade():
+    for _, archive_name in reversed(archive_names):
+        op.drop_table(archive_name)
@@ -0,0 +1,73 @@
+"""Store transformers as JSON and add division transformer generations
+
+Revision ID: 5c8e1f0a7b42
+Revises: 2b7c04e5d6f1
+Create Date: 2026-10-19 16:41:07.203915
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5c8e1f0a7b42'
+down_revision = '2b7c04e5d6f1'
+
+import json
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.sql import table, column, update, select
+
+from evesrp.transformers import from_spec
+
+
+transformerref = table('transformerref',
+        column('id', sa.Integer),
+        column('transformer', sa.PickleType(protocol=2)),
+        column('transformer_spec', sa.Text),
+)
+
+
+def upgrade():
+    op.add_column('division',
+            sa.Column('transformer_generation', sa.Integer(), nullable=False,
+                server_default='1'))
+    op.add_column('transformerref',
+            sa.Column('transformer_spec', sa.Text(), nullable=True))
+    conn = op.get_bind()
+    rows = conn.execute(select([transformerref.c.id,
+            transformerref.c.transformer]))
+    for ref_id, transformer in rows.fetchall():
+        if transformer is None:
+            continue
+        spec = json.dumps(transformer.spec, sort_keys=True,
+                separators=(',', ':'))
+        conn.execute(update(transformerref)\
+                .where(transformerref.c.id == ref_id)\
+                .values(transformer_spec=spec))
+    with op.batch_alter_table('transformerref') as batch_op:
+        batch_op.drop_column('transformer')
+        batch_op.alter_column('transformer_spec',
+                new_column_name='transformer', existing_type=sa.Text())
+
+
+def downgrade():
+    op.add_column('transformerref',
+            sa.Column('transformer_pickle', sa.PickleType(protocol=2),
+                nullable=True))
+    conn = op.get_bind()
+    pickled = table('transformerref',
+            column('id', sa.Integer),
+            column('transformer', sa.Text),
+            column('transformer_pickle', sa.PickleType(protocol=2)),
+    )
+    rows = conn.execute(select([pickled.c.id, pickled.c.transformer]))
+    for ref_id, spec in rows.fetchall():
+        if spec is None:
+            continue
+        conn.execute(update(pickled)\
+                .where(pickled.c.id == ref_id)\
+                .values(transformer_pickle=from_spec(json.loads(spec))))
+    with op.batch_alter_table('transformerref') as batch_op:
+        batch_op.drop_column('transformer')
+        batch_op.alter_column('transformer_pickle',
+                new_column_name='transformer',
+                existing_type=sa.PickleType(protocol=2))
+    op.drop_column('division', 'transformer_generation')
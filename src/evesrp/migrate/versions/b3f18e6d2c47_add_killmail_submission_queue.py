@@ -0,0 +1,50 @@
+"""Add a queue of killmails to verify in the background
+
+Revision ID: b3f18e6d2c47
+Revises: 4a7d2e9c1b06
+Create Date: 2026-10-19 21:04:52.174390
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b3f18e6d2c47'
+down_revision = '4a7d2e9c1b06'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('killmailsubmission',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('submitter_id', sa.Integer(), nullable=False),
+            sa.Column('division_id', sa.Integer(), nullable=False),
+            sa.Column('url', sa.String(length=512), nullable=False),
+            sa.Column('details', sa.Text(), nullable=True),
+            sa.Column('status', sa.Enum('verifying', 'failed', 'submitted',
+                    name='ck_submission_status'), nullable=False),
+            sa.Column('attempts', sa.Integer(), nullable=False),
+            sa.Column('next_attempt', sa.DateTime(), nullable=False),
+            sa.Column('last_error', sa.Text(), nullable=True),
+            sa.Column('request_id', sa.Integer(), nullable=True),
+            sa.Column('timestamp', sa.DateTime(), nullable=False),
+            sa.ForeignKeyConstraint(['submitter_id'], ['user.id'],
+                    name=op.f('fk_killmailsubmission_submitter_id_user_id')),
+            sa.ForeignKeyConstraint(['division_id'], ['division.id'],
+                    name=op.f(
+                        'fk_killmailsubmission_division_id_division_id')),
+            sa.PrimaryKeyConstraint('id',
+                    name=op.f('pk_killmailsubmission')))
+    op.create_index(op.f('ix_killmailsubmission_submitter_id'),
+            'killmailsubmission', ['submitter_id'], unique=False)
+    op.create_index(op.f('ix_killmailsubmission_next_attempt'),
+            'killmailsubmission', ['next_attempt'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_killmailsubmission_next_attempt'),
+            table_name='killmailsubmission')
+    op.drop_index(op.f('ix_killmailsubmission_submitter_id'),
+            table_name='killmailsubmission')
+    op.drop_table('killmailsubmission')
+    sa.Enum(name='ck_submission_status').drop(op.get_bind(), checkfirst=True)
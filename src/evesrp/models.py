@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 import datetime as dt
+from collections import defaultdict, OrderedDict
 from decimal import Decimal
 import six
 from six.moves import filter, map, range
@@ -7,15 +8,22 @@ from sqlalchemy import event
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.event import listens_for
+from sqlalchemy.orm import Session as SessionBase
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.schema import DDL, DropIndex
-from flask import Markup, current_app, url_for
+from sqlalchemy.types import SchemaType
+from flask import Markup, current_app, url_for, has_app_context
 from flask_babel import gettext, lazy_gettext
 from flask_login import current_user
 
 from . import db
+from .util import metrics
 from .util import DeclEnum, classproperty, AutoID, Timestamped, AutoName,\
-        unistr, ensure_unicode, PrettyDecimal, PrettyNumeric, DateTime
+        unistr, ensure_unicode, PrettyDecimal, PrettyNumeric, DateTime, utc
 from .auth import PermissionType
+from .ships import ships
+from . import systems
 
 
 if six.PY3:
@@ -351,6 +359,121 @@ class RelativeModifier(Modifier):
         return parent
 
 
+class _Organization(AutoID, AutoName):
+
+    #: The name of the organization.
+    name = db.Column(db.String(150, convert_unicode=True), nullable=False)
+
+    def __repr__(self):
+        return "{x.__class__.__name__}(id={x.id}, name='{x.name}')".format(
+                x=self)
+
+    def __unicode__(self):
+        return self.name
+
+    @classmethod
+    def lookup(cls, id_, name):
+        """Get the instance with the given CCP-given ID, creating it (or
+        updating its name) as needed.
+        """
+        instance = cls.query.get(id_)
+        if instance is None:
+            instance = cls(id=id_, name=ensure_unicode(name))
+            db.session.add(instance)
+        elif name is not None and instance.name != name:
+            instance.name = ensure_unicode(name)
+        return instance
+
+
+@unistr
+class Corporation(db.Model, _Organization):
+    """A corporation the :py:class:`~.Pilot` of a :py:class:`Request` was in
+    at the time of the killmail.
+    """
+
+
+@unistr
+class Alliance(db.Model, _Organization):
+    """An alliance the :py:class:`~.Pilot` of a :py:class:`Request` was in at
+    the time of the killmail.
+    """
+
+
+class _StaticNames(object):
+    # Resolves names and IDs using a NameLookup from the static data
+
+    def __init__(self, lookup):
+        self.lookup = lookup
+
+    def resolve(self, names):
+        resolved = {}
+        for name in names:
+            id_ = self.lookup.id_for(name)
+            if id_ is not None:
+                resolved[name] = id_
+        return resolved
+
+    def clause(self, id_column, column, names):
+        # Requests with an ID are compared by ID where the name is in the
+        # static data. Requests without one (like those not backfilled yet)
+        # and names not in the static data are compared as strings.
+        resolved = self.resolve(names)
+        clauses = [db.and_(id_column == None, column.in_(names))]
+        if resolved:
+            clauses.append(db.and_(id_column != None,
+                    id_column.in_(set(six.itervalues(resolved)))))
+        unresolved = set(names).difference(resolved)
+        if unresolved:
+            clauses.append(column.in_(unresolved))
+        return db.or_(*clauses)
+
+    def names(self, id_column, column):
+        names = set()
+        unknown = set()
+        for id_, in db.session.query(id_column).filter(id_column != None)\
+                .distinct():
+            name = self.lookup.name_for(id_)
+            if name is None:
+                unknown.add(id_)
+            else:
+                names.add(name)
+        if unknown:
+            query = db.session.query(column)\
+                    .filter(id_column.in_(unknown)).distinct()
+            names.update(name for name, in query)
+        return names
+
+
+class _DimensionNames(object):
+    # Resolves names and IDs using the Corporation or Alliance table
+
+    def __init__(self, model):
+        self.model = model
+
+    def resolve(self, names):
+        return dict(db.session.query(self.model.name, self.model.id)\
+                .filter(self.model.name.in_(names)))
+
+    def clause(self, id_column, column, names):
+        # Organizations are only added as new requests are submitted, so
+        # requests without an ID are compared by name.
+        ids = db.session.query(self.model.id)\
+                .filter(self.model.name.in_(names)).subquery()
+        return db.or_(db.and_(id_column != None, id_column.in_(ids)),
+                db.and_(id_column == None, column.in_(names)))
+
+    def names(self, id_column, column):
+        used = db.session.query(id_column).filter(id_column != None)\
+                .distinct().subquery()
+        query = db.session.query(self.model.name)\
+                .filter(self.model.id.in_(used))
+        return set(name for name, in query)
+
+
+_transformed_link = Markup(u'<a href="{link}" target="_blank">{value} '
+        u'<i class="fa fa-external-link"></i></a>')
+
+
 class Request(db.Model, AutoID, Timestamped, AutoName):
     """Requests represent SRP requests."""
 
@@ -382,6 +505,20 @@ class Request(db.Model, AutoID, Timestamped, AutoName):
             cascade='all,delete-orphan',
             lazy='dynamic', order_by='desc(Modifier.timestamp)')
 
+    #: The same :py:class:`Modifier`\s as :py:attr:`modifiers`, but as a
+    #: plain list so that it can be eagerly loaded. This relationship is read
+    #: only.
+    all_modifiers = db.relationship('Modifier', viewonly=True,
+            order_by='desc(Modifier.timestamp)')
+
+    #: The :py:class:`Modifier`\s on this request that have not been voided,
+    #: sorted in the order they were added. This relationship is read only.
+    active_modifiers = db.relationship('Modifier', viewonly=True,
+            primaryjoin='and_(Request.id == Modifier.request_id, '
+                        'or_(Modifier.voided_user_id == None, '
+                        'Modifier.voided_timestamp == None))',
+            order_by='desc(Modifier.timestamp)')
+
     #: The URL of the source killmail.
     killmail_url = db.Column(db.String(512, convert_unicode=True),
             nullable=False)
@@ -397,14 +534,29 @@ class Request(db.Model, AutoID, Timestamped, AutoName):
     corporation = db.Column(db.String(150, convert_unicode=True),
             nullable=False, index=True)
 
+    #: The ID of the :py:class:`Corporation` for :py:attr:`corporation`.
+    corporation_id = db.Column(db.Integer, db.ForeignKey('corporation.id'),
+            nullable=True, index=True)
+
+    corporation_ref = db.relationship(Corporation)
+
     #: The alliance of the :py:attr:`pilot` at the time of the killmail.
     alliance = db.Column(db.String(150, convert_unicode=True), nullable=True,
             index=True)
 
+    #: The ID of the :py:class:`Alliance` for :py:attr:`alliance`.
+    alliance_id = db.Column(db.Integer, db.ForeignKey('alliance.id'),
+            nullable=True, index=True)
+
+    alliance_ref = db.relationship(Alliance)
+
     #: The type of ship that was destroyed.
     ship_type = db.Column(db.String(75, convert_unicode=True), nullable=False,
             index=True)
 
+    #: The typeID of :py:attr:`ship_type`.
+    ship_type_id = db.Column(db.Integer, nullable=True, index=True)
+
     # TODO: include timezones
     #: The date and time of when the ship was destroyed.
     kill_timestamp = db.Column(DateTime, nullable=False, index=True)
@@ -478,6 +630,77 @@ class Request(db.Model, AutoID, Timestamped, AutoName):
     region = db.Column(db.String(25, convert_unicode=True), nullable=False,
             index=True)
 
+    #: The ID of :py:attr:`system`.
+    system_id = db.Column(db.Integer, nullable=True, index=True)
+
+    #: The ID of :py:attr:`constellation`.
+    constellation_id = db.Column(db.Integer, nullable=True, index=True)
+
+    #: The ID of :py:attr:`region`.
+    region_id = db.Column(db.Integer, nullable=True, index=True)
+
+    #: Incremented every time this request (or one of its :py:class:`Action`\s
+    #: or :py:class:`Modifier`\s) is changed. Used as part of the key for
+    #: cached fragments of templates showing this request.
+    version = db.Column(db.Integer, nullable=False, default=1,
+            server_default='1')
+
+    #: True for requests loaded from the archive tables by
+    #: :py:func:`load_archived_request`. They are read only until restored.
+    archived = False
+
+    @classmethod
+    def name_clause(cls, attr, names):
+        """Create a clause matching requests where the string attribute
+        ``attr`` is one of ``names``.
+
+        For the attributes with an ID column, the names are resolved to IDs
+        (using the static data, or the :py:class:`Corporation` and
+        :py:class:`Alliance` tables) and the IDs are compared instead. Names
+        that cannot be resolved are still compared as strings. Requests made
+        before the ID columns were added need to have their IDs filled in
+        with the ``backfill_ids`` management command to be matched by the
+        static data names.
+        """
+        column = getattr(cls, attr)
+        try:
+            id_column, resolver = cls._id_columns[attr]
+        except KeyError:
+            return column.in_(names)
+        return resolver.clause(getattr(cls, id_column), column, names)
+
+    @classmethod
+    def distinct_names(cls, attr):
+        """Get the set of distinct values of the string attribute ``attr``.
+
+        As with :py:meth:`name_clause`, the ID columns are used where
+        possible.
+        """
+        column = getattr(cls, attr)
+        try:
+            id_column, resolver = cls._id_columns[attr]
+        except KeyError:
+            return set(value for value, in
+                    db.session.query(column).distinct())
+        id_column = getattr(cls, id_column)
+        names = resolver.names(id_column, column)
+        unresolved = db.session.query(column).filter(id_column == None)\
+                .distinct()
+        names.update(value for value, in unresolved)
+        return names
+
+    #: Maps string attributes to the name of their ID column and an object
+    #: resolving names to IDs.
+    _id_columns = {
+        'ship_type': ('ship_type_id', _StaticNames(ships)),
+        'system': ('system_id', _StaticNames(systems.system_names)),
+        'constellation': ('constellation_id',
+                _StaticNames(systems.constellation_names)),
+        'region': ('region_id', _StaticNames(systems.region_names)),
+        'corporation': ('corporation_id', _DimensionNames(Corporation)),
+        'alliance': ('alliance_id', _DimensionNames(Alliance)),
+    }
+
     @hybrid_property
     def finalized(self):
         return self.status in ActionType.finalized
@@ -507,10 +730,22 @@ class Request(db.Model, AutoID, Timestamped, AutoName):
             # of Request attributes and values for those attributes
             for attr, value in killmail:
                 setattr(self, attr, value)
+            if self.corporation_id is not None:
+                self.corporation_ref = Corporation.lookup(self.corporation_id,
+                        self.corporation)
+            if self.alliance_id is not None:
+                self.alliance_ref = Alliance.lookup(self.alliance_id,
+                        self.alliance)
             # Set default values before a flush
             if self.base_payout is None and 'base_payout' not in kwargs:
                 self.base_payout = Decimal(0)
         super(Request, self).__init__(**kwargs)
+        # Fill in any IDs the killmail did not provide from the static data
+        for attr, (id_attr, resolver) in six.iteritems(self._id_columns):
+            name = getattr(self, attr)
+            if getattr(self, id_attr) is None and name is not None and \
+                    isinstance(resolver, _StaticNames):
+                setattr(self, id_attr, resolver.lookup.id_for(name))
 
     @db.validates('base_payout')
     def _validate_payout(self, attr, value):
@@ -563,9 +798,20 @@ class Request(db.Model, AutoID, Timestamped, AutoName):
         },
     }
 
-    def valid_actions(self, user):
-        """Get valid actions (besides comment) the given user can perform."""
+    def valid_actions(self, user, permissions=None):
+        """Get valid actions (besides comment) the given user can perform.
+
+        :param user: The user to check.
+        :param dict permissions: The user's permissions, from
+            :py:meth:`~.User.division_permissions`. When listing many requests
+            this saves checking the permissions for each one.
+        """
         possible_actions = self.state_rules[self.status]
+        if permissions is not None:
+            division_permissions = permissions.get(self.division_id, set())
+            return [action for action in possible_actions if
+                    division_permissions.intersection(
+                        possible_actions[action])]
         def action_filter(action):
             return user.has_permission(possible_actions[action],
                     self.division)
@@ -653,22 +899,20 @@ class Request(db.Model, AutoID, Timestamped, AutoName):
         class RequestTransformer(object):
             def __init__(self, request):
                 self._request = request
+                self._transformers = request.division.transformer_map
 
             def __getattr__(self, attr):
                 raw_value = getattr(self._request, attr)
-                if attr in self._request.division.transformers:
-                    transformer = self._request.division.transformers[attr]
-                    return Markup(u'<a href="{link}" target="_blank">'
-                                  u'{value} <i class="fa fa-external-link">'
-                                  u'</i></a>').format(
-                                        link=transformer(raw_value),
-                                        value=str(raw_value))
+                transformer = self._transformers.get(attr)
+                if transformer is not None:
+                    return _transformed_link.format(
+                            link=transformer(raw_value),
+                            value=six.text_type(raw_value))
                 else:
                     return raw_value
 
             def __iter__(self):
-                for attr, transformer in\
-                        self._request.division.transformers.items():
+                for attr, transformer in six.iteritems(self._transformers):
                     if attr == 'ship_type':
                         yield ('ship', transformer(getattr(self._request,
                                 attr)))
@@ -677,35 +921,180 @@ class Request(db.Model, AutoID, Timestamped, AutoName):
 
         return RequestTransformer(self)
 
-    def _json(self, extended=False):
+    #: Maps the keys in the output of :py:meth:`_json` to the attributes
+    #: they are created from.
+    json_attributes = {
+        u'id': u'id',
+        u'href': u'id',
+        u'killmail_url': u'killmail_url',
+        u'kill_timestamp': u'kill_timestamp',
+        u'pilot': u'pilot',
+        u'alliance': u'alliance',
+        u'corporation': u'corporation',
+        u'submitter': u'submitter',
+        u'division': u'division',
+        u'status': u'status',
+        u'base_payout': u'base_payout',
+        u'payout': u'payout',
+        u'details': u'details',
+        u'ship': u'ship_type',
+        u'system': u'system',
+        u'constellation': u'constellation',
+        u'region': u'region',
+        u'submit_timestamp': u'timestamp',
+    }
+
+    #: The keys only present in the extended output of :py:meth:`_json`.
+    json_extended_keys = frozenset((u'actions', u'modifiers', u'valid_actions',
+                                    u'transformed'))
+
+    def _json(self, extended=False, fields=None, permissions=None):
+        """Create a JSON-ready representation of this request.
+
+        :param bool extended: Include actions, modifiers, valid actions and
+            transformed attributes.
+        :param fields: If given, only these keys (and ``id``) are included.
+            Attributes that are not needed are never accessed, so they do not
+            need to be loaded.
+        :type fields: set or None
+        :param dict permissions: The current user's permissions, passed on to
+            :py:meth:`valid_actions`.
+        """
         try:
             parent = super(Request, self)._json(extended)
         except AttributeError:
             parent = {}
-        parent[u'href'] = url_for('requests.get_request_details',
-                request_id=self.id)
-        attrs = (u'killmail_url', u'kill_timestamp', u'pilot',
-                 u'alliance', u'corporation', u'submitter',
-                 u'division', u'status', u'base_payout', u'payout',
-                 u'details', u'id', u'ship_type', u'system', u'constellation',
-                 u'region')
-        for attr in attrs:
-            if attr == u'ship_type':
-                parent['ship'] = self.ship_type
-            elif u'payout' in attr:
-                payout = getattr(self, attr)
-                parent[attr] = payout.currency()
-            else:
-                parent[attr] = getattr(self, attr)
-        parent[u'submit_timestamp'] = self.timestamp
+        def wanted(key):
+            return fields is None or key in fields
+        if wanted(u'href'):
+            parent[u'href'] = url_for('requests.get_request_details',
+                    request_id=self.id)
+        for key, attr in six.iteritems(self.json_attributes):
+            if key in (u'id', u'href') or not wanted(key):
+                continue
+            value = getattr(self, attr)
+            if attr in (u'base_payout', u'payout'):
+                value = value.currency()
+            parent[key] = value
         if extended:
-            parent[u'actions'] = map(lambda a: a._json(True), self.actions)
-            parent[u'modifiers'] = map(lambda m: m._json(True), self.modifiers)
-            parent[u'valid_actions'] = self.valid_actions(current_user)
-            parent[u'transformed'] = dict(self.transformed)
+            if wanted(u'actions'):
+                parent[u'actions'] = map(lambda a: a._json(True), self.actions)
+            if wanted(u'modifiers'):
+                parent[u'modifiers'] = map(lambda m: m._json(True),
+                        self.all_modifiers)
+            if wanted(u'valid_actions'):
+                parent[u'valid_actions'] = self.valid_actions(current_user,
+                        permissions)
+            if wanted(u'transformed'):
+                parent[u'transformed'] = dict(self.transformed)
         return parent
 
 
+class RequestChange(db.Model, AutoID, Timestamped):
+    """A log entry recording that a :py:class:`Request` has been changed.
+
+    Entries are added automatically whenever a request (or one of its
+    :py:class:`Action`\s or :py:class:`Modifier`\s) is created, modified or
+    deleted. As :py:attr:`id` always increases, it can be used by API clients
+    as a cursor to find out what has changed since they last looked.
+    """
+
+    __tablename__ = 'request_change'
+
+    #: The ID of the changed :py:class:`Request`. This is intentionally not a
+    #: foreign key, as the log outlives deleted requests.
+    request_id = db.Column(db.Integer, nullable=False, index=True)
+
+    #: The ID of the :py:class:`~.Division` the request was in at the time it
+    #: was changed. Used for permission checks.
+    division_id = db.Column(db.Integer, nullable=False, index=True)
+
+    #: The ID of the :py:class:`~.User` who submitted the request.
+    submitter_id = db.Column(db.Integer, index=True)
+
+    #: Set when the request was deleted.
+    deleted = db.Column(db.Boolean(name='deleted'), nullable=False,
+            default=False)
+
+
+class SubmissionStatus(DeclEnum):
+
+    # TRANS: Status of a submitted killmail that is waiting to be retrieved
+    # TRANS: and checked before a request is made for it.
+    verifying = u'verifying', lazy_gettext(u'Verifying')
+    """The killmail has not been verified yet."""
+
+    # TRANS: Status of a submitted killmail that could not be verified, so no
+    # TRANS: request was made for it.
+    failed = u'failed', lazy_gettext(u'Failed')
+    """The killmail could not be verified. This is a terminating state."""
+
+    # TRANS: Status of a submitted killmail that has been verified and turned
+    # TRANS: into a request.
+    submitted = u'submitted', lazy_gettext(u'Submitted')
+    """A :py:class:`Request` has been made for the killmail. This is a
+    terminating state.
+    """
+
+
+class KillmailSubmission(db.Model, AutoID, Timestamped, AutoName):
+    """A killmail submitted while ``SRP_ASYNC_KILLMAILS`` is enabled.
+
+    Submissions are queued here until a worker (see
+    :py:mod:`evesrp.submissions`) retrieves and verifies the killmail, and
+    creates the :py:class:`Request` for it.
+    """
+
+    #: The ID of the :py:class:`~.User` who submitted the killmail.
+    submitter_id = db.Column(db.Integer, db.ForeignKey('user.id'),
+            nullable=False, index=True)
+
+    #: The :py:class:`~.User` who submitted the killmail.
+    submitter = db.relationship('User')
+
+    #: The ID of the :py:class:`~.Division` the killmail was submitted to.
+    division_id = db.Column(db.Integer, db.ForeignKey('division.id'),
+            nullable=False)
+
+    #: The :py:class:`~.Division` the killmail was submitted to.
+    division = db.relationship('Division')
+
+    #: The URL of the killmail.
+    url = db.Column(db.String(512, convert_unicode=True), nullable=False)
+
+    #: The details the submitter gave.
+    details = db.Column(db.Text(convert_unicode=True))
+
+    #: The :py:class:`SubmissionStatus` of the submission.
+    status = db.Column(SubmissionStatus.db_type(), nullable=False,
+            default=SubmissionStatus.verifying)
+
+    #: How many times a worker has tried to verify the killmail.
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+
+    #: When a worker should (next) try to verify the killmail.
+    next_attempt = db.Column(DateTime, nullable=False, index=True,
+            default=lambda: dt.datetime.now(utc))
+
+    #: Why the last attempt failed.
+    last_error = db.Column(db.Text(convert_unicode=True))
+
+    #: The ID of the :py:class:`Request` made for the killmail (or the
+    #: existing one, for duplicate submissions). Not a foreign key, as the
+    #: request may be archived.
+    request_id = db.Column(db.Integer)
+
+    def __init__(self, submitter, division, url, details):
+        self.submitter = submitter
+        self.division = division
+        self.url = url
+        self.details = details
+
+    def __repr__(self):
+        return "{}({}, {}, {!r})".format(self.__class__.__name__, self.id,
+                self.status, self.url)
+
+
 # Define event listeners for syncing the various denormalized attributes
 
 @listens_for(Action.type_, 'set')
@@ -745,6 +1134,7 @@ def _recalculate_payout_from_request(srp_request, base_payout, *args):
         relative = Decimal(0)
     payout = (base_payout + absolute) * (Decimal(1) + relative)
     srp_request.payout = PrettyDecimal(payout)
+    metrics.payout_recalculations.inc(trigger=u'base_payout')
 
 
 @listens_for(Modifier.request, 'set', propagate=True)
@@ -796,6 +1186,150 @@ def _recalculate_payout_from_modifier(modifier, value, *args):
         payout = (srp_request.base_payout + absolute) * \
                 (Decimal(1) + relative)
         srp_request.payout = PrettyDecimal(payout)
+        metrics.payout_recalculations.inc(trigger=u'modifier')
+
+
+def recalculate_payouts(bind, start, end):
+    """Recalculate the stored :py:attr:`Request.payout` of the requests with
+    IDs from ``start`` (inclusive) to ``end`` (exclusive).
+
+    Meant to be used with :py:func:`evesrp.migrate.batch.run_batched` to repair
+    payouts that were not kept up to date. Only requests whose payout is
+    wrong are updated, and they get a new version and change log entry, so it
+    is safe to run again.
+
+    :returns: The number of requests that were updated.
+    :rtype: int
+    """
+    request_table = Request.__table__
+    modifier_table = Modifier.__table__
+    in_range = db.and_(modifier_table.c.request_id >= start,
+            modifier_table.c.request_id < end)
+    active = db.or_(modifier_table.c.voided_user_id == None,
+            modifier_table.c.voided_timestamp == None)
+    sums = []
+    for cls in (AbsoluteModifier, RelativeModifier):
+        value_table = cls.__table__
+        sums.append(dict(bind.execute(db.select([modifier_table.c.request_id,
+                    db.func.sum(value_table.c.value)])\
+                .select_from(modifier_table.join(value_table,
+                    value_table.c.id == modifier_table.c.id))\
+                .where(db.and_(in_range, active))\
+                .group_by(modifier_table.c.request_id)).fetchall()))
+    absolute_sums, relative_sums = sums
+    rows = bind.execute(db.select([request_table.c.id,
+                request_table.c.base_payout, request_table.c.payout,
+                request_table.c.division_id, request_table.c.submitter_id])\
+            .where(db.and_(request_table.c.id >= start,
+                request_table.c.id < end)))
+    changed = []
+    for row in rows:
+        base_payout = Decimal(row.base_payout or 0)
+        absolute = Decimal(absolute_sums.get(row.id) or 0)
+        relative = Decimal(relative_sums.get(row.id) or 0)
+        payout = ((base_payout + absolute) * (Decimal(1) + relative))\
+                .quantize(Decimal('0.01'))
+        if row.payout is None or Decimal(row.payout) != payout:
+            changed.append((row, payout))
+    if not changed:
+        return 0
+    bind.execute(request_table.update()\
+            .where(request_table.c.id == db.bindparam('request_id'))\
+            .values(payout=db.bindparam('new_payout'),
+                version=request_table.c.version + 1),
+            [{'request_id': row.id, 'new_payout': payout}
+                for row, payout in changed])
+    bind.execute(RequestChange.__table__.insert(), [
+        {
+            'request_id': row.id,
+            'division_id': row.division_id,
+            'submitter_id': row.submitter_id,
+            'deleted': False,
+        } for row, _ in changed])
+    return len(changed)
+
+
+# Track which requests are changed in a transaction so that they can be pushed
+# out to listeners once (and only if) the transaction is committed.
+
+def _request_summary(srp_request, deleted=False):
+    """Create a small, JSON serializable summary of a :py:class:`Request`.
+
+    The summaries are built from the already loaded state of the request so
+    that no further queries are needed.
+    """
+    summary = {
+        u'id': srp_request.id,
+        u'division_id': srp_request.division_id,
+        u'submitter_id': srp_request.submitter_id,
+    }
+    if deleted:
+        summary[u'deleted'] = True
+    else:
+        payout = srp_request.payout
+        if payout is None:
+            payout = Decimal(0)
+        summary[u'status'] = srp_request.status.name
+        summary[u'payout'] = PrettyDecimal(payout).currency()
+    return summary
+
+
+def _changed_requests(session):
+    """Yield the :py:class:`Request`\s affected by the current flush."""
+    with session.no_autoflush:
+        for instance in session.new | session.dirty:
+            if isinstance(instance, Request):
+                yield instance
+            elif isinstance(instance, (Action, Modifier)) and \
+                    instance.request is not None:
+                yield instance.request
+
+
+@listens_for(SessionBase, 'before_flush')
+def _increment_request_versions(session, flush_context, instances):
+    changed = {}
+    for srp_request in _changed_requests(session):
+        if srp_request not in session.new:
+            changed[id(srp_request)] = srp_request
+    for srp_request in six.itervalues(changed):
+        srp_request.version = (srp_request.version or 0) + 1
+
+
+@listens_for(SessionBase, 'after_flush')
+def _record_request_changes(session, flush_context):
+    changes = session.info.setdefault('request_changes', {})
+    flushed = {}
+    for srp_request in _changed_requests(session):
+        flushed[srp_request.id] = _request_summary(srp_request)
+    for instance in session.deleted:
+        if isinstance(instance, Request):
+            flushed[instance.id] = _request_summary(instance, deleted=True)
+    if not flushed:
+        return
+    changes.update(flushed)
+    # Append to the change log within the same transaction
+    session.execute(RequestChange.__table__.insert(), [
+        {
+            'request_id': summary[u'id'],
+            'division_id': summary[u'division_id'],
+            'submitter_id': summary[u'submitter_id'],
+            'deleted': summary.get(u'deleted', False),
+        } for summary in six.itervalues(flushed)])
+
+
+@listens_for(SessionBase, 'after_commit')
+def _publish_request_changes(session):
+    changes = session.info.pop('request_changes', None)
+    if not changes or not has_app_context():
+        return
+    broadcaster = getattr(current_app, 'request_broadcast', None)
+    if broadcaster is not None:
+        broadcaster.publish(changes.values())
+
+
+@listens_for(SessionBase, 'after_rollback')
+def _discard_request_changes(session):
+    session.info.pop('request_changes', None)
 
 
 # The next few lines are responsible for adding a full text search index on the
@@ -817,3 +1351,320 @@ event.listen(
         'before_drop',
         _drop_fts.execute_if(dialect='mysql')
 )
+
+
+# Finalized requests can be moved (along with their actions and modifiers)
+# into archive tables with the same columns, keeping the tables the request
+# queues use small.
+
+#: Maps the names of tables to the name of their archive table.
+archive_names = OrderedDict((
+    ('request', 'request_archive'),
+    ('action', 'action_archive'),
+    ('modifier', 'modifier_archive'),
+    ('absolute_modifier', 'absolute_modifier_archive'),
+    ('relative_modifier', 'relative_modifier_archive'),
+))
+
+
+#: The columns of each archive table that are indexed.
+archive_indexes = {
+    'request_archive': ('division_id', 'submitter_id', 'pilot_id', 'status',
+            'timestamp', 'kill_timestamp'),
+    'action_archive': ('request_id',),
+    'modifier_archive': ('request_id',),
+}
+
+
+def _archive_table(table):
+    name = archive_names[table.name]
+    indexed = archive_indexes.get(name, ())
+    columns = []
+    for column in table.columns:
+        foreign_keys = []
+        for foreign_key in column.foreign_keys:
+            target_table, target_column = foreign_key.target_fullname\
+                    .split('.')
+            # Point at the archive table for tables that are archived too
+            target_table = archive_names.get(target_table, target_table)
+            foreign_keys.append(db.ForeignKey(
+                    target_table + '.' + target_column))
+        column_type = column.type
+        if isinstance(column_type, SchemaType):
+            # Enum types are tied to the table they were created for
+            column_type = column_type.copy()
+        columns.append(db.Column(column.name, column_type, *foreign_keys,
+                primary_key=column.primary_key, nullable=column.nullable,
+                index=column.name in indexed))
+    return db.Table(name, db.metadata, *columns)
+
+
+request_archive = _archive_table(Request.__table__)
+action_archive = _archive_table(Action.__table__)
+modifier_archive = _archive_table(Modifier.__table__)
+absolute_modifier_archive = _archive_table(AbsoluteModifier.__table__)
+relative_modifier_archive = _archive_table(RelativeModifier.__table__)
+
+
+event.listen(
+        request_archive,
+        'after_create',
+        _create_fts.execute_if(dialect='mysql')
+)
+
+
+event.listen(
+        request_archive,
+        'before_drop',
+        _drop_fts.execute_if(dialect='mysql')
+)
+
+
+def _move_requests(request_ids, archive):
+    """Move the given requests, with their actions and modifiers, into the
+    archive tables (or out of them if ``archive`` is false).
+    """
+    tables = [(t, db.metadata.tables[archive_names[t.name]]) for t in (
+            Request.__table__, Action.__table__, Modifier.__table__,
+            AbsoluteModifier.__table__, RelativeModifier.__table__)]
+    if not archive:
+        tables = [(dest, source) for source, dest in tables]
+    request_table, action_table, modifier_table = [s for s, _ in tables[:3]]
+    modifier_ids = db.select([modifier_table.c.id])\
+            .where(modifier_table.c.request_id.in_(request_ids))
+    conditions = (
+        lambda t: t.c.id.in_(request_ids),
+        lambda t: t.c.request_id.in_(request_ids),
+        lambda t: t.c.request_id.in_(request_ids),
+        lambda t: t.c.id.in_(modifier_ids),
+        lambda t: t.c.id.in_(modifier_ids),
+    )
+    # Copy parents before children, then delete children before parents
+    for (source, dest), condition in zip(tables, conditions):
+        names = [c.name for c in source.columns]
+        db.session.execute(dest.insert().from_select(names,
+                db.select([source.c[n] for n in names])\
+                        .where(condition(source))))
+    for (source, dest), condition in reversed(list(zip(tables, conditions))):
+        db.session.execute(source.delete().where(condition(source)))
+    # Core statements skip the ORM events, so bump the versions (for the
+    # fragment cache) and write the change log entries here.
+    dest_requests = tables[0][1]
+    db.session.execute(dest_requests.update()\
+            .where(dest_requests.c.id.in_(request_ids))\
+            .values(version=dest_requests.c.version + 1))
+    moved = db.session.execute(db.select([dest_requests.c.id,
+                dest_requests.c.division_id, dest_requests.c.submitter_id])\
+            .where(dest_requests.c.id.in_(request_ids))).fetchall()
+    if moved:
+        db.session.execute(RequestChange.__table__.insert(), [
+            {
+                'request_id': row.id,
+                'division_id': row.division_id,
+                'submitter_id': row.submitter_id,
+                'deleted': False,
+            } for row in moved])
+
+
+def archive_requests(cutoff, batch_size=1000):
+    """Move requests finalized before ``cutoff`` into the archive tables.
+
+    A request is archived once it is in a finalized state and neither it nor
+    any of its actions are newer than ``cutoff``. Each batch of requests is
+    committed separately.
+
+    :param cutoff: The :py:class:`~datetime.datetime` to archive up to.
+    :param int batch_size: The number of requests to move at once.
+    :returns: An iterator of the number of requests moved in each batch.
+    """
+    recent_actions = db.exists().where(db.and_(
+            Action.request_id == Request.id,
+            Action.timestamp >= cutoff))
+    while True:
+        request_ids = [r for r, in db.session.query(Request.id)\
+                .filter(Request.finalized, Request.timestamp < cutoff,
+                    ~recent_actions)\
+                .order_by(Request.id)\
+                .limit(batch_size)]
+        if not request_ids:
+            break
+        _move_requests(request_ids, True)
+        db.session.commit()
+        yield len(request_ids)
+
+
+def restore_request(request_id):
+    """Move a request out of the archive tables, if it is archived.
+
+    The session is not committed.
+
+    :returns: If the request was restored.
+    :rtype: bool
+    """
+    archived = db.session.query(request_archive.c.id)\
+            .filter(request_archive.c.id == request_id).first()
+    if archived is None:
+        return False
+    _move_requests([request_id], False)
+    return True
+
+
+def _archived_instance(mapper, row, labels):
+    # Build a persistent (but read only) instance from an archived row
+    instance = mapper.class_manager.new_instance()
+    for attr in mapper.column_attrs:
+        column = attr.columns[0]
+        set_committed_value(instance, attr.key,
+                row[labels[(column.table.name, column.name)]])
+    make_transient_to_detached(instance)
+    return db.session.merge(instance, load=False)
+
+
+def load_archived_request(request_id):
+    """Load an archived request, with its actions and modifiers, without
+    moving it out of the archive tables.
+
+    The returned request has :py:attr:`Request.archived` set, and it (along
+    with its actions and modifiers) must not be changed. Use
+    :py:func:`restore_request` to be able to change it.
+
+    :returns: The request, or ``None`` if it is not archived.
+    :rtype: :py:class:`Request`
+    """
+    existing = Request.query.get(request_id)
+    if existing is not None:
+        return existing if existing.archived else None
+    return load_archived_requests([request_id]).get(request_id)
+
+
+def load_archived_requests(request_ids):
+    """Load many archived requests at once, like
+    :py:func:`load_archived_request`.
+
+    The requests, actions and modifiers are each loaded with one query, as
+    are the pilots, users and divisions they refer to, so the number of
+    queries does not depend on how many requests there are. IDs that are in
+    the ``request`` table (or not anywhere) are left out.
+
+    :param request_ids: The IDs of the requests to load.
+    :returns: The archived requests, keyed by ID.
+    :rtype: dict
+    """
+    # auth.models imports this module, so it cannot be imported at the top
+    from .auth.models import User, Pilot, Division
+    request_ids = set(request_ids)
+    if not request_ids:
+        return {}
+    request_labels = dict(((Request.__table__.name, c.name), c.name)
+            for c in request_archive.columns)
+    srp_requests = {}
+    for row in db.session.execute(db.select([request_archive])\
+            .where(request_archive.c.id.in_(request_ids))):
+        srp_request = _archived_instance(db.inspect(Request), row,
+                request_labels)
+        srp_request.archived = True
+        srp_requests[srp_request.id] = srp_request
+    if not srp_requests:
+        return {}
+    request_ids = list(srp_requests)
+    action_labels = dict(((Action.__table__.name, c.name), c.name)
+            for c in action_archive.columns)
+    actions = defaultdict(list)
+    for row in db.session.execute(db.select([action_archive])\
+            .where(action_archive.c.request_id.in_(request_ids))\
+            .order_by(action_archive.c.timestamp.desc())):
+        action = _archived_instance(db.inspect(Action), row, action_labels)
+        actions[action.request_id].append(action)
+    # Modifiers are split over a table for each class
+    modifier_tables = ((Modifier.__table__, modifier_archive),
+            (AbsoluteModifier.__table__, absolute_modifier_archive),
+            (RelativeModifier.__table__, relative_modifier_archive))
+    modifier_labels = {}
+    selected = []
+    for table, archive_table in modifier_tables:
+        for column in archive_table.columns:
+            label = '{}_{}'.format(table.name, column.name)
+            modifier_labels[(table.name, column.name)] = label
+            selected.append(column.label(label))
+    joined = modifier_archive\
+            .outerjoin(absolute_modifier_archive,
+                absolute_modifier_archive.c.id == modifier_archive.c.id)\
+            .outerjoin(relative_modifier_archive,
+                relative_modifier_archive.c.id == modifier_archive.c.id)
+    modifier_mapper = db.inspect(Modifier)
+    modifiers = defaultdict(list)
+    for row in db.session.execute(db.select(selected).select_from(joined)\
+            .where(modifier_archive.c.request_id.in_(request_ids))\
+            .order_by(modifier_archive.c.timestamp.desc())):
+        mapper = modifier_mapper.polymorphic_map[row['modifier__type']]
+        modifier = _archived_instance(mapper, row, modifier_labels)
+        modifiers[modifier.request_id].append(modifier)
+    # Load everything the requests refer to up front, instead of lazily for
+    # each request
+    user_ids = set(r.submitter_id for r in srp_requests.values())
+    for request_actions in actions.values():
+        user_ids.update(a.user_id for a in request_actions)
+    for request_modifiers in modifiers.values():
+        user_ids.update(m.user_id for m in request_modifiers)
+        user_ids.update(m.voided_user_id for m in request_modifiers
+                if m.voided_user_id is not None)
+    users = dict((u.id, u) for u in
+            User.query.filter(User.id.in_(user_ids)))
+    pilots = dict((p.id, p) for p in Pilot.query.filter(Pilot.id.in_(
+            set(r.pilot_id for r in srp_requests.values()))))
+    divisions = dict((d.id, d) for d in Division.query.filter(Division.id.in_(
+            set(r.division_id for r in srp_requests.values()))))
+    for request_id, srp_request in six.iteritems(srp_requests):
+        set_committed_value(srp_request, 'submitter',
+                users.get(srp_request.submitter_id))
+        set_committed_value(srp_request, 'pilot',
+                pilots.get(srp_request.pilot_id))
+        set_committed_value(srp_request, 'division',
+                divisions.get(srp_request.division_id))
+        for action in actions[request_id]:
+            set_committed_value(action, 'user', users.get(action.user_id))
+        for modifier in modifiers[request_id]:
+            set_committed_value(modifier, 'user', users.get(modifier.user_id))
+            set_committed_value(modifier, 'voided_user',
+                    users.get(modifier.voided_user_id))
+        set_committed_value(srp_request, 'actions', actions[request_id])
+        set_committed_value(srp_request, 'all_modifiers',
+                modifiers[request_id])
+        set_committed_value(srp_request, 'active_modifiers',
+                [m for m in modifiers[request_id] if not m.voided])
+    return srp_requests
+
+
+def archive_horizon():
+    """Get the newest submission and kill timestamps of archived requests.
+
+    :returns: A tuple of the timestamps, or ``None`` if nothing has been
+        archived.
+    """
+    row = db.session.query(db.func.max(request_archive.c.timestamp),
+            db.func.max(request_archive.c.kill_timestamp)).first()
+    if row is None or row[0] is None:
+        return None
+    # Aggregates lose the column type, so convert them like the columns do
+    result_type = Request.__table__.c.timestamp.type
+    processor = result_type.result_processor(db.session.bind.dialect, None)
+    if processor is not None:
+        row = tuple(processor(value) for value in row)
+    return tuple(row)
+
+
+def requests_with_archive():
+    """Returns a :py:class:`Request` query over both the current and the
+    archived requests.
+
+    Archived requests are loaded as normal :py:class:`Request` instances, but
+    their actions and modifiers are not loaded (as they are archived as well).
+    Use :py:func:`load_archived_request` to show a single archived request, and
+    :py:func:`restore_request` before changing one.
+    """
+    columns = [c.name for c in Request.__table__.columns]
+    combined = db.union_all(
+            db.select([Request.__table__.c[name] for name in columns]),
+            db.select([request_archive.c[name] for name in columns]))
+    # Keep the name of the table so labels stay the same
+    return Request.query.select_entity_from(combined.alias('request'))
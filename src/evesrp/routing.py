@@ -0,0 +1,73 @@
+"""Send the reads of some requests to a read replica database.
+
+The replica is configured as one of the ``SQLALCHEMY_BINDS``, and named by
+the ``SRP_READ_REPLICA_BIND`` config value::
+
+    SQLALCHEMY_DATABASE_URI = 'postgresql://primary/evesrp'
+    SQLALCHEMY_BINDS = {
+        'replica': 'postgresql://replica/evesrp',
+    }
+    SRP_READ_REPLICA_BIND = 'replica'
+
+``GET`` and ``HEAD`` requests to the blueprints listed in
+``SRP_READ_REPLICA_BLUEPRINTS`` read from the replica. Everything else, and
+every query after something has been written in a request, uses the primary
+database. After a user makes any other kind of request (like submitting a
+form) their requests stay on the primary for
+``SRP_READ_REPLICA_PIN_SECONDS`` seconds, so they see their own changes even
+if the replica is lagging behind.
+"""
+from __future__ import absolute_import
+import time
+
+from flask import current_app, g, has_request_context, request, session
+import flask_sqlalchemy
+from sqlalchemy.sql.expression import Select
+
+
+_SAFE_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+
+
+class RoutingSession(flask_sqlalchemy.SignallingSession):
+    """A :py:class:`~flask_sqlalchemy.SignallingSession` running plain
+    ``SELECT`` statements on the read replica when the current request allows
+    it.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if has_request_context() and g.get('use_replica', False):
+            if isinstance(clause, Select) and clause._for_update_arg is None\
+                    and not self._flushing:
+                bind = self.app.config['SRP_READ_REPLICA_BIND']
+                state = flask_sqlalchemy.get_state(self.app)
+                return state.db.get_engine(self.app, bind=bind)
+            # Something is being written, so read it back from the primary
+            # for the rest of the request.
+            g.use_replica = False
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(flask_sqlalchemy.SQLAlchemy):
+    """A :py:class:`~flask_sqlalchemy.SQLAlchemy` using
+    :py:class:`RoutingSession` for sessions.
+    """
+
+    def create_session(self, options):
+        return RoutingSession(self, **options)
+
+
+def choose_bind():
+    """Decide if the current request can read from the replica."""
+    config = current_app.config
+    g.use_replica = request.method in ('GET', 'HEAD') and \
+            request.blueprint in config['SRP_READ_REPLICA_BLUEPRINTS'] and \
+            session.get('primary_until', 0) < time.time()
+
+
+def pin_to_primary(response):
+    """Keep the user on the primary for a while after changing something."""
+    if request.method not in _SAFE_METHODS:
+        session['primary_until'] = time.time() + \
+                current_app.config['SRP_READ_REPLICA_PIN_SECONDS']
+    return response
+
@@ -1,9 +1,8 @@
 from __future__ import unicode_literals
 
-from .util.crest import NameLookup
-from . import static_data
+from .util.crest import NameLookup, static_table
 
 
-ships = NameLookup(static_data.ships,
+ships = NameLookup(static_table('ships'),
         'itemTypes',
         'application/vnd.ccp.eve.ItemType-v3+json')
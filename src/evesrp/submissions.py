@@ -0,0 +1,242 @@
+"""Verify killmails in the background.
+
+When ``SRP_ASYNC_KILLMAILS`` is enabled, submitting a request does not wait
+for the killmail to be retrieved from the killboard and ESI. Instead a
+:py:class:`~.KillmailSubmission` is stored, and worker processes (started
+with ``evesrp -c config.py process_killmails``) take submissions from that
+table, verify the killmails and create the requests.
+
+The table is the queue, so no other service is needed. A worker claims a
+submission by moving its :py:attr:`~.KillmailSubmission.next_attempt` into
+the future with a single ``UPDATE``, so only one worker processes it at a
+time. If that worker dies, the submission is picked up again once the claim
+runs out after ``SRP_KILLMAIL_CLAIM_SECONDS``. Submissions that fail because
+a site could not be reached are retried with an increasing (and jittered)
+delay, up to ``SRP_KILLMAIL_RETRIES`` times.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import datetime as dt
+import logging
+import multiprocessing
+import random
+import time
+
+from flask import current_app
+from flask_babel import gettext
+from requests.exceptions import RequestException
+import six
+
+from . import db
+from .auth.models import Pilot
+from .models import KillmailSubmission, SubmissionStatus, Request,\
+        restore_request
+from .util import utc
+
+
+log = logging.getLogger(__name__)
+
+
+class SubmissionError(Exception):
+    """Raised when a killmail can never be verified, so retrying is
+    pointless.
+    """
+    pass
+
+
+def _now():
+    return dt.datetime.now(utc)
+
+
+def due_submissions(limit=None):
+    """Return the IDs of the submissions ready to be verified, oldest
+    first.
+    """
+    query = db.session.query(KillmailSubmission.id)\
+            .filter(KillmailSubmission.status == SubmissionStatus.verifying,
+                    KillmailSubmission.next_attempt <= _now())\
+            .order_by(KillmailSubmission.next_attempt)
+    if limit is not None:
+        query = query.limit(limit)
+    return [row.id for row in query]
+
+
+def claim(submission_id):
+    """Try to claim a submission for the current worker.
+
+    :returns: If the submission was claimed. ``False`` means it has been
+        claimed by another worker (or is not waiting to be verified).
+    :rtype: bool
+    """
+    now = _now()
+    claim_until = now + dt.timedelta(
+            seconds=current_app.config['SRP_KILLMAIL_CLAIM_SECONDS'])
+    table = KillmailSubmission.__table__
+    update = table.update()\
+            .where(table.c.id == submission_id)\
+            .where(table.c.status == SubmissionStatus.verifying)\
+            .where(table.c.next_attempt <= now)\
+            .values(next_attempt=claim_until,
+                    attempts=table.c.attempts + 1)
+    result = db.session.execute(update)
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def verify(submission):
+    """Retrieve and verify the killmail for a submission, and create the
+    :py:class:`~.Request` for it.
+
+    Performs the same checks as submitting a request without
+    ``SRP_ASYNC_KILLMAILS``.
+
+    :raises SubmissionError: if the killmail cannot be verified.
+    :raises requests.exceptions.RequestException: if the killmail could not
+        be retrieved.
+    :rtype: :py:class:`~.Request`
+    """
+    mail = None
+    errors = []
+    for source in current_app.killmail_sources:
+        try:
+            mail = source(submission.url)
+        except (ValueError, LookupError) as e:
+            errors.append(six.text_type(e))
+            continue
+        if mail.verified:
+            break
+        # TRANS: Error message show when trying to submit a killmail
+        # TRANS: that cannot be verified.
+        errors.append(gettext(u"%(url)s cannot be verified.",
+                url=submission.url))
+        mail = None
+    if mail is None:
+        raise SubmissionError(u' '.join(errors))
+    # Prevent submitting other people's killmails
+    pilot = Pilot.query.get(mail.pilot_id)
+    if not pilot or pilot not in submission.submitter.pilots:
+        # TRANS: Error message shown when trying to submit a lossmail from
+        # TRANS: A character not associated with your user account.
+        raise SubmissionError(gettext(u"You can only submit killmails of "
+                                      u"characters you control"))
+    # Prevent duplicate killmails
+    srp_request = Request.query.get(mail.kill_id)
+    if srp_request is None and restore_request(mail.kill_id):
+        db.session.commit()
+        srp_request = Request.query.get(mail.kill_id)
+    if srp_request is not None:
+        submission.request_id = srp_request.id
+        # TRANS: Error message shown when trying to submit a killmail for
+        # TRANS: SRP a second time.
+        raise SubmissionError(gettext(u"This kill has already been "
+                                      u"submitted"))
+    srp_request = Request(submission.submitter, submission.details,
+            submission.division, mail)
+    srp_request.pilot = pilot
+    db.session.add(srp_request)
+    return srp_request
+
+
+def _retry_later(submission, error):
+    config = current_app.config
+    if submission.attempts >= config['SRP_KILLMAIL_RETRIES']:
+        submission.status = SubmissionStatus.failed
+        # TRANS: Error message shown when the site a killmail is from
+        # TRANS: cannot be reached.
+        submission.last_error = gettext(u"Unable to retrieve %(url)s right "
+                                        u"now, please try again later.",
+                                        url=submission.url)
+        return
+    # Back off exponentially, with some jitter so that submissions failing
+    # together do not all come back at the same time.
+    delay = config['SRP_KILLMAIL_RETRY_DELAY'] * \
+            2 ** (submission.attempts - 1) * random.uniform(0.5, 1)
+    submission.next_attempt = _now() + dt.timedelta(seconds=delay)
+    submission.last_error = six.text_type(error)
+
+
+def process_submission(submission_id):
+    """Claim and verify a submission, recording the outcome.
+
+    :returns: If the submission was claimed by this worker.
+    :rtype: bool
+    """
+    if not claim(submission_id):
+        return False
+    submission = KillmailSubmission.query.get(submission_id)
+    try:
+        srp_request = verify(submission)
+        db.session.flush()
+    except SubmissionError as e:
+        submission.status = SubmissionStatus.failed
+        submission.last_error = six.text_type(e)
+    except Exception as e:
+        if isinstance(e, RequestException):
+            log.warning("Unable to retrieve killmail %s: %s", submission.url,
+                    e)
+        else:
+            log.exception("Error verifying killmail %s.", submission.url)
+        db.session.rollback()
+        submission = KillmailSubmission.query.get(submission_id)
+        _retry_later(submission, e)
+    else:
+        submission.status = SubmissionStatus.submitted
+        submission.request_id = srp_request.id
+        submission.last_error = None
+    db.session.commit()
+    return True
+
+
+def process_due(limit=None):
+    """Process the submissions that are ready to be verified.
+
+    :returns: The number of submissions processed by this worker.
+    :rtype: int
+    """
+    submission_ids = due_submissions(limit)
+    # Other workers see the same submissions, so start in a different place
+    random.shuffle(submission_ids)
+    processed = 0
+    try:
+        for submission_id in submission_ids:
+            if process_submission(submission_id):
+                processed += 1
+    finally:
+        db.session.remove()
+    return processed
+
+
+def work(poll_interval=5, batch_size=10):
+    """Process submissions until interrupted, waiting ``poll_interval``
+    seconds whenever there is nothing to do.
+    """
+    while True:
+        if not process_due(batch_size):
+            time.sleep(poll_interval)
+
+
+def _worker(app, poll_interval, batch_size):
+    with app.app_context():
+        # Connections inherited from the parent process cannot be shared
+        db.get_engine(app).dispose()
+        try:
+            work(poll_interval, batch_size)
+        except KeyboardInterrupt:
+            pass
+
+
+def run_workers(app, processes, poll_interval=5, batch_size=10):
+    """Run ``processes`` worker processes until interrupted."""
+    db.get_engine(app).dispose()
+    workers = [multiprocessing.Process(target=_worker,
+            args=(app, poll_interval, batch_size)) for _ in range(processes)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+            worker.join()
@@ -1,7 +1,6 @@
 import re
 from flask import current_app
-from .util.crest import check_crest_response, NameLookup
-from . import static_data
+from .util.crest import check_crest_response, NameLookup, static_table
 
 
 REGION_TYPE = 'application/vnd.ccp.eve.Region-v1+json'
@@ -9,23 +8,25 @@ CONSTELLATION_TYPE = 'application/vnd.ccp.eve.Constellation-v1+json'
 SYSTEM_TYPE = 'application/vnd.ccp.eve.System-v1+json'
 
 
-region_names = NameLookup(static_data.region_names, 'regions', REGION_TYPE)
+region_names = NameLookup(static_table('region_names'), 'regions',
+        REGION_TYPE)
 
 
 constellation_names = NameLookup(
-        static_data.constellation_names,
+        static_table('constellation_names'),
         'constellations',
         CONSTELLATION_TYPE)
 
 
-system_names = NameLookup(static_data.system_names, 'systems', SYSTEM_TYPE)
+system_names = NameLookup(static_table('system_names'), 'systems',
+        SYSTEM_TYPE)
 
 
 class ConstellationRegionLookup(NameLookup):
 
     def __init__(self):
         super(ConstellationRegionLookup, self).__init__(
-                static_data.constellations_to_regions,
+                static_table('constellations_to_regions'),
                 'constellations',
                 CONSTELLATION_TYPE,
                 'region.href')
@@ -46,7 +47,7 @@ class ConstellationRegionLookup(NameLookup):
         return self._dict[key]
 
 
-systems_constellations = NameLookup(static_data.systems_to_constellations,
+systems_constellations = NameLookup(static_table('systems_to_constellations'),
                                     'systems',
                                     SYSTEM_TYPE,
                                     'constellation.id')
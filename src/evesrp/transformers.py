@@ -1,3 +1,6 @@
+from werkzeug.utils import import_string
+
+
 class Transformer(object):
 
     def __init__(self, name, slug):
@@ -14,7 +17,36 @@ class Transformer(object):
         return self.slug.format(*args, **kwargs)
 
     def __hash__(self):
-        return hash(self.name + self.slug) ^ hash(self.__class__)
+        return hash((self.__class__, self.name, self.slug))
 
     def __eq__(self, other):
-        return hash(self) == hash(other)
+        return self.__class__ is other.__class__ and \
+                self.name == other.name and self.slug == other.slug
+
+    def __ne__(self, other):
+        return not self == other
+
+    @property
+    def spec(self):
+        """A JSON serializable dictionary describing this transformer.
+
+        The ``type`` key is the import path of the transformer's class, and
+        the other keys are passed to the class as keyword arguments by
+        :py:func:`from_spec`. Subclasses taking extra arguments should add
+        them here.
+        """
+        return {
+            u'type': u'{}.{}'.format(self.__class__.__module__,
+                    self.__class__.__name__),
+            u'name': self.name,
+            u'slug': self.slug,
+        }
+
+
+def from_spec(spec):
+    """Create a :py:class:`Transformer` from a :py:attr:`Transformer.spec`
+    dictionary.
+    """
+    spec = dict(spec)
+    Type = import_string(spec.pop(u'type'))
+    return Type(**dict((str(k), v) for k, v in spec.items()))
@@ -4,7 +4,7 @@ from .enum import DeclEnum
 from .jsonify import jsonify
 from .models import AutoID, Timestamped, AutoName
 from .request import AcceptRequest
-from .sqlstats import DB_STATS
+from .sqlstats import DbStats
 from .unistr import unistr, ensure_unicode
 from .urlparse import urlparse, urlunparse
 from .datetime import utc, DateTime, parse_datetime
@@ -12,3 +12,4 @@ from .varies import varies
 from .validate_redirect import is_safe_redirect
 from .weak_ciphers import WeakCiphersAdapter
 from .xmlify import xmlify
+from .cache import LRUCache, FragmentCache, FragmentCacheExtension
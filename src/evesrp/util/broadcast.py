@@ -0,0 +1,100 @@
+from __future__ import absolute_import
+import threading
+
+from six.moves import queue
+
+
+class LocalFanout(object):
+    """The default fan-out backend for :py:class:`Broadcaster`.
+
+    Messages are handed straight to the attached callback, so only subscribers
+    within the same process receive them. Deployments running multiple worker
+    processes have to provide a different backend (for example one wrapping a
+    Redis or PostgreSQL ``LISTEN``/``NOTIFY`` channel) by implementing the same
+    two methods and passing it as the ``SRP_BROADCAST_FANOUT`` config value.
+    """
+
+    #: Whether messages reach subscribers in other processes. Backends that
+    #: do not define this are assumed to.
+    cross_process = False
+
+    def __init__(self):
+        self.callbacks = []
+
+    def attach(self, callback):
+        """Register a callable to be called with every published message
+        batch, from every process.
+        """
+        self.callbacks.append(callback)
+
+    def publish(self, messages):
+        """Send a batch of messages to every attached callback."""
+        for callback in self.callbacks:
+            callback(messages)
+
+
+class Subscription(object):
+    """A bounded queue of messages for a single listener."""
+
+    def __init__(self, maxsize=100):
+        self._queue = queue.Queue(maxsize)
+        #: Set when messages had to be dropped because the listener fell too
+        #: far behind. Listeners should do a full refresh when this is set.
+        self.overflowed = False
+
+    def put(self, messages):
+        for message in messages:
+            try:
+                self._queue.put_nowait(message)
+            except queue.Full:
+                self.overflowed = True
+                return
+
+    def get(self, timeout=None):
+        """Get the next message, or ``None`` if the timeout expired."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class Broadcaster(object):
+    """Distributes messages to in-process :py:class:`Subscription`\s.
+
+    Messages are published through a fan-out backend (by default a
+    :py:class:`LocalFanout`) which is responsible for getting them to every
+    worker process. Each process then delivers the messages it receives to its
+    own subscribers.
+    """
+
+    def __init__(self, fanout=None, queue_size=100):
+        if fanout is None:
+            fanout = LocalFanout()
+        self.fanout = fanout
+        self.queue_size = queue_size
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self.fanout.attach(self._deliver)
+
+    def subscribe(self):
+        """Create and register a new :py:class:`Subscription`."""
+        subscription = Subscription(self.queue_size)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, messages):
+        """Publish a sequence of messages to every subscriber."""
+        messages = list(messages)
+        if messages:
+            self.fanout.publish(messages)
+
+    def _deliver(self, messages):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            subscription.put(messages)
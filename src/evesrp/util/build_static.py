@@ -0,0 +1,26 @@
+"""Write the manifest of hashed static file names (and gzipped copies of the
+static files) when building EVE-SRP::
+
+    python -m evesrp.util.build_static --gzip src/evesrp/static
+"""
+from __future__ import absolute_import
+import argparse
+import os.path
+from ..versioned_static import StaticManifest, compress_static, MANIFEST_NAME
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=u"Write a manifest of the "
+            u"hashed names of static files.")
+    parser.add_argument('static_folder')
+    parser.add_argument('--gzip', action='store_true', default=False,
+            help=u"Also write gzipped copies of the files.")
+    args = parser.parse_args(args)
+    manifest = StaticManifest.build(args.static_folder)
+    if args.gzip:
+        compress_static(args.static_folder, manifest)
+    manifest.save(os.path.join(args.static_folder, MANIFEST_NAME))
+
+
+if __name__ == '__main__':
+    main()
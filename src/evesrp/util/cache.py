@@ -0,0 +1,137 @@
+from __future__ import absolute_import
+from collections import OrderedDict
+import threading
+
+from flask_babel import get_locale, get_timezone
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+import six
+
+
+class LRUCache(object):
+    """A thread-safe, in-process cache holding up to ``maxsize`` items.
+
+    When full, the least recently used item is evicted to make room for a new
+    one.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Get the value stored for ``key``, or ``default`` if there is none.
+        """
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                return default
+            # Re-insert to mark as most recently used
+            self._items[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class FragmentCache(object):
+    """Two level cache for rendered template fragments.
+
+    Fragments are looked up in a per-process :py:class:`LRUCache` first, and
+    then in an optional shared store (shared between processes and servers).
+    The shared store only needs ``get(key)`` and ``set(key, value, timeout)``
+    methods, so any of the Werkzeug cache classes can be used.
+
+    :param int maxsize: The number of fragments to keep in each process.
+    :param shared: The shared store, or ``None``.
+    :param int timeout: How long fragments are kept in the shared store, in
+        seconds.
+    """
+
+    def __init__(self, maxsize=1000, shared=None, timeout=None):
+        self.local = LRUCache(maxsize)
+        self.shared = shared
+        self.timeout = timeout
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value, self.timeout)
+
+    def clear(self):
+        """Clear the fragments cached in this process."""
+        self.local.clear()
+
+
+class FragmentCacheExtension(Extension):
+    """Jinja extension adding a ``{% cache %}`` tag for caching fragments of a
+    template.
+
+    The tag takes one or more key values. The first should name the fragment,
+    and the rest should together identify everything the fragment depends
+    on::
+
+        {% cache 'request-row', request.id, request.version %}
+          ...
+        {% endcache %}
+
+    The current locale and timezone are added to the key automatically. The
+    fragments are stored in the environment's ``fragment_cache`` attribute; if
+    it is ``None`` fragments are rendered every time.
+    """
+
+    tags = set(['cache'])
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(
+                self.call_method('_cache_support', [nodes.List(args)]),
+                [], [], body).set_lineno(lineno)
+
+    def _cache_support(self, key_parts, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        key_parts = list(key_parts)
+        key_parts.append(get_locale())
+        key_parts.append(get_timezone())
+        key = u'fragment:' + u':'.join(six.text_type(p) for p in key_parts)
+        value = cache.get(key)
+        if value is None:
+            value = six.text_type(caller())
+            cache.set(key, value)
+        return Markup(value)
@@ -1,4 +1,7 @@
 from flask import flash, current_app
+import six
+
+from . import metrics
 
 
 def check_crest_response(response):
@@ -24,14 +27,37 @@ def check_crest_response(response):
     return True
 
 
+def static_table(name):
+    """Return a function loading the named table from
+    :py:mod:`evesrp.static_data`.
+
+    The static data module is large, so it is only imported when one of its
+    tables is first used.
+    """
+    def load():
+        from .. import static_data
+        return getattr(static_data, name)
+    return load
+
+
 class NameLookup(object):
 
     def __init__(self, starting_data, root_key, content_type, attribute='name'):
-        self._dict = starting_data
+        # starting_data may also be a function returning the data (like from
+        # static_table), to load it when it is first needed.
+        self._starting_data = starting_data
+        self._data = None
         self.content_type = content_type
         self.attribute_name = attribute
         self.root_key = root_key
 
+    @property
+    def _dict(self):
+        if self._data is None:
+            data = self._starting_data
+            self._data = data() if callable(data) else data
+        return self._data
+
     @property
     def url_slug(self):
         if not hasattr(self, '_url_slug'):
@@ -56,7 +82,12 @@ class NameLookup(object):
         if not isinstance(key, int):
             raise TypeError("Invalid ID for {} lookup: '{}'".\
                     format(self.attribute_name, key))
-        if key not in self._dict:
+        if key in self._dict:
+            metrics.name_lookups.inc(lookup=self.attribute_name,
+                    result=u'hit')
+        else:
+            metrics.name_lookups.inc(lookup=self.attribute_name,
+                    result=u'miss')
             resp = current_app.requests_session.get(
                     self.url_slug.format(key),
                     headers={'Accept': self.content_type})
@@ -67,3 +98,24 @@ class NameLookup(object):
                         .format(self.attribute_name, resp.status_code, key)
                 raise KeyError(message)
         return self._dict[key]
+
+    def id_for(self, name):
+        """Get the ID for a name, or ``None`` if the name is not known.
+
+        Only the names already known are searched; CREST is not queried.
+        """
+        if getattr(self, '_ids_size', None) != len(self._dict):
+            self._ids = dict((v, k) for k, v in six.iteritems(self._dict))
+            self._ids_size = len(self._dict)
+        return self._ids.get(name)
+
+    def name_for(self, key):
+        """Get the name for an ID, or ``None`` if the ID is not known.
+
+        As with :py:meth:`id_for`, CREST is not queried.
+        """
+        return self._dict.get(key)
+
+    def items(self):
+        """The known IDs and names, as ``(id, name)`` pairs."""
+        return self._dict.items()
@@ -0,0 +1,95 @@
+"""Measure how long importing modules takes when starting a new process.
+
+This uses the ``-X importtime`` option of the Python interpreter (added in
+Python 3.7), in a new process so that nothing has already been imported.
+:py:func:`imported_modules` only checks which modules end up imported, and
+works on every supported version of Python.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from collections import namedtuple
+import json
+import re
+import subprocess
+import sys
+
+
+#: The time spent importing a module, in microseconds. ``self_time`` does not
+#: include the modules imported by it, ``cumulative`` does.
+ImportTime = namedtuple('ImportTime', ('module', 'self_time', 'cumulative'))
+
+
+_line_re = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|\s?( *)(\S+)$')
+
+
+def parse_importtime(output):
+    """Parse the output of ``python -X importtime``.
+
+    :param str output: The text written to stderr.
+    :rtype: :py:class:`list` of :py:class:`ImportTime`
+    """
+    times = []
+    for line in output.splitlines():
+        match = _line_re.match(line.rstrip())
+        if match is None:
+            continue
+        self_time, cumulative, _, module = match.groups()
+        times.append(ImportTime(module, int(self_time), int(cumulative)))
+    return times
+
+
+def profile_imports(code, python=None):
+    """Run ``code`` in a new Python process and return how long each module
+    imported by it took.
+
+    :param str code: The Python code to run.
+    :param str python: The interpreter to use, defaults to the current one.
+    :rtype: :py:class:`list` of :py:class:`ImportTime`
+    :raises RuntimeError: If the interpreter does not support
+        ``-X importtime``, or the code fails.
+    """
+    if python is None:
+        if sys.version_info < (3, 7):
+            raise RuntimeError(u"Measuring import times requires Python 3.7 "
+                               u"or later.")
+        python = sys.executable
+    process = subprocess.Popen([python, '-X', 'importtime', '-c', code],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, stderr = process.communicate()
+    stderr = stderr.decode('utf-8', 'replace')
+    if process.returncode != 0:
+        raise RuntimeError(u"Profiling imports failed:\n{}".format(stderr))
+    return parse_importtime(stderr)
+
+
+# Appended to the code given to imported_modules, writing the names of the
+# loaded modules as the last line of output.
+_list_modules = u"""
+import json as _json, sys as _sys
+_sys.stdout.write('\\n' + _json.dumps(sorted(_sys.modules)) + '\\n')
+"""
+
+
+def imported_modules(code, python=None):
+    """Run ``code`` in a new Python process and return the names of the
+    modules that were imported by the time it finished.
+
+    Unlike :py:func:`profile_imports` this does not need ``-X importtime``, so
+    it can be used to check that modules are imported lazily on any version
+    of Python.
+
+    :param str code: The Python code to run.
+    :param str python: The interpreter to use, defaults to the current one.
+    :rtype: :py:class:`set` of :py:class:`str`
+    :raises RuntimeError: If the code fails.
+    """
+    if python is None:
+        python = sys.executable
+    process = subprocess.Popen([python, '-c', code + _list_modules],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(u"Checking imports failed:\n{}".format(
+                stderr.decode('utf-8', 'replace')))
+    last_line = stdout.decode('utf-8', 'replace').strip().splitlines()[-1]
+    return set(json.loads(last_line))
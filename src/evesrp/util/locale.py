@@ -9,29 +9,89 @@ if six.PY3:
     unicode = str
 
 
+# We're only formatting ISK, so it has a bit of a special format
+_currency_pattern = numbers.parse_pattern(u'#,##0.00;-#')
+
+
+class NumberFormatter(object):
+    """Formats numbers for a locale, with the number patterns already parsed.
+
+    Use :py:func:`formatter` to get one for the current locale.
+    """
+
+    def __init__(self, locale):
+        self.locale = Locale.parse(locale)
+        self.decimal_pattern = numbers.parse_pattern(
+                self.locale.decimal_formats.get(None))
+        self.percent_pattern = numbers.parse_pattern(
+                self.locale.percent_formats.get(None))
+
+    def currency(self, currency):
+        return _currency_pattern.apply(currency, self.locale)
+
+    def number(self, number):
+        return self.decimal_pattern.apply(number, self.locale)
+
+    def percent(self, percent):
+        return self.percent_pattern.apply(percent, self.locale)
+
+
+_formatters = {}
+
+
+def formatter(locale=None):
+    """Return the :py:class:`NumberFormatter` for a locale (defaulting to the
+    current one). Formatters are kept for each locale once created.
+    """
+    if locale is None:
+        locale = get_locale()
+    key = unicode(locale)
+    try:
+        return _formatters[key]
+    except KeyError:
+        number_formatter = NumberFormatter(locale)
+        _formatters[key] = number_formatter
+        return number_formatter
+
+
 def currencyfmt(currency):
-    # We're only formatting ISK, so it has a bit of a special format
-    number = numbers.format_decimal(currency, format="#,##0.00;-#",
-            locale=get_locale())
-    return number
+    return formatter().currency(currency)
+
+
+def currencyfmt_list(currencies):
+    """Format a sequence of amounts at once (like a column of payouts),
+    looking up the locale only once.
+    """
+    number_formatter = formatter()
+    return [number_formatter.currency(currency) for currency in currencies]
 
 
 def numberfmt(number):
-    return numbers.format_number(number, locale=get_locale())
+    return formatter().number(number)
 
 
 def percentfmt(percent):
-    return numbers.format_percent(percent, locale=get_locale())
+    return formatter().percent(percent)
 
 
-def enabled_locales():
-    all_locales = [(unicode(l), l) for l in babel.list_translations()]
-    enabled_locales = current_app.config.get('SRP_LOCALES', [])
-    if not enabled_locales:
-        for locale in all_locales:
-            yield locale[0]
+def load_locales(app):
+    """Find the available translations and the enabled locales for an app.
+
+    The translations directory is only searched once, instead of on every
+    request.
+    """
+    translations = babel.list_translations()
+    app.available_locales = [unicode(l) for l in translations]
+    enabled = app.config.get('SRP_LOCALES', [])
+    if not enabled:
+        app.enabled_locales = list(translations)
     else:
-        for enabled_locale in enabled_locales:
-            for locale_str, locale in all_locales:
-                if locale_str == enabled_locale:
-                    yield locale
+        by_name = dict((unicode(l), l) for l in translations)
+        app.enabled_locales = [by_name[name] for name in enabled
+                if name in by_name]
+    app.enabled_locale_names = frozenset(unicode(l) for l in
+            app.enabled_locales)
+
+
+def enabled_locales():
+    return current_app.enabled_locales
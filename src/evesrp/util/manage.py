@@ -5,8 +5,10 @@ from __future__ import print_function
 import os
 import os.path
 import argparse
+from collections import defaultdict
 from itertools import cycle
 import json
+import logging
 from decimal import Decimal
 import time
 import datetime as dt
@@ -16,8 +18,11 @@ from flask_migrate import Migrate, MigrateCommand, stamp
 from alembic.migration import MigrationContext
 from alembic.script import ScriptDirectory
 import six
-from .. import create_app, db, migrate, models, auth, killmail
+from .. import create_app, db, migrate, models, auth, killmail, submissions
+from ..auth.sync import sync_users
 from .datetime import utc
+from .importtime import profile_imports
+from ..migrate.batch import run_batched
 
 
 if six.PY3:
@@ -222,6 +227,264 @@ class Populate(script.Command):
 manager.add_command('populate', Populate())
 
 
+class BackfillIDs(script.Command):
+    """Fill in the ship, location and organization IDs of existing requests.
+
+    Requests are checked in ranges of IDs, with each range committed along
+    with a checkpoint. If the command is stopped, running it again continues
+    after the last committed range instead of looking at the requests with
+    names that could not be resolved (or no alliance) again. Names that
+    cannot be resolved are left as they are.
+    """
+
+    option_list = (
+        script.Option('--batch-size', '-b', dest='batch_size', default=1000,
+                type=int),
+    )
+
+    def run(self, batch_size, **kwargs):
+        table = models.Request.__table__
+        # Triples of the name column, the ID column, and the resolver
+        id_columns = [(table.c[attr], table.c[id_attr], resolver)
+                for attr, (id_attr, resolver)
+                in six.iteritems(models.Request._id_columns)]
+        missing = db.or_(*[db.and_(id_column == None, name_column != None)
+                for name_column, id_column, _ in id_columns])
+        columns = [table.c.id]
+        for name_column, id_column, _ in id_columns:
+            columns.extend((name_column, id_column))
+
+        def backfill(bind, start, end):
+            batch = bind.execute(db.select(columns).where(db.and_(
+                    table.c.id >= start, table.c.id < end, missing))).fetchall()
+            # Resolve the names for the entire batch at once
+            updates = defaultdict(list)
+            for name_column, id_column, resolver in id_columns:
+                names = set(row[name_column] for row in batch
+                        if row[id_column] is None)
+                names.discard(None)
+                if not names:
+                    continue
+                resolved = resolver.resolve(names)
+                for row in batch:
+                    id_ = resolved.get(row[name_column])
+                    if id_ is not None and row[id_column] is None:
+                        updates[id_column.name].append(
+                                {'request_id': row.id, 'new_id': id_})
+            # The organization resolvers read through the session
+            db.session.rollback()
+            for key, params in six.iteritems(updates):
+                update = table.update()\
+                        .where(table.c.id == db.bindparam('request_id'))\
+                        .values({key: db.bindparam('new_id')})
+                bind.execute(update, params)
+            return len(set(p['request_id'] for params in
+                    six.itervalues(updates) for p in params))
+
+        # Show the progress logged for each batch
+        log = logging.getLogger('evesrp.migrate')
+        log.addHandler(logging.StreamHandler())
+        log.setLevel(logging.INFO)
+        conn = db.get_engine(flask.current_app).connect()
+        try:
+            updated = run_batched(conn, 'backfill-ids', table, backfill,
+                    batch_size)
+        finally:
+            conn.close()
+        print(u"Updated {} requests.".format(updated))
+
+
+manager.add_command('backfill_ids', BackfillIDs())
+
+
+class Archive(script.Command):
+    """Move old paid and rejected requests into the archive tables.
+
+    Requests that were finalized more than the given number of days ago are
+    moved (with their actions and modifiers) in batches, with each batch
+    committed separately. Archived requests are still shown in listings that
+    can include them, and can be viewed (but not changed) until they are
+    restored from their detail page.
+    """
+
+    option_list = (
+        script.Option('--days', '-d', dest='days', default=90, type=int),
+        script.Option('--batch-size', '-b', dest='batch_size', default=1000,
+                type=int),
+    )
+
+    def run(self, days, batch_size, **kwargs):
+        cutoff = dt.datetime.utcnow() - dt.timedelta(days=days)
+        archived = 0
+        for count in models.archive_requests(cutoff, batch_size):
+            archived += count
+            print(u"Archived {} requests.".format(archived))
+        print(u"Archived {} requests finalized before {}.".format(archived,
+                cutoff.strftime('%Y-%m-%d %H:%M')))
+
+
+manager.add_command('archive', Archive())
+
+
+class RecomputePayouts(script.Command):
+    """Recalculate the stored payouts of every request from their modifiers.
+
+    Requests are checked in ranges of IDs, with each range committed along
+    with a checkpoint. If the command is stopped, running it again continues
+    from the last committed range. Only requests with a wrong payout are
+    changed, so it can be run again at any time.
+    """
+
+    option_list = (
+        script.Option('--batch-size', '-b', dest='batch_size', default=None,
+                type=int),
+    )
+
+    def run(self, batch_size, **kwargs):
+        # Show the progress logged for each batch
+        log = logging.getLogger('evesrp.migrate')
+        log.addHandler(logging.StreamHandler())
+        log.setLevel(logging.INFO)
+        engine = db.get_engine(flask.current_app)
+        conn = engine.connect()
+        try:
+            updated = run_batched(conn, 'recompute-payouts',
+                    models.Request.__table__, models.recalculate_payouts,
+                    batch_size)
+        finally:
+            conn.close()
+        print(u"Updated the payouts of {} requests.".format(updated))
+
+
+manager.add_command('recompute_payouts', RecomputePayouts())
+
+
+class ProcessKillmails(script.Command):
+    """Verify killmails submitted while SRP_ASYNC_KILLMAILS is enabled.
+
+    Runs the given number of worker processes until interrupted, or processes
+    the submissions that are ready once and exits with --once (for running
+    from cron).
+    """
+
+    option_list = (
+        script.Option('--workers', '-w', dest='workers', default=2, type=int),
+        script.Option('--poll', '-p', dest='poll_interval', default=5,
+                type=float),
+        script.Option('--batch-size', '-b', dest='batch_size', default=10,
+                type=int),
+        script.Option('--once', dest='once', action='store_true',
+                default=False),
+    )
+
+    def run(self, workers, poll_interval, batch_size, once, **kwargs):
+        if once:
+            processed = submissions.process_due()
+            print(u"Processed {} submissions.".format(processed))
+        elif workers <= 1:
+            try:
+                submissions.work(poll_interval, batch_size)
+            except KeyboardInterrupt:
+                pass
+        else:
+            submissions.run_workers(flask.current_app._get_current_object(),
+                    workers, poll_interval, batch_size)
+
+
+manager.add_command('process_killmails', ProcessKillmails())
+
+
+class SyncUsers(script.Command):
+    """Refresh the groups (and other information) of every user.
+
+    Users are refreshed in batches, with a pool of threads calling their
+    authentication method. Authentication methods that cannot refresh users
+    who are not logged in skip them.
+    """
+
+    option_list = (
+        script.Option('--threads', '-t', dest='threads', default=4, type=int),
+        script.Option('--batch-size', '-b', dest='batch_size', default=100,
+                type=int),
+    )
+
+    def run(self, threads, batch_size, **kwargs):
+        for results in sync_users(flask.current_app._get_current_object(),
+                threads, batch_size):
+            print(u"Refreshed {} users ({} skipped, {} failed).".format(
+                    results['refreshed'], results['skipped'],
+                    results['failed']))
+
+
+manager.add_command('sync_users', SyncUsers())
+
+
+class ProfileImports(script.Command):
+    """Report how long importing each module takes when a worker starts.
+
+    A new Python process imports EVE-SRP, the modules given in the
+    configuration (like authentication methods and killmail sources) and
+    creates an app, and the slowest imports are listed.
+    """
+
+    option_list = (
+        script.Option('--limit', '-l', dest='limit', default=25, type=int),
+        script.Option('--sort', '-s', dest='sort', default='self',
+                choices=('self', 'cumulative')),
+        script.Option('--package', '-p', dest='package', default=None),
+    )
+
+    @staticmethod
+    def _config_modules(config):
+        # The modules of the configured classes, which are imported when the
+        # app is created.
+        modules = set()
+        values = list(config['SRP_AUTH_METHODS'])
+        values.extend(config['SRP_KILLMAIL_SOURCES'])
+        for value in values:
+            if isinstance(value, dict):
+                value = value.get('type', '')
+            if isinstance(value, six.string_types):
+                module = value.replace(':', '.').rpartition('.')[0]
+            elif isinstance(value, type):
+                module = value.__module__
+            else:
+                module = type(value).__module__
+            if module:
+                modules.add(module)
+        return sorted(modules)
+
+    def run(self, limit, sort, package, **kwargs):
+        modules = self._config_modules(flask.current_app.config)
+        lines = [u'import importlib', u'import evesrp']
+        lines.extend(u"importlib.import_module('{}')".format(m)
+                for m in modules)
+        lines.append(u"evesrp.create_app({{'SQLALCHEMY_DATABASE_URI': "
+                     u"'sqlite://', 'SRP_USER_AGENT_EMAIL': '{}'}})".format(
+                         flask.current_app.config['SRP_USER_AGENT_EMAIL']))
+        try:
+            times = profile_imports(u'\n'.join(lines))
+        except RuntimeError as exc:
+            print(six.text_type(exc))
+            return 1
+        total = sum(t.self_time for t in times)
+        print(u"Imported {} modules in {:.1f} ms.".format(len(times),
+                total / 1000.0))
+        if package is not None:
+            times = [t for t in times if t.module == package or
+                    t.module.startswith(package + u'.')]
+        key = (lambda t: t.self_time) if sort == 'self' else \
+                (lambda t: t.cumulative)
+        print(u"{:>10} {:>12}  {}".format(u'self (ms)', u'cumul. (ms)',
+                u'module'))
+        for t in sorted(times, key=key, reverse=True)[:limit]:
+            print(u"{:10.1f} {:12.1f}  {}".format(t.self_time / 1000.0,
+                    t.cumulative / 1000.0, t.module))
+
+
+manager.add_command('profile_imports', ProfileImports())
+
+
 def main():
     manager.run()
 
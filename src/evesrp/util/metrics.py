@@ -0,0 +1,325 @@
+"""Counters and histograms exposed in the Prometheus text format.
+
+Values are kept per thread and only added together when they are read, so
+recording a value never waits on a lock. Each process keeps its own values;
+when running multiple worker processes (like with gunicorn) set
+``SRP_METRICS_DIR`` to a directory shared by the workers. Each worker then
+periodically writes its values to a file in that directory, and ``/metrics``
+adds up the values from every worker's file. The files of workers that have
+exited are removed.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import errno
+import glob
+import json
+import os
+import os.path
+import threading
+import time
+
+import six
+
+
+class _Shards(object):
+    """A dictionary per thread, added together when read.
+
+    The dictionaries are kept by thread identifier, which are reused once a
+    thread exits. A new thread continues adding to the values of the exited
+    thread it shares an identifier with, so only as many dictionaries are kept
+    as there have been threads running at the same time.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = {}
+        self._lock = threading.Lock()
+
+    def local(self):
+        try:
+            return self._local.values
+        except AttributeError:
+            ident = threading.current_thread().ident
+            # Only taken the first time a thread records a value
+            with self._lock:
+                values = self._shards.setdefault(ident, {})
+            self._local.values = values
+            return values
+
+    def shards(self):
+        with self._lock:
+            return list(self._shards.values())
+
+
+class Metric(object):
+
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = _Shards()
+
+    def _key(self, labels):
+        return tuple(six.text_type(labels[name]) for name in self.labelnames)
+
+    def collect(self):
+        """Return a :py:class:`dict` of the label values and the current
+        value for them, for this process.
+        """
+        merged = {}
+        for shard in self._values.shards():
+            for key, value in list(shard.items()):
+                merged[key] = self._merge(merged.get(key), value)
+        return merged
+
+    def _merge(self, first, second):
+        raise NotImplementedError
+
+    def _samples(self, key, value):
+        raise NotImplementedError
+
+    def samples(self, values):
+        """Yield the lines for the samples of ``values`` in the Prometheus text
+        format.
+        """
+        for key in sorted(values):
+            for line in self._samples(key, values[key]):
+                yield line
+
+    def _labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(name, _escape(value))
+                for name, value in pairs) + '}'
+
+
+def _running(pid):
+    # Signal 0 only checks if the process exists
+    try:
+        os.kill(pid, 0)
+    except OSError as exc:
+        return exc.errno == errno.EPERM
+    return True
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n')\
+            .replace('"', '\\"')
+
+
+def _format(value):
+    return repr(float(value))
+
+
+class Counter(Metric):
+    """A value that only goes up."""
+
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        values = self._values.local()
+        key = self._key(labels)
+        values[key] = values.get(key, 0) + amount
+
+    def _merge(self, first, second):
+        return (first or 0) + second
+
+    def _samples(self, key, value):
+        yield '{}{} {}'.format(self.name, self._labels(key), _format(value))
+
+
+class Histogram(Metric):
+    """Counts observations in buckets, along with their sum and count."""
+
+    type_name = 'histogram'
+
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5,
+            10)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=None):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        if buckets is None:
+            buckets = self.default_buckets
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        values = self._values.local()
+        key = self._key(labels)
+        try:
+            counts = values[key]
+        except KeyError:
+            # One count per bucket, then the sum and the total count
+            counts = values[key] = [0] * (len(self.buckets) + 2)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        counts[-2] += value
+        counts[-1] += 1
+
+    def _merge(self, first, second):
+        if first is None:
+            return list(second)
+        return [a + b for a, b in zip(first, second)]
+
+    def _samples(self, key, value):
+        cumulative = 0
+        for bound, count in zip(self.buckets, value[:-2]):
+            cumulative += count
+            yield '{}_bucket{} {}'.format(self.name,
+                    self._labels(key, (('le', _format(bound)),)),
+                    _format(cumulative))
+        yield '{}_bucket{} {}'.format(self.name,
+                self._labels(key, (('le', '+Inf'),)), _format(value[-1]))
+        yield '{}_sum{} {}'.format(self.name, self._labels(key),
+                _format(value[-2]))
+        yield '{}_count{} {}'.format(self.name, self._labels(key),
+                _format(value[-1]))
+
+
+class Registry(object):
+    """A collection of metrics for one process."""
+
+    def __init__(self):
+        self.metrics = []
+        self.directory = None
+        self.interval = 5
+        self._flushed = 0
+
+    def configure(self, directory=None, interval=5):
+        """Set up sharing values between worker processes.
+
+        :param str directory: The directory worker processes share their
+            values in, or ``None`` for a single process.
+        :param int interval: The minimum number of seconds between writing
+            the values of this process to ``directory``.
+        """
+        self.directory = directory
+        self.interval = interval
+
+    def counter(self, *args, **kwargs):
+        metric = Counter(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs):
+        metric = Histogram(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def _path(self, pid):
+        return os.path.join(self.directory, 'metrics-{}.json'.format(pid))
+
+    def snapshot(self):
+        return dict((m.name, m.collect()) for m in self.metrics)
+
+    def flush(self, force=False):
+        """Write the values for this process to the shared directory, if it
+        has been long enough since they were last written.
+        """
+        if self.directory is None:
+            return
+        now = time.time()
+        if not force and now - self._flushed < self.interval:
+            return
+        self._flushed = now
+        data = dict((name, [[list(key), value] for key, value in
+                six.iteritems(values)]) for name, values in
+                six.iteritems(self.snapshot()))
+        path = self._path(os.getpid())
+        temp_path = '{}.{}.tmp'.format(path, threading.current_thread().ident)
+        with open(temp_path, 'w') as temp_file:
+            json.dump(data, temp_file)
+        # Replace the old file in one step so readers never see partial data
+        os.rename(temp_path, path)
+
+    def _combined(self):
+        combined = self.snapshot()
+        if self.directory is None:
+            return combined
+        own_path = self._path(os.getpid())
+        by_name = dict((m.name, m) for m in self.metrics)
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            if path == own_path:
+                continue
+            pid = os.path.basename(path)[len('metrics-'):-len('.json')]
+            if pid.isdigit() and not _running(int(pid)):
+                # Left behind by a worker that has exited
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path) as data_file:
+                    data = json.load(data_file)
+            except (IOError, OSError, ValueError):
+                continue
+            for name, values in six.iteritems(data):
+                metric = by_name.get(name)
+                if metric is None:
+                    continue
+                merged = combined[name]
+                for key, value in values:
+                    key = tuple(key)
+                    merged[key] = metric._merge(merged.get(key), value)
+        return combined
+
+    def render(self):
+        """Return the values of all metrics (from all worker processes, if
+        configured) in the Prometheus text format.
+        """
+        combined = self._combined()
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP {} {}'.format(metric.name,
+                    metric.documentation))
+            lines.append('# TYPE {} {}'.format(metric.name,
+                    metric.type_name))
+            lines.extend(metric.samples(combined[metric.name]))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+request_latency = registry.histogram('evesrp_request_duration_seconds',
+        'Time taken to respond to requests.',
+        ('endpoint', 'method', 'format', 'status'))
+
+
+request_db_time = registry.histogram('evesrp_request_db_seconds',
+        'Time spent running database statements for each request.',
+        ('endpoint',))
+
+
+http_client_latency = registry.histogram(
+        'evesrp_http_client_duration_seconds',
+        'Time taken by outgoing HTTP requests.', ('host',))
+
+
+http_client_responses = registry.counter('evesrp_http_client_responses_total',
+        'Responses to outgoing HTTP requests.', ('host', 'status'))
+
+
+payout_recalculations = registry.counter(
+        'evesrp_payout_recalculations_total',
+        'Number of times the payout of a request was recalculated.',
+        ('trigger',))
+
+
+name_lookups = registry.counter('evesrp_name_lookups_total',
+        'Lookups of ship and location names, and if they were cached.',
+        ('lookup', 'result'))
+
+
+def record_http_response(response, *args, **kwargs):
+    """A :py:mod:`requests` response hook recording the latency and status of
+    outgoing requests.
+    """
+    host = six.moves.urllib.parse.urlparse(response.url).hostname or ''
+    http_client_latency.observe(response.elapsed.total_seconds(), host=host)
+    http_client_responses.inc(host=host, status=response.status_code)
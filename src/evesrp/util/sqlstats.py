@@ -1,40 +1,178 @@
-from __future__ import unicode_literals
+"""Per-request SQL statistics.
 
-"""This file was written by Dan Birken and discussed on his blog:
+Based on the counters written by Dan Birken and discussed on his blog:
     http://www.danbirken.com/quicktip/2014/04/16/improve-developer-habits-with-db-diagnostisc.html
 
     File source: https://gist.github.com/danbirken/10939933
+
+Each request gets its own :py:class:`DbStats` (as ``g.db_stats``) recording
+every statement run while handling it, grouped by the shape of the statement
+(the SQL with literal values and the lengths of ``IN`` lists removed).
 """
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from collections import OrderedDict
+import logging
+import re
+import sys
 import time
+
+from flask import current_app, g, has_app_context
 from sqlalchemy import engine
 from sqlalchemy import event
- 
-class DbStats():
-    def __init__(self):
+
+
+log = logging.getLogger(__name__)
+
+
+_whitespace = re.compile(r'\s+')
+_string_literal = re.compile(r"'(?:[^']|'')*'")
+_number_literal = re.compile(r'\b\d+(?:\.\d+)?\b')
+_placeholder_list = re.compile(
+        r'\(\s*(?:\?|%s|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+))*\s*\)')
+
+
+def normalize(statement):
+    """Reduce a SQL statement to its shape.
+
+    Literal values are replaced with ``?``, lists of parameters (like in an
+    ``IN`` clause) are collapsed to a single parameter, and whitespace is
+    collapsed.
+    """
+    statement = _string_literal.sub('?', statement)
+    statement = _number_literal.sub('?', statement)
+    statement = _placeholder_list.sub('(?)', statement)
+    return _whitespace.sub(' ', statement).strip()
+
+
+def _call_site():
+    # Find the innermost frame in this app, skipping this module
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module.startswith('evesrp') and module != __name__:
+            code = frame.f_code
+            return '{}:{} ({})'.format(module, frame.f_lineno, code.co_name)
+        frame = frame.f_back
+    return None
+
+
+class QueryShape(object):
+    """The statistics for one statement shape."""
+
+    def __init__(self, statement):
+        self.statement = statement
+        self.count = 0
+        self.total_time = 0
+        self.call_sites = OrderedDict()
+
+    def add(self, timing, call_site):
+        self.count += 1
+        self.total_time += timing
+        self.call_sites[call_site] = self.call_sites.get(call_site, 0) + 1
+
+    def as_dict(self):
+        return {
+            'statement': self.statement,
+            'count': self.count,
+            'total_time_ms': self.total_time * 1000,
+            'call_sites': [{'call_site': site, 'count': count}
+                    for site, count in self.call_sites.items()],
+        }
+
+
+class DbStats(object):
+    """The statements run while handling a single request."""
+
+    def __init__(self, path=None):
+        self.path = path
         self.clear()
- 
+
     def clear(self):
         self.total_queries = 0
         self.total_time = 0
- 
-    def add_query(self, timing):
+        self.shapes = OrderedDict()
+
+    def add_query(self, statement, timing, call_site=None):
+        shape = normalize(statement)
+        try:
+            stats = self.shapes[shape]
+        except KeyError:
+            stats = self.shapes[shape] = QueryShape(shape)
+        stats.add(timing, call_site)
         self.total_queries += 1
         self.total_time += timing
- 
-    def as_dict(self):
-        return {
+
+    def repeated(self, threshold):
+        """Return the :py:class:`QueryShape`\s that were run at least
+        ``threshold`` times, which usually means an N+1 query pattern.
+        """
+        return [s for s in self.shapes.values() if s.count >= threshold]
+
+    def server_timing(self):
+        """The value of a ``Server-Timing`` header for these statistics."""
+        return 'db;dur={:.3f};desc="{} queries"'.format(
+                self.total_time * 1000, self.total_queries)
+
+    def as_dict(self, repeat_threshold=None):
+        shapes = sorted(self.shapes.values(), key=lambda s: s.total_time,
+                reverse=True)
+        stats = {
+            'path': self.path,
             'total_queries': self.total_queries,
             'total_time_ms': self.total_time * 1000,
+            'statements': [s.as_dict() for s in shapes],
         }
- 
-DB_STATS = DbStats()
- 
+        if repeat_threshold is not None:
+            stats['repeated'] = [s.statement for s in
+                    self.repeated(repeat_threshold)]
+        return stats
+
+
+def current_stats():
+    """Return the :py:class:`DbStats` for the current request, or ``None``
+    when not handling a request.
+    """
+    if not has_app_context():
+        return None
+    return g.get('db_stats')
+
+
+def _explain(conn, statement, parameters):
+    if conn.dialect.name == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    else:
+        prefix = 'EXPLAIN '
+    # Use a DBAPI cursor directly so the EXPLAIN is not recorded itself
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return '\n'.join(' '.join(str(c) for c in row)
+                for row in cursor.fetchall())
+    finally:
+        cursor.close()
+
+
 @event.listens_for(engine.Engine, 'before_cursor_execute')
 def before_cursor_execute(conn, cursor, statement, parameters,
-                          context, exceutemany):
+                          context, executemany):
     context._query_start_time = time.time()
- 
+
+
 @event.listens_for(engine.Engine, 'after_cursor_execute')
 def after_cursor_execute(conn, cursor, statement, parameters,
-                         context, exceutemany):
-    DB_STATS.add_query(time.time() - context._query_start_time)
+                         context, executemany):
+    stats = current_stats()
+    if stats is None:
+        return
+    timing = time.time() - context._query_start_time
+    stats.add_query(statement, timing, _call_site())
+    threshold = current_app.config['SRP_SQL_SLOW_THRESHOLD']
+    if threshold is not None and timing >= threshold and not executemany \
+            and statement.lstrip()[:6].upper() == 'SELECT':
+        try:
+            plan = _explain(conn, statement, parameters)
+        except Exception as e:
+            plan = 'EXPLAIN failed: {}'.format(e)
+        log.warning("Slow statement (%.1f ms):\n%s\n%s", timing * 1000,
+                statement, plan)
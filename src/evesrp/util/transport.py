@@ -0,0 +1,198 @@
+"""A :py:class:`requests.Session` that copes with slow or failing hosts.
+
+Every request gets a default connect and read timeout. Idempotent requests
+failing with a connection error or a 5xx response are retried a few times,
+waiting a random (jittered) and increasing amount of time in between. Hosts
+that keep failing are skipped for a while by a per-host circuit breaker,
+and the ESI error limit headers are tracked so calls are paused before the
+error budget runs out (at which point ESI would block the app entirely).
+
+The circuit breaker and error budget are shared by every thread using the
+session.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from six.moves.urllib.parse import urlparse
+
+
+log = logging.getLogger(__name__)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of making a request to a host that has been failing."""
+    pass
+
+
+class ErrorBudgetExhausted(requests.exceptions.ConnectionError):
+    """Raised instead of making a request that could exceed the ESI error
+    limit.
+    """
+    pass
+
+
+class CircuitBreaker(object):
+    """Tracks consecutive failures for each host.
+
+    After ``threshold`` failures in a row the circuit for a host opens, and
+    requests to it fail immediately for ``reset_timeout`` seconds. After that
+    a single request is let through; if it succeeds the circuit closes again.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._failures = {}
+        self._opened = {}
+        self._lock = threading.Lock()
+
+    def allow(self, host):
+        with self._lock:
+            opened = self._opened.get(host)
+            if opened is None:
+                return True
+            if time.time() - opened < self.reset_timeout:
+                return False
+            # Let one request through, and keep the rest waiting for it
+            self._opened[host] = time.time()
+            return True
+
+    def success(self, host):
+        with self._lock:
+            self._failures.pop(host, None)
+            self._opened.pop(host, None)
+
+    def failure(self, host):
+        with self._lock:
+            failures = self._failures.get(host, 0) + 1
+            self._failures[host] = failures
+            if failures >= self.threshold:
+                if host not in self._opened:
+                    log.warning("Too many failures for %s, skipping it for "
+                            "%d seconds.", host, self.reset_timeout)
+                self._opened[host] = time.time()
+
+
+class ErrorBudget(object):
+    """Tracks the error budget ESI reports in the ``X-ESI-Error-Limit-Remain``
+    and ``X-ESI-Error-Limit-Reset`` headers of its responses.
+
+    :param int floor: Pause calls once the remaining budget drops to this.
+    :param int max_pause: The longest calls are paused for (in seconds).
+        Calls that would have to wait longer raise
+        :py:exc:`ErrorBudgetExhausted`.
+    """
+
+    def __init__(self, floor=10, max_pause=10):
+        self.floor = floor
+        self.max_pause = max_pause
+        self._remaining = None
+        self._reset_at = 0
+        self._lock = threading.Lock()
+
+    def update(self, response):
+        remain = response.headers.get('X-ESI-Error-Limit-Remain')
+        reset = response.headers.get('X-ESI-Error-Limit-Reset')
+        if remain is None or reset is None:
+            return
+        try:
+            remain = int(remain)
+            reset_at = time.time() + int(reset)
+        except ValueError:
+            return
+        with self._lock:
+            self._remaining = remain
+            self._reset_at = reset_at
+
+    def wait(self):
+        """Pause until the error budget has been reset, if it is too low."""
+        with self._lock:
+            if self._remaining is None or self._remaining > self.floor:
+                return
+            delay = self._reset_at - time.time()
+        if delay <= 0:
+            return
+        if delay > self.max_pause:
+            raise ErrorBudgetExhausted("The ESI error limit is nearly "
+                    "exhausted (resets in {:.0f} seconds).".format(delay))
+        log.info("Pausing %.1f seconds for the ESI error limit.", delay)
+        time.sleep(delay)
+
+
+class TransportSession(requests.Session):
+    """A :py:class:`requests.Session` with default timeouts, retries, a
+    circuit breaker and ESI error budget tracking.
+
+    :param timeout: The default timeout for requests, as a ``(connect,
+        read)`` tuple or a number of seconds.
+    :param int retries: How many times to retry a failed idempotent request.
+    :param float backoff: The base number of seconds to wait before retrying.
+        The wait is a random time up to ``backoff * 2 ** attempt``.
+    :param circuit_breaker: A :py:class:`CircuitBreaker`.
+    :param error_budget: An :py:class:`ErrorBudget`.
+    :param tuple esi_hosts: The hosts to apply ``error_budget`` to.
+    """
+
+    retry_methods = frozenset(('GET', 'HEAD', 'OPTIONS'))
+
+    def __init__(self, timeout=(3.05, 15), retries=2, backoff=0.5,
+            circuit_breaker=None, error_budget=None, esi_hosts=()):
+        super(TransportSession, self).__init__()
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        if circuit_breaker is None:
+            circuit_breaker = CircuitBreaker()
+        self.circuit_breaker = circuit_breaker
+        if error_budget is None:
+            error_budget = ErrorBudget()
+        self.error_budget = error_budget
+        self.esi_hosts = frozenset(esi_hosts)
+
+    def mount_pools(self, default_size, sizes=None):
+        """Mount adapters with ``default_size`` connections per pool, and
+        the pool sizes in ``sizes`` (a :py:class:`dict` of URL prefixes to
+        sizes) for specific hosts.
+        """
+        for prefix in ('https://', 'http://'):
+            self.mount(prefix, HTTPAdapter(pool_maxsize=default_size))
+        for prefix, size in (sizes or {}).items():
+            self.mount(prefix, HTTPAdapter(pool_maxsize=size))
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        host = urlparse(url).hostname
+        attempts = self.retries + 1 if method.upper() in self.retry_methods \
+                else 1
+        for attempt in range(attempts):
+            if not self.circuit_breaker.allow(host):
+                raise CircuitOpenError("{} is failing, not trying it "
+                        "again yet.".format(host))
+            if host in self.esi_hosts:
+                self.error_budget.wait()
+            last_try = attempt == attempts - 1
+            try:
+                response = super(TransportSession, self).request(method, url,
+                        **kwargs)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout):
+                self.circuit_breaker.failure(host)
+                if last_try:
+                    raise
+            else:
+                if host in self.esi_hosts:
+                    self.error_budget.update(response)
+                if response.status_code < 500:
+                    self.circuit_breaker.success(host)
+                    return response
+                self.circuit_breaker.failure(host)
+                if last_try:
+                    return response
+                response.close()
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
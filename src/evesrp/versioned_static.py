@@ -1,60 +1,235 @@
-import re
+from __future__ import absolute_import
+import gzip
 import hashlib
-from werkzeug.exceptions import NotFound
-from flask import Flask, send_file, safe_join, url_for, g, current_app, abort
-
-
-def get_file_hash(filename):
-    if not hasattr(g, 'static_hashes'):
-        g.static_hashes = {}
-    # Check the cache if not in debug mode
-    if not current_app.debug:
-        try:
-            return g.static_hashes[filename]
-        except KeyError:
-            pass
+import json
+import mimetypes
+import os
+import os.path
+import shutil
+from flask import Flask, send_from_directory, safe_join, url_for, \
+        current_app, request
+
+
+#: The name of the manifest file in the static folder.
+MANIFEST_NAME = 'manifest.json'
+
+
+#: Hashed files are sent with headers letting them be cached for a year.
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+#: Extensions of files worth compressing ahead of time. Images and newer font
+#: formats are compressed already.
+COMPRESSIBLE_EXTENSIONS = ('.js', '.css', '.map', '.json', '.svg', '.eot',
+                           '.ttf', '.otf', '.ico')
+
+
+def file_hash(path):
+    """Return the first 8 hex digits of the MD5 hash of a file."""
     hasher = hashlib.md5()
-    with open(safe_join(current_app.static_folder, filename), 'rb') as f:
-        hasher.update(f.read())
-    filehash = hasher.hexdigest()[:8]
-    g.static_hashes[filename] = filehash
-    return filehash
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()[:8]
+
+
+def _gzip_fresh(path):
+    # A gzipped copy older than its source was made from an older version
+    try:
+        return os.path.getmtime(path + '.gz') >= os.path.getmtime(path)
+    except OSError:
+        return False
+
+
+def hashed_filename(filename, filehash):
+    beginning, extension = filename.rsplit('.', 1)
+    return '{}.{}.{}'.format(beginning, filehash, extension)
+
+
+class StaticManifest(object):
+    """Maps the names of static files to names including a hash of their
+    contents.
+
+    Source maps are not listed, instead they are found by adding ``.map`` to
+    the hashed name of the file they belong to.
+
+    :param dict files: Hashed file names, keyed by the original names.
+    :param compressed: The original names of the files that also have an up
+        to date gzipped copy (with ``.gz`` appended to the name).
+    """
+
+    def __init__(self, files=None, compressed=None):
+        self.files = dict(files or {})
+        self.compressed = set(compressed or ())
+        self._originals = dict((v, k) for k, v in self.files.items())
+
+    @classmethod
+    def build(cls, static_folder):
+        """Create a manifest by hashing every file in ``static_folder``."""
+        files = {}
+        compressed = set()
+        for dirpath, dirnames, filenames in os.walk(static_folder):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                filename = os.path.relpath(path, static_folder).replace(
+                        os.sep, '/')
+                if filename.endswith('.gz'):
+                    if _gzip_fresh(path[:-3]):
+                        compressed.add(filename[:-3])
+                    continue
+                if filename == MANIFEST_NAME or filename.endswith('.map') \
+                        or '.' not in name:
+                    continue
+                files[filename] = hashed_filename(filename, file_hash(path))
+        # Source maps can be compressed too
+        compressed.intersection_update(set(files) |
+                set(f + '.map' for f in files))
+        return cls(files, compressed)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as f:
+            data = json.load(f)
+        return cls(data['files'], data.get('compressed'))
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({
+                'files': self.files,
+                'compressed': sorted(self.compressed),
+            }, f, indent=2, sort_keys=True)
+
+    def hashed(self, filename):
+        """Return the hashed name for a file, or ``None`` if it is unknown."""
+        return self.files.get(filename)
+
+    def original(self, hashed):
+        """Return the original name for a hashed file name (including source
+        maps), or ``None`` if it is unknown.
+        """
+        if hashed.endswith('.map'):
+            original = self._originals.get(hashed[:-4])
+            if original is not None:
+                return original + '.map'
+            return None
+        return self._originals.get(hashed)
+
+
+def compress_static(static_folder, manifest):
+    """Write gzipped copies of the compressible files in a manifest, and
+    record them in it.
+    """
+    for filename in manifest.files:
+        for name in (filename, filename + '.map'):
+            if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+            path = os.path.join(static_folder, *name.split('/'))
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as source:
+                with gzip.open(path + '.gz', 'wb') as dest:
+                    shutil.copyfileobj(source, dest)
+            # Not worth it if it does not get any smaller
+            if os.path.getsize(path + '.gz') < os.path.getsize(path):
+                manifest.compressed.add(name)
+            else:
+                os.remove(path + '.gz')
+                manifest.compressed.discard(name)
+
+
+def _newer_files(static_folder, since):
+    # The names of the static files changed after ``since``
+    for dirpath, dirnames, filenames in os.walk(static_folder):
+        for name in filenames:
+            if name == MANIFEST_NAME or name.endswith('.gz'):
+                continue
+            path = os.path.join(dirpath, name)
+            if os.path.getmtime(path) > since:
+                yield os.path.relpath(path, static_folder)
+
+
+def load_manifest(app):
+    """Load the manifest from the static folder, or build one if it is
+    missing or any of the static files have changed since it was written.
+    """
+    path = os.path.join(app.static_folder, MANIFEST_NAME)
+    if os.path.exists(path):
+        changed = next(_newer_files(app.static_folder,
+                os.path.getmtime(path)), None)
+        if changed is None:
+            manifest = StaticManifest.load(path)
+            manifest.compressed = set(name for name in manifest.compressed
+                    if _gzip_fresh(os.path.join(app.static_folder,
+                        *name.split('/'))))
+            return manifest
+        app.logger.warning(u"The static file manifest is older than {}, "
+                           u"hashing static files.".format(changed))
+    else:
+        app.logger.info(u"No static file manifest found, hashing static "
+                        u"files.")
+    return StaticManifest.build(app.static_folder)
 
 
 def static_file(filename, **kwargs):
     if current_app.config['SRP_STATIC_FILE_HASH']:
-        filehash = get_file_hash(filename)
-        beginning, extension = filename.rsplit('.', 1)
-        filename = '{}.{}.{}'.format(beginning, filehash, extension)
+        if current_app.debug:
+            # Files change while debugging, so hash them every time
+            filehash = file_hash(safe_join(current_app.static_folder,
+                    filename))
+            filename = hashed_filename(filename, filehash)
+        else:
+            filename = current_app.static_manifest.hashed(filename) or \
+                    filename
     return url_for('static', filename=filename, **kwargs)
 
 
 class VersionedStaticFlask(Flask):
 
+    static_manifest = None
+
     def send_static_file(self, filename):
         # Short-circuit if not adding file hashes
-        if not self.config['SRP_STATIC_FILE_HASH']:
+        if not self.config['SRP_STATIC_FILE_HASH'] or \
+                self.static_manifest is None:
             return super(VersionedStaticFlask, self).send_static_file(filename)
-        try:
-            return super(VersionedStaticFlask, self).send_static_file(filename)
-        except NotFound as e:
-            current_app.logger.debug(u"Checking for version-hashed file: {}".
-                    format(filename))
-            # Map file names are derived from the source file's name, so ignore
-            # the '.map' at the end.
-            if filename.endswith('.map'):
-                hashed_filename = filename[:-4]
-            else:
-                hashed_filename = filename
-            # Extract the file hash from the name
-            filename_match = re.match(r'(.+)\.([0-9a-fA-F]{8})(\.\w+)$',
-                    hashed_filename)
-            if filename_match is None:
-                current_app.logger.warning(u"Hash was unable to be found.")
-                raise e
-            requested_hash = filename_match.group(2)
-            real_filename = filename_match.group(1) + filename_match.group(3)
-            if filename != hashed_filename:
-                real_filename += '.map'
-            return super(VersionedStaticFlask, self).send_static_file(
-                    real_filename)
+        original = self.static_manifest.original(filename)
+        if original is None:
+            if self.debug:
+                original = self._debug_original(filename)
+            if original is None:
+                return super(VersionedStaticFlask, self).send_static_file(
+                        filename)
+        # The name changes whenever the contents do, so it can be cached
+        # forever.
+        options = {'cache_timeout': IMMUTABLE_MAX_AGE}
+        # The compressed copies may be out of date while debugging
+        compressed = not self.debug and \
+                original in self.static_manifest.compressed and \
+                'gzip' in request.accept_encodings
+        if compressed:
+            options['mimetype'] = mimetypes.guess_type(original)[0] or \
+                    'application/octet-stream'
+            response = send_from_directory(self.static_folder,
+                    original + '.gz', **options)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = send_from_directory(self.static_folder, original,
+                    **options)
+        response.headers['Cache-Control'] = \
+                'public, max-age={}, immutable'.format(IMMUTABLE_MAX_AGE)
+        if original in self.static_manifest.compressed:
+            response.vary.add('Accept-Encoding')
+        return response
+
+    def _debug_original(self, filename):
+        # The hashes are calculated on each request while debugging, so they
+        # are not in the manifest.
+        hashed = filename[:-4] if filename.endswith('.map') else filename
+        parts = hashed.rsplit('.', 2)
+        if len(parts) != 3 or len(parts[1]) != 8:
+            return None
+        original = '{}.{}'.format(parts[0], parts[2])
+        if hashed != filename:
+            original += '.map'
+        return original
+
@@ -1,16 +1,17 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 from flask import redirect, url_for, render_template, make_response, request,\
-        json, session, current_app
+        json, session, current_app, abort
 import flask_babel
 from flask_login import login_required, current_user
 from babel import get_locale_identifier, negotiate_locale, parse_locale
+from werkzeug.security import safe_str_cmp
 import six
-from .. import db, babel, sentry
+from .. import db, sentry
 from ..models import Request, ActionType
 from ..auth import PermissionType
 from ..auth.models import Permission, Division
-from ..util import jsonify, varies, locale
+from ..util import jsonify, varies, metrics
 
 
 if six.PY3:
@@ -23,6 +24,33 @@ def index():
     return redirect(url_for('requests.personal_requests'))
 
 
+def _metrics_token_valid():
+    token = current_app.config['SRP_METRICS_TOKEN']
+    if not token:
+        return False
+    allowed_ips = current_app.config['SRP_METRICS_ALLOWED_IPS']
+    if allowed_ips and request.remote_addr not in allowed_ips:
+        return False
+    scheme, _, given = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer':
+        return False
+    return safe_str_cmp(given.strip(), token)
+
+
+def prometheus_metrics():
+    """Metrics for this app in the Prometheus text format.
+
+    Only accessible with the bearer token in ``SRP_METRICS_TOKEN`` (from the
+    addresses in ``SRP_METRICS_ALLOWED_IPS``, if given) or by administrators.
+    """
+    if not _metrics_token_valid() and \
+            not (current_user.is_authenticated and current_user.admin):
+        abort(403)
+    response = make_response(metrics.registry.render())
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4'
+    return response
+
+
 @varies('Accept', 'X-Requested-With')
 def error_page(error):
     """View function for displaying error pages."""
@@ -79,7 +107,7 @@ def request_count(permission, statuses=None):
 
 
 def update_navbar(response):
-    if request.endpoint == 'static':
+    if request.endpoint == 'static' or response.is_streamed:
         return response
     if 'application/json' not in response.mimetype:
         return response
@@ -104,17 +132,16 @@ def update_navbar(response):
 def detect_language():
     if 'lang' in request.args:
         requested_locale = request.args['lang']
-        locales = [unicode(l) for l in babel.list_translations()]
-        locale = negotiate_locale([requested_locale,], locales)
+        locale = negotiate_locale([requested_locale,],
+                current_app.available_locales)
         session['locale'] = locale
         flask_babel.refresh()
 
 
 def locale_selector():
     requested_locale = session.get('locale')
-    supported_locales = [unicode(l) for l in locale.enabled_locales()]
     if requested_locale is not None and \
-            requested_locale not in supported_locales:
+            requested_locale not in current_app.enabled_locale_names:
         requested_locale = None
         del session['locale']
     return requested_locale
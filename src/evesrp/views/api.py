@@ -1,17 +1,23 @@
 from __future__ import absolute_import
-from flask import url_for, redirect, abort, request, Blueprint, current_app
-from flask_login import login_required, current_user
+from collections import defaultdict
+import datetime as dt
+from flask import url_for, redirect, abort, request, Blueprint, current_app,\
+        json, stream_with_context
+from flask_login import login_required, current_user, login_fresh
 import six
 from six.moves import filter, map
 from sqlalchemy.orm.exc import NoResultFound
 from itertools import chain
 
 from .. import ships, systems, db
-from ..models import Request, ActionType
+from ..models import Request, ActionType, Action, Modifier, \
+        AbsoluteModifier, RequestChange, request_archive, \
+        load_archived_requests
 from ..auth import PermissionType
 from ..auth.models import Division, User, Group, Pilot, Entity
-from .requests import PermissionRequestListing, PersonalRequests
-from ..util import jsonify, classproperty
+from .requests import PermissionRequestListing, PersonalRequests, \
+        permitted_divisions, parse_fields
+from ..util import jsonify, classproperty, utc
 
 
 api = Blueprint('api', __name__)
@@ -185,7 +191,299 @@ def ship_list():
     return jsonify(ships=ship_objs)
 
 
+@api.route('/debug/sql/')
+@login_required
+def sql_profiles():
+    """List the SQL statistics of the most recent requests handled by this
+    process, newest first.
+
+    Each statement shape has its number of runs, total time and call sites.
+    The shapes run often enough to be possible N+1 queries are listed under
+    ``repeated``. This method is only accesible to administrators.
+    """
+    if not current_user.admin:
+        abort(403)
+    threshold = current_app.config['SRP_SQL_REPEAT_THRESHOLD']
+    profiles = [stats.as_dict(threshold) for stats in
+            reversed(current_app.sql_profiles)]
+    return jsonify(requests=profiles)
+
+
+def _action_dict(action):
+    return {
+        u'id': action.id,
+        u'type': action.type_,
+        u'note': action.note or u'',
+        u'timestamp': action.timestamp,
+        u'user_id': action.user_id,
+    }
+
+
+def _modifier_dict(modifier):
+    if modifier.voided:
+        void = {
+            u'user_id': modifier.voided_user_id,
+            u'timestamp': modifier.voided_timestamp,
+        }
+    else:
+        void = False
+    return {
+        u'id': modifier.id,
+        u'type': u'absolute' if isinstance(modifier, AbsoluteModifier) \
+                else u'relative',
+        u'value': modifier.value,
+        u'note': modifier.note or u'',
+        u'timestamp': modifier.timestamp,
+        u'user_id': modifier.user_id,
+        u'void': void,
+    }
+
+
+@api.route('/requests/changes')
+@login_required
+def request_changes():
+    """List the requests that have changed since a given point.
+
+    The ``since`` query argument is the ``cursor`` value returned by a previous
+    call (or 0 to start from the beginning). At most ``limit`` entries of the
+    change log are read per call, and each request changed by them is
+    returned once, ordered by when it was last changed. Each request is sent
+    as it currently is, with all of its actions and modifiers, so a request
+    changed again later is just sent again. Requests that have been archived
+    are returned as an object with just the ``id``, ``href`` and ``archived``
+    set to ``true`` (they can still be fetched from :py:func:`request_batch`).
+    Requests that have been deleted are returned as tombstones: an object
+    with just the ``id`` and ``deleted`` set to ``true``. If ``more`` is
+    true, there are further changes to fetch with the returned cursor.
+
+    Only requests in divisions where the user has been granted an elevated
+    permission (and their own requests) are included.
+    """
+    try:
+        since = int(request.args.get('since', 0))
+        limit = int(request.args.get('limit',
+                current_app.config['SRP_CHANGES_BATCH_SIZE']))
+    except ValueError:
+        abort(400)
+    limit = max(1, min(limit, current_app.config['SRP_CHANGES_BATCH_SIZE']))
+    divisions = permitted_divisions(PermissionType.elevated)
+    # Skip very recent changes, as transactions that have been assigned lower
+    # sequence numbers may not have been committed yet.
+    settled = dt.datetime.now(utc) - dt.timedelta(
+            seconds=current_app.config['SRP_CHANGES_SETTLE_SECONDS'])
+    # Page over the log entries themselves, so that the cursor never skips
+    # over an entry.
+    entries = db.session.query(RequestChange.id, RequestChange.request_id)\
+            .filter(RequestChange.id > since)\
+            .filter(RequestChange.timestamp <= settled)\
+            .filter(db.or_(
+                RequestChange.division_id.in_(divisions),
+                RequestChange.submitter_id == current_user.id))\
+            .order_by(RequestChange.id)\
+            .limit(limit + 1)\
+            .all()
+    more = len(entries) > limit
+    entries = entries[:limit]
+    if entries:
+        cursor = entries[-1].id
+    else:
+        cursor = since
+    # Each request once, in the order of its last change in this batch
+    last_changes = {}
+    for entry in entries:
+        last_changes[entry.request_id] = entry.id
+    request_ids = sorted(last_changes, key=last_changes.get)
+    srp_requests = {}
+    archived = set()
+    actions = defaultdict(list)
+    modifiers = defaultdict(list)
+    if request_ids:
+        srp_requests = {r.id: r for r in Request.query\
+                .filter(Request.id.in_(request_ids))}
+        missing = [i for i in request_ids if i not in srp_requests]
+        if missing:
+            archived = set(row.id for row in
+                    db.session.query(request_archive.c.id)\
+                    .filter(request_archive.c.id.in_(missing)))
+        action_query = Action.query.filter(
+                Action.request_id.in_(request_ids))\
+                .order_by(Action.timestamp)
+        modifier_query = db.session.query(
+                    db.with_polymorphic(Modifier, '*'))\
+                .filter(Modifier.request_id.in_(request_ids))\
+                .order_by(Modifier.timestamp)
+        for action in action_query:
+            actions[action.request_id].append(_action_dict(action))
+        for modifier in modifier_query:
+            modifiers[modifier.request_id].append(_modifier_dict(modifier))
+    changes = []
+    for request_id in request_ids:
+        srp_request = srp_requests.get(request_id)
+        if request_id in archived:
+            changes.append({
+                u'id': request_id,
+                u'href': url_for('requests.get_request_details',
+                        request_id=request_id),
+                u'archived': True,
+            })
+            continue
+        if srp_request is None:
+            changes.append({u'id': request_id, u'deleted': True})
+            continue
+        changes.append({
+            u'id': srp_request.id,
+            u'href': url_for('requests.get_request_details',
+                    request_id=srp_request.id),
+            u'status': srp_request.status,
+            u'base_payout': srp_request.base_payout.currency(),
+            u'payout': srp_request.payout.currency(),
+            u'division_id': srp_request.division_id,
+            u'submitter_id': srp_request.submitter_id,
+            u'pilot_id': srp_request.pilot_id,
+            u'killmail_url': srp_request.killmail_url,
+            u'kill_timestamp': srp_request.kill_timestamp,
+            u'submit_timestamp': srp_request.timestamp,
+            u'ship': srp_request.ship_type,
+            u'system': srp_request.system,
+            u'constellation': srp_request.constellation,
+            u'region': srp_request.region,
+            u'corporation': srp_request.corporation,
+            u'alliance': srp_request.alliance,
+            u'actions': actions[request_id],
+            u'modifiers': modifiers[request_id],
+        })
+    return jsonify(changes=changes, cursor=cursor, more=more)
+
+
+@api.route('/requests/')
+@login_required
+def request_batch():
+    """Get the details of many requests at once.
+
+    The ``ids`` query argument is a comma separated list of request IDs (up
+    to ``SRP_BATCH_REQUEST_LIMIT`` of them). The response is a JSON array of
+    the same objects returned for a single request's details, in the order
+    requested. Archived requests are read from the archive tables and have
+    ``archived`` set to ``true`` (and no valid actions). Requests that do not
+    exist or that the user does not have access to are left out.
+    """
+    try:
+        request_ids = [int(i) for i in request.args.get('ids', '').split(',')
+                       if i != '']
+    except ValueError:
+        abort(400)
+    if len(request_ids) > current_app.config['SRP_BATCH_REQUEST_LIMIT']:
+        abort(400)
+    # Remove duplicates while preserving the requested order
+    seen = set()
+    request_ids = [i for i in request_ids if not (i in seen or seen.add(i))]
+    srp_requests = {}
+    modifiers = defaultdict(list)
+    if request_ids:
+        srp_requests = {r.id: r for r in Request.query\
+                .filter(Request.id.in_(request_ids))\
+                .options(
+                    db.undefer('details'),
+                    db.joinedload('pilot'),
+                    db.joinedload('submitter'),
+                    db.joinedload('division'),
+                    db.subqueryload('actions').joinedload('user'))}
+        modifier_query = db.session.query(db.with_polymorphic(Modifier, '*'))\
+                .filter(Modifier.request_id.in_(request_ids))\
+                .options(
+                    db.joinedload('user'),
+                    db.joinedload('voided_user'))\
+                .order_by(Modifier.timestamp.desc())
+        for modifier in modifier_query:
+            modifiers[modifier.request_id].append(modifier)
+        archived = load_archived_requests(i for i in request_ids
+                if i not in srp_requests)
+        for request_id, srp_request in six.iteritems(archived):
+            srp_requests[request_id] = srp_request
+            modifiers[request_id] = srp_request.all_modifiers
+    permissions = current_user.division_permissions()
+    can_audit = any(PermissionType.audit in p for p in permissions.values())
+    fresh = login_fresh()
+    visible = []
+    for request_id in request_ids:
+        srp_request = srp_requests.get(request_id)
+        if srp_request is None:
+            continue
+        # Same rules as requests.get_request_details
+        if srp_request.submitter_id != current_user.id:
+            division_permissions = permissions[srp_request.division_id]
+            if not fresh:
+                continue
+            if PermissionType.admin not in division_permissions and \
+                    PermissionType.review not in division_permissions and \
+                    PermissionType.pay not in division_permissions and \
+                    not can_audit:
+                continue
+        visible.append(srp_request)
+
+    def serialize(srp_request):
+        if srp_request.archived:
+            valid_actions = []
+        else:
+            division_permissions = permissions[srp_request.division_id]
+            valid_actions = [action for action, needed in
+                    six.iteritems(Request.state_rules[srp_request.status])
+                    if division_permissions.intersection(needed)]
+        detail = srp_request._json(False)
+        detail[u'actions'] = [a._json(True) for a in srp_request.actions]
+        detail[u'modifiers'] = [m._json(True) for m in
+                modifiers[srp_request.id]]
+        detail[u'valid_actions'] = valid_actions
+        detail[u'transformed'] = dict(srp_request.transformed)
+        detail[u'archived'] = srp_request.archived
+        return json.dumps(detail)
+
+    def generate():
+        # Each request is only serialized as it is sent
+        yield u'['
+        for index, srp_request in enumerate(visible):
+            if index > 0:
+                yield u','
+            yield serialize(srp_request)
+        yield u']'
+
+    return current_app.response_class(stream_with_context(generate()),
+            mimetype='application/json')
+
+
 class FiltersRequestListing(object):
+
+    #: Functions creating each of the keys for a request, given the
+    #: :py:class:`~.Request`.
+    _columns = {
+        u'id': lambda r: r.id,
+        u'href': lambda r: url_for('requests.get_request_details',
+                request_id=r.id),
+        u'pilot': lambda r: r.pilot.name,
+        u'corporation': lambda r: r.corporation,
+        u'alliance': lambda r: r.alliance,
+        u'ship': lambda r: r.ship_type,
+        u'status': lambda r: r.status.name,
+        u'payout': lambda r: r.payout.currency(),
+        u'kill_timestamp': lambda r: r.kill_timestamp,
+        u'submit_timestamp': lambda r: r.timestamp,
+        u'division': lambda r: r.division.name,
+        u'submitter_id': lambda r: r.submitter_id,
+        u'system': lambda r: r.system,
+        u'constellation': lambda r: r.constellation,
+        u'region': lambda r: r.region,
+    }
+
+    @classproperty
+    def field_attributes(cls):
+        attributes = {}
+        for key in cls._columns:
+            if key == u'submitter_id':
+                attributes[key] = u'submitter_id'
+            else:
+                attributes[key] = Request.json_attributes[key]
+        return attributes
+
     @classproperty
     def _load_options(self):
         """Returns a sequence of
@@ -200,43 +498,158 @@ class FiltersRequestListing(object):
                     'alliance',
                     'ship_type',
                     'status',
-                    'base_payout',
+                    'payout',
                     'kill_timestamp',
                     'timestamp',
                     'division_id',
                     'submitter_id',
                     'system',
+                    'constellation',
+                    'region',
                 ),
-                db.Load(Division).joinedload('name'),
-                db.Load(Pilot).joinedload('name'),
-                db.Load(User).joinedload('id')
+                db.joinedload('pilot').load_only('name'),
+                db.joinedload('division').load_only('name'),
         )
 
-
     def dispatch_request(self, filters='', **kwargs):
+        self.fields = parse_fields(self.field_attributes)
+        if self.fields is None:
+            columns = self._columns
+        else:
+            # The ID is always included
+            columns = {k: v for k, v in six.iteritems(self._columns)
+                       if k in self.fields or k == u'id'}
+
+        if request.args.get('layout') == u'columnar':
+            return self.columnar_response(sorted(columns))
+
         def request_dict(request):
-            payout = request.payout
-            return {
-                u'id': request.id,
-                u'href': url_for('requests.get_request_details',
-                    request_id=request.id),
-                u'pilot': request.pilot.name,
-                u'corporation': request.corporation,
-                u'alliance': request.alliance,
-                u'ship': request.ship_type,
-                u'status': request.status.name,
-                u'payout': payout.currency(),
-                u'kill_timestamp': request.kill_timestamp,
-                u'submit_timestamp': request.timestamp,
-                u'division': request.division.name,
-                u'submitter_id': request.submitter.id,
-                u'system': request.system,
-                u'constellation': request.constellation,
-                u'region': request.region,
-            }
+            return {k: column(request) for k, column in
+                    six.iteritems(columns)}
 
         return jsonify(requests=map(request_dict, self.requests({})))
 
+    #: Keys with values repeated often enough that they are sent as indices
+    #: into a dictionary of strings in columnar responses.
+    _dictionary_columns = frozenset((
+        u'pilot',
+        u'corporation',
+        u'alliance',
+        u'ship',
+        u'status',
+        u'division',
+        u'system',
+        u'constellation',
+        u'region',
+    ))
+
+    @staticmethod
+    def _column_expressions(pilot, division):
+        """Returns a dict of the SQL expressions for each of the keys of a
+        columnar response.
+
+        :param pilot: The alias of :py:class:`~.Pilot` joined to requests.
+        :param division: The alias of :py:class:`~.Division` joined to
+            requests.
+        """
+        return {
+            u'id': Request.id,
+            u'pilot': pilot.name,
+            u'corporation': Request.corporation,
+            u'alliance': Request.alliance,
+            u'ship': Request.ship_type,
+            u'status': Request.status,
+            u'payout': Request.payout,
+            u'kill_timestamp': Request.kill_timestamp,
+            u'submit_timestamp': Request.timestamp,
+            u'division': division.name,
+            u'submitter_id': Request.submitter_id,
+            u'system': Request.system,
+            u'constellation': Request.constellation,
+            u'region': Request.region,
+        }
+
+    def columnar_response(self, keys):
+        """Stream the matching requests in a columnar layout.
+
+        Instead of an object per request, each chunk of rows has an array of
+        values for each key. Keys in :py:attr:`_dictionary_columns` are sent as
+        indices into a per-key dictionary, and each chunk only has the
+        dictionary entries that are new in that chunk. The rows are selected
+        as plain tuples, skipping the ORM entirely.
+
+        :param list keys: The keys to include.
+        """
+        pilot = db.aliased(Pilot)
+        division = db.aliased(Division)
+        expressions = self._column_expressions(pilot, division)
+        # href is built from the ID instead of being selected
+        selected = [k for k in keys if k != u'href']
+        query = self.requests({}).with_entities(
+                *[expressions[k].label(k) for k in selected])
+        if u'pilot' in selected:
+            query = query.join(pilot, Request.pilot_id == pilot.id)
+        if u'division' in selected:
+            query = query.join(division, Request.division_id == division.id)
+        statement = query.statement.execution_options(stream_results=True)
+        chunk_size = current_app.config['SRP_COLUMNAR_CHUNK_SIZE']
+        # Build the URL once and substitute each ID into it, instead of
+        # calling url_for for every row.
+        href_prefix, href_suffix = url_for('requests.get_request_details',
+                request_id=0).rsplit(u'0', 1)
+        dictionary_keys = sorted(self._dictionary_columns.intersection(keys))
+        # The index of each value in the dictionaries sent so far
+        indices = {key: {} for key in dictionary_keys}
+        # The dictionary entries added in the current chunk
+        new_values = {}
+
+        def encode(key, value):
+            if key == u'status':
+                value = value.name
+            index = indices[key].get(value)
+            if index is None:
+                index = len(indices[key])
+                indices[key][value] = index
+                new_values[key].append(value)
+            return index
+
+        def generate():
+            yield u'{{"fields": {}, "dictionary_fields": {}, "chunks": ['.format(
+                    json.dumps(keys), json.dumps(dictionary_keys))
+            result = db.session.execute(statement)
+            first = True
+            while True:
+                rows = result.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for key in dictionary_keys:
+                    new_values[key] = []
+                columns = {}
+                for key in selected:
+                    if key in indices:
+                        columns[key] = [encode(key, row[key]) for row in rows]
+                    elif key == u'payout':
+                        columns[key] = [row[key].currency() for row in rows]
+                    else:
+                        columns[key] = [row[key] for row in rows]
+                if u'href' in keys:
+                    columns[u'href'] = [u'{}{}{}'.format(href_prefix,
+                            row[u'id'], href_suffix) for row in rows]
+                chunk = {
+                    u'count': len(rows),
+                    u'dictionaries': dict(new_values),
+                    u'columns': columns,
+                }
+                if not first:
+                    yield u','
+                first = False
+                yield json.dumps(chunk)
+            result.close()
+            yield u']}'
+
+        return current_app.response_class(stream_with_context(generate()),
+                mimetype='application/json')
+
 
 class APIRequestListing(FiltersRequestListing, PermissionRequestListing): pass
 
@@ -283,30 +696,29 @@ def _first(o):
 @filters.route('/ship/')
 @login_required
 def filter_ships():
-    ships = db.session.query(Request.ship_type).distinct()
-    return jsonify(key=u'ship', ship=map(_first, ships))
+    ships = Request.distinct_names('ship_type')
+    return jsonify(key=u'ship', ship=sorted(ships))
 
 
 @filters.route('/system/')
 @login_required
 def filter_systems():
-    systems = db.session.query(Request.system).distinct()
-    return jsonify(key=u'system', system=map(_first, systems))
+    systems = Request.distinct_names('system')
+    return jsonify(key=u'system', system=sorted(systems))
 
 
 @filters.route('/constellation/')
 @login_required
 def filter_constellations():
-    constellations = db.session.query(Request.constellation).distinct()
-    return jsonify(key=u'constellation',
-            constellation=map(_first, constellations))
+    constellations = Request.distinct_names('constellation')
+    return jsonify(key=u'constellation', constellation=sorted(constellations))
 
 
 @filters.route('/region/')
 @login_required
 def filter_regions():
-    regions = db.session.query(Request.region).distinct()
-    return jsonify(key=u'region', region=map(_first, regions))
+    regions = Request.distinct_names('region')
+    return jsonify(key=u'region', region=sorted(regions))
 
 
 @filters.route('/details/<path:query>')
@@ -327,17 +739,16 @@ def filter_pilots():
 @filters.route('/corporation/')
 @login_required
 def filter_corps():
-    corps = db.session.query(Request.corporation).distinct()
-    return jsonify(key=u'corporation', corporation=map(_first, corps))
+    corps = Request.distinct_names('corporation')
+    return jsonify(key=u'corporation', corporation=sorted(corps))
 
 
 @filters.route('/alliance/')
 @login_required
 def filter_alliances():
-    alliances = db.session.query(Request.alliance)\
-            .filter(Request.alliance != None)\
-            .distinct()
-    return jsonify(key=u'alliance', alliance=map(_first, alliances))
+    alliances = Request.distinct_names('alliance')
+    alliances.discard(None)
+    return jsonify(key=u'alliance', alliance=sorted(alliances))
 
 
 @filters.route('/division/')
@@ -12,7 +12,7 @@ from wtforms.validators import AnyOf
 from sqlalchemy.orm.exc import NoResultFound
 from .. import csrf, db
 from ..auth import AnonymousUser
-from ..auth.models import User, APIKey
+from ..auth.models import APIKey
 from ..util import ensure_unicode, jsonify, xmlify
 
 
@@ -27,9 +27,12 @@ login_manager.anonymous_user = AnonymousUser
 def login_loader(userid):
     """Pull a user object from the database.
 
-    This is used for loading users from existing sessions.
+    This is used for loading users from existing sessions. Users are loaded
+    through :py:attr:`current_app.user_cache <evesrp.auth.user_cache>`, so
+    most requests do not need to query for them.
     """
-    return User.query.get(int(userid))
+    return current_app.user_cache.load(int(userid),
+            session.get('user_generation', 0))
 
 
 @login_manager.request_loader
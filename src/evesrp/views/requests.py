@@ -1,10 +1,18 @@
 from __future__ import absolute_import
 from collections import OrderedDict, defaultdict
+import csv
+import datetime as dt
+from decimal import Decimal
+import hashlib
+import io
 import re
+import time
+import zlib
 
 import babel
 from flask import render_template, abort, url_for, flash, Markup, request,\
-    redirect, current_app, Blueprint, Markup, json, make_response
+    redirect, current_app, Blueprint, Markup, json, make_response,\
+    stream_with_context
 from flask.views import View
 from flask_babel import gettext, lazy_gettext, get_locale
 from flask_login import login_required, fresh_login_required, \
@@ -12,6 +20,9 @@ from flask_login import login_required, fresh_login_required, \
 from flask_sqlalchemy import Pagination
 from flask_wtf import Form
 import iso8601
+from itsdangerous import URLSafeTimedSerializer, BadSignature, \
+        SignatureExpired
+from requests.exceptions import RequestException
 import six
 from six.moves import map
 from wtforms.fields import SelectField, SubmitField, TextAreaField, HiddenField
@@ -22,9 +33,13 @@ from wtforms.validators import InputRequired, AnyOf, URL, ValidationError,\
 from .login import login_manager
 from .. import db
 from ..models import Request, Modifier, Action, ActionType, ActionError,\
-        ModifierError, AbsoluteModifier, RelativeModifier
+        ModifierError, AbsoluteModifier, RelativeModifier, RequestChange,\
+        archive_horizon, requests_with_archive, restore_request,\
+        load_archived_request,\
+        KillmailSubmission, SubmissionStatus
 from ..util import xmlify, jsonify, classproperty, PrettyDecimal, varies,\
         ensure_unicode, parse_datetime
+from ..util.enum import EnumSymbol
 from ..auth import PermissionType
 from ..auth.models import Division, Pilot, Permission, User, Group, Note,\
     APIKey, users_groups
@@ -37,6 +52,120 @@ if six.PY3:
 blueprint = Blueprint('requests', __name__)
 
 
+def parse_fields(allowed):
+    """Parse the ``fields`` query argument into a set of keys.
+
+    Aborts with a 400 error if any of the keys are not in ``allowed``.
+
+    :param allowed: The valid keys.
+    :returns: The requested keys, or ``None`` if there is no ``fields``
+        argument.
+    :rtype: :py:class:`frozenset`
+    """
+    if 'fields' not in request.args:
+        return None
+    fields = set()
+    for field in request.args['fields'].split(','):
+        field = field.strip()
+        if field != u'':
+            fields.add(field)
+    unknown = fields.difference(allowed)
+    if unknown:
+        # TRANS: Error message shown when fields that do not exist are
+        # TRANS: requested from the API.
+        abort(400, gettext(u"Unknown fields: %(fields)s.",
+                fields=u', '.join(sorted(unknown))))
+    return frozenset(fields)
+
+
+def sparse_load_options(fields, attributes):
+    """Create the load options for loading only the attributes needed for the
+    given JSON keys.
+
+    Columns not needed are left unloaded and relationships are only joined
+    when requested.
+
+    :param fields: The requested keys.
+    :param dict attributes: A mapping of keys to :py:class:`~.Request`
+        attribute names. Keys not in this mapping are ignored.
+    :rtype: list
+    """
+    mapper = db.inspect(Request)
+    columns = set(('id',))
+    relationships = set()
+    for field in fields:
+        attr = attributes.get(field)
+        if attr is None:
+            continue
+        prop = mapper.attrs[attr]
+        if hasattr(prop, 'mapper'):
+            # Relationships need the foreign key column loaded as well
+            relationships.add(attr)
+            columns.update(c.key for c in prop.local_columns)
+        else:
+            columns.add(attr)
+    options = [db.Load(Request).load_only(*columns)]
+    options.extend(db.joinedload(attr) for attr in relationships)
+    return options
+
+
+def _export_value(value):
+    """Convert a value from an export query into a JSON and CSV friendly
+    value.
+    """
+    if isinstance(value, dt.datetime):
+        return value.isoformat()
+    elif isinstance(value, Decimal):
+        return six.text_type(value)
+    elif isinstance(value, EnumSymbol):
+        return value.name
+    return value
+
+
+class _CSVSerializer(object):
+    """Formats chunks of rows as CSV text (encoded as UTF-8)."""
+
+    def __init__(self, keys):
+        self.keys = keys
+        if six.PY2:
+            self.buffer = io.BytesIO()
+        else:
+            self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+
+    def header(self):
+        return self([self.keys])
+
+    def __call__(self, rows):
+        for row in rows:
+            if six.PY2:
+                row = [v.encode('utf-8') if isinstance(v, unicode) else v
+                       for v in row]
+            self.writer.writerow(row)
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        if six.PY2:
+            return data
+        return data.encode('utf-8')
+
+
+def _ndjson_lines(keys, rows):
+    lines = [json.dumps(dict(zip(keys, row))) for row in rows]
+    lines.append(u'')
+    return u'\n'.join(lines).encode('utf-8')
+
+
+def _gzip_chunks(chunks):
+    """Compress an iterable of byte strings with gzip as it is consumed."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
 class RequestListing(View):
     """Abstract class for lists of :py:class:`~evesrp.models.Request`\s.
 
@@ -53,6 +182,20 @@ class RequestListing(View):
     # TRANS: The default title for a page with atable listing SRP requests.
     title = lazy_gettext(u'Requests')
 
+    #: The keys requested with the ``fields`` query argument for JSON
+    #: responses, or ``None`` to include everything.
+    fields = None
+
+    @classproperty
+    def field_attributes(cls):
+        """The keys that may be requested with the ``fields`` query argument,
+        mapped to the :py:class:`~.Request` attributes they need.
+        """
+        attributes = dict(Request.json_attributes)
+        for key in Request.json_extended_keys:
+            attributes[key] = None
+        return attributes
+
     @staticmethod
     def parse_filter(filter_string):
         filters = {}
@@ -140,6 +283,34 @@ class RequestListing(View):
                 filter_strings.append(attr + '/' + ','.join(values))
         return '/'.join(filter_strings)
 
+    @staticmethod
+    def includes_archive(filters):
+        """Returns whether archived requests could match ``filters``.
+
+        Only finalized requests are archived, so the archive is skipped when
+        the status filter has no finalized statuses, or when a timestamp
+        filter only covers times after the newest archived request.
+        """
+        statuses = filters.get('status')
+        if statuses and not ActionType.finalized.intersection(statuses):
+            return False
+        horizon = archive_horizon()
+        if horizon is None:
+            return False
+        # Compare everything as naive UTC times
+        naive = lambda d: dt.datetime(*d.utctimetuple()[0:6])
+        for attr, newest in zip(('submit_timestamp', 'kill_timestamp'),
+                horizon):
+            for value in filters.get(attr, ()):
+                try:
+                    start, _ = parse_datetime(value)
+                except iso8601.ParseError:
+                    # requests() reports the error
+                    continue
+                if naive(start) > naive(newest):
+                    return False
+        return True
+
     def requests(self, filters):
         """Returns a list :py:class:`~.Request`\s belonging to
         the specified :py:class:`~.Division`, or all divisions if
@@ -149,13 +320,22 @@ class RequestListing(View):
         :rtype: iterable
         """
         # Start with a basic query for requests
-        requests = Request.query.options(*self._load_options)
-        requests = requests.order_by(Request.timestamp.desc())
+        if self.fields is None:
+            load_options = self._load_options
+        else:
+            load_options = sparse_load_options(self.fields,
+                    self.field_attributes)
         # Set default filters values
         filters.setdefault('page', 1)
         filters.setdefault('sort', '-submit_timestamp')
+        if self.includes_archive(filters):
+            requests = requests_with_archive()
+        else:
+            requests = Request.query
+        requests = requests.options(*load_options)
+        requests = requests.order_by(Request.timestamp.desc())
         # Apply the filters
-        known_attrs = ('page', 'division', 'alliance', 'corporation',
+        known_attrs = ('page', 'id', 'division', 'alliance', 'corporation',
                 'pilot', 'system', 'constellation', 'region', 'ship_type',
                 'status', 'details', 'payout', 'base_payout', 'kill_timestamp',
                 'submit_timestamp')
@@ -268,9 +448,11 @@ class RequestListing(View):
                         requests = requests.join(mapped)
                 else:
                     if grouped['=']:
-                        requests = requests.filter(column.in_(grouped['=']))
+                        requests = requests.filter(Request.name_clause(
+                                real_attr, grouped['=']))
                     if grouped['-']:
-                        requests = requests.filter(~column.in_(grouped['-']))
+                        requests = requests.filter(~Request.name_clause(
+                                real_attr, grouped['-']))
                     for lt_val in grouped['<']:
                         requests = requests.filter(column < lt_val)
                     for gt_val in grouped['>']:
@@ -284,11 +466,191 @@ class RequestListing(View):
                     u'warning')
         return requests
 
+    @staticmethod
+    def export_columns():
+        """Returns an :py:class:`~collections.OrderedDict` of the column
+        names and SQL expressions included in exports.
+
+        Pilots and divisions are referred to through the aliases
+        ``export_pilot`` and ``export_division``, which have to be joined to
+        the query.
+        """
+        pilot = db.aliased(Pilot, name='export_pilot')
+        division = db.aliased(Division, name='export_division')
+        modifier = Modifier.__table__
+
+        def modifier_sum(modifier_class):
+            table = modifier_class.__table__
+            total = db.select([db.func.sum(table.c.value)])\
+                    .select_from(modifier.join(table,
+                            modifier.c.id == table.c.id))\
+                    .where(modifier.c.request_id == Request.id)\
+                    .where(db.or_(
+                            modifier.c.voided_user_id == None,
+                            modifier.c.voided_timestamp == None))\
+                    .as_scalar()
+            return db.func.coalesce(total, 0)
+
+        return pilot, division, OrderedDict((
+            (u'id', Request.id),
+            (u'kill_timestamp', Request.kill_timestamp),
+            (u'submit_timestamp', Request.timestamp),
+            (u'pilot', pilot.name),
+            (u'corporation', Request.corporation),
+            (u'alliance', Request.alliance),
+            (u'ship', Request.ship_type),
+            (u'system', Request.system),
+            (u'constellation', Request.constellation),
+            (u'region', Request.region),
+            (u'division', division.name),
+            (u'status', Request.status),
+            (u'killmail_url', Request.killmail_url),
+            (u'base_payout', Request.base_payout),
+            (u'absolute_modifiers', modifier_sum(AbsoluteModifier)),
+            (u'relative_modifiers', modifier_sum(RelativeModifier)),
+            (u'payout', Request.payout),
+        ))
+
+    def export(self, requests, export_format):
+        """Stream every request matched by a query as CSV or newline
+        delimited JSON.
+
+        The rows are selected as plain columns and read in chunks from a
+        server-side cursor, so memory use does not grow with the number of
+        requests exported. If the client accepts it, the response is gzipped
+        as it is generated.
+
+        :param requests: The query of :py:class:`~.Request`\s to export.
+        :param str export_format: Either ``'csv'`` or ``'ndjson'``.
+        """
+        pilot, division, columns = self.export_columns()
+        query = requests\
+                .with_entities(*[c.label(k) for k, c in
+                        six.iteritems(columns)])\
+                .join(pilot, Request.pilot_id == pilot.id)\
+                .join(division, Request.division_id == division.id)
+        statement = query.statement.execution_options(stream_results=True)
+        chunk_size = current_app.config['SRP_EXPORT_CHUNK_SIZE']
+        keys = list(columns)
+        if export_format == 'csv':
+            serialize = _CSVSerializer(keys)
+            mimetype = 'text/csv'
+        else:
+            serialize = _ndjson_lines
+            mimetype = 'application/x-ndjson'
+
+        def generate():
+            if export_format == 'csv':
+                yield serialize.header()
+            result = db.session.execute(statement)
+            while True:
+                rows = result.fetchmany(chunk_size)
+                if not rows:
+                    break
+                values = [[_export_value(row[k]) for k in keys]
+                          for row in rows]
+                if export_format == 'csv':
+                    yield serialize(values)
+                else:
+                    yield serialize(keys, values)
+            result.close()
+
+        chunks = stream_with_context(generate())
+        headers = {
+            'Content-Disposition': 'attachment; filename=requests.{}'.format(
+                    export_format),
+        }
+        if 'gzip' in request.accept_encodings:
+            chunks = _gzip_chunks(chunks)
+            headers['Content-Encoding'] = 'gzip'
+        response = current_app.response_class(chunks, mimetype=mimetype,
+                headers=headers)
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def permission_fingerprint(self):
+        """Returns a hashable value that is the same for every user who can
+        see the same requests in this listing.
+
+        By default this is the current user's ID.
+        """
+        return (u'user', current_user.id)
+
+    def feed(self, filters, canonical_filter, title):
+        """Respond with an RSS feed of the requests matching the filters.
+
+        Instead of loading :py:class:`~.Request`\s, only the columns in the
+        feed are selected, along with the latest :py:class:`~.Action` for each
+        request (used in the item GUIDs). The rendered feed is cached until a
+        request changes, and is shared by every user with the same
+        :py:meth:`permission_fingerprint`. The response supports conditional
+        requests with ``ETag`` and ``Last-Modified``.
+
+        :param dict filters: The parsed filters.
+        :param str canonical_filter: The filters as given in the URL.
+        :param str title: The title of the feed.
+        """
+        latest_change = db.session.query(RequestChange.id,
+                    RequestChange.timestamp)\
+                .order_by(RequestChange.id.desc())\
+                .first()
+        cache_key = (
+            request.url_root,
+            request.endpoint,
+            canonical_filter,
+            six.text_type(get_locale()),
+            self.permission_fingerprint(),
+            latest_change.id if latest_change is not None else None,
+        )
+        cached = current_app.feed_cache.get(cache_key)
+        if cached is None:
+            page = filters.get('page', 1)
+            per_page = 200
+            pilot = db.aliased(Pilot)
+            division = db.aliased(Division)
+            latest_action = db.select([db.func.max(Action.id)])\
+                    .where(Action.request_id == Request.id)\
+                    .as_scalar()
+            items = self.requests(filters)\
+                    .with_entities(
+                        Request.id,
+                        Request.ship_type,
+                        Request.system,
+                        Request.status,
+                        Request.kill_timestamp,
+                        Request.timestamp,
+                        pilot.name.label('pilot'),
+                        division.name.label('division'),
+                        latest_action.label('latest_action_id'))\
+                    .join(pilot, Request.pilot_id == pilot.id)\
+                    .join(division, Request.division_id == division.id)\
+                    .limit(per_page)\
+                    .offset((page - 1) * per_page)\
+                    .all()
+            content = render_template('rss.xml', requests=items, title=title,
+                    main_link=url_for(request.endpoint,
+                        filters=canonical_filter, _external=True))
+            if latest_change is not None:
+                last_modified = latest_change.timestamp
+            else:
+                last_modified = None
+            cached = (content, hashlib.sha1(content.encode('utf-8'))\
+                    .hexdigest(), last_modified)
+            current_app.feed_cache.set(cache_key, cached)
+        content, etag, last_modified = cached
+        response = make_response(content)
+        response.headers['Content-Type'] = 'application/rss+xml'
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        return response.make_conditional(request)
+
     def dispatch_request(self, filters='', **kwargs):
         """Returns the response to requests.
 
         Part of the :py:class:`flask.views.View` interface.
         """
+        export_format = kwargs.pop('export_format', None)
         filter_map = self.parse_filter(filters)
         current_app.logger.debug("Filter map: {}".format(filter_map))
         canonical_filter = self.unparse_filter(filter_map)
@@ -301,7 +663,16 @@ class RequestListing(View):
             }
             if 'fmt' in request.args:
                 url_kwargs['fmt'] = request.args['fmt']
+            if export_format is not None:
+                url_kwargs['export_format'] = export_format
             return redirect(url_for(request.endpoint, **url_kwargs), code=301)
+        if export_format is not None:
+            return self.export(self.requests(filter_map), export_format)
+        if request.is_rss and not (request.is_json or request.is_xhr):
+            return self.feed(filter_map, canonical_filter,
+                    kwargs.get('title', u''))
+        if request.is_json or request.is_xhr:
+            self.fields = parse_fields(self.field_attributes)
         requests = self.requests(filter_map)
         # Ignore rejected requests when summing the payout.
         # Discard ordering options, they affect the sum somehow.
@@ -352,8 +723,20 @@ class RequestListing(View):
             filter_map['page'] = pager.page
         # Handle API/RSS responses
         if request.is_json or request.is_xhr:
+            extended = getattr(request, 'json_extended', False)
+            if isinstance(extended, dict):
+                extended = extended.get(Request, False)
+            if extended:
+                # Check the valid actions for every request with one query
+                permissions = current_user.division_permissions()
+                items = [r._json(True, self.fields, permissions)
+                        for r in pager.items]
+            elif self.fields is None:
+                items = pager.items
+            else:
+                items = [r._json(False, self.fields) for r in pager.items]
             jsonify_kwargs = {
-                'requests': pager.items,
+                'requests': items,
                 'request_count': requests.count(),
                 'total_payouts': total_payouts.currency()
             }
@@ -362,12 +745,6 @@ class RequestListing(View):
             if request.is_json:
                 jsonify_kwargs.update(api_links)
             return jsonify(**jsonify_kwargs)
-        if request.is_rss:
-            return xmlify('rss.xml', content_type='application/rss+xml',
-                    requests=pager.items,
-                    title=(kwargs['title'] if 'title' in kwargs else u''),
-                    main_link=url_for(request.endpoint, filters=filters,
-                        _external=True))
         if request.is_xml:
             xmlify_kwargs = {
                 'requests': pager.items,
@@ -392,7 +769,7 @@ class RequestListing(View):
         return (
                 db.Load(Request).load_only('id', 'pilot_id', 'division_id',
                     'system', 'ship_type', 'status', 'timestamp',
-                    'base_payout'),
+                    'base_payout', 'payout', 'version'),
                 db.Load(Division).joinedload('name'),
                 db.Load(Pilot).joinedload('name'),
         )
@@ -418,6 +795,20 @@ class PersonalRequests(RequestListing):
 
     decorators = [login_required]
 
+    def dispatch_request(self, filters='', **kwargs):
+        if current_app.config['SRP_ASYNC_KILLMAILS']:
+            # Show the killmails still being verified, and recent failures
+            recent = dt.datetime.utcnow() - dt.timedelta(days=7)
+            kwargs['submissions'] = KillmailSubmission.query\
+                    .filter_by(submitter_id=current_user.id)\
+                    .filter(KillmailSubmission.status !=
+                            SubmissionStatus.submitted)\
+                    .filter(KillmailSubmission.timestamp >= recent)\
+                    .order_by(KillmailSubmission.timestamp.desc())\
+                    .all()
+        return super(PersonalRequests, self).dispatch_request(filters,
+                **kwargs)
+
     def requests(self, filters):
         requests = super(PersonalRequests, self).requests(filters)
         requests = requests\
@@ -440,6 +831,28 @@ class PersonalRequests(RequestListing):
             return gettext(u"%(name)s's Requests", name=current_user.name)
 
 
+def permitted_divisions(permissions, user=None):
+    """Create a subquery of the IDs of the divisions where a user has been
+    granted any of the given permissions (either directly or through a group).
+
+    The single column of the subquery is named ``division_id``.
+
+    :param tuple permissions: The permissions to look for
+    :param user: The user to check. Defaults to the current user.
+    :type user: :py:class:`~.User`
+    """
+    if user is None:
+        user = current_user
+    current_groups = db.select([users_groups.c.group_id])\
+            .where(users_groups.c.user_id == user.id).alias()
+    return db.select([Permission.division_id.label('division_id')])\
+            .where(Permission.permission.in_(permissions))\
+            .where(db.or_(
+                    Permission.entity_id == user.id,
+                    Permission.entity_id.in_(current_groups)))\
+            .alias('permitted_divisions')
+
+
 class PermissionRequestListing(RequestListing):
     """Show all requests that the current user has permissions to access.
 
@@ -462,7 +875,8 @@ class PermissionRequestListing(RequestListing):
         self.permissions = (PermissionType.admin,) + tuple(permissions)
         self.statuses = statuses
         if title is None:
-            self.title = u', '.join(map(lambda s: s.description, self.statuses))
+            self.title = u', '.join(map(lambda s: six.text_type(s.description),
+                    self.statuses))
         else:
             self.title = ensure_unicode(title)
 
@@ -475,15 +889,15 @@ class PermissionRequestListing(RequestListing):
                     title=gettext(self.title),
                     **kwargs)
 
+    def permission_fingerprint(self):
+        divisions = permitted_divisions(self.permissions)
+        division_ids = db.session.query(divisions.c.division_id)\
+                .distinct()\
+                .order_by(divisions.c.division_id)
+        return (u'divisions',) + tuple(d[0] for d in division_ids)
+
     def requests(self, filters):
-        current_groups = db.select([users_groups.c.group_id])\
-                .where(users_groups.c.user_id == current_user.id).alias()
-        divisions = db.select([Permission.division_id.label('division_id')])\
-                .where(Permission.permission.in_(self.permissions))\
-                .where(db.or_(
-                        Permission.entity_id == current_user.id,
-                        Permission.entity_id.in_(current_groups)))\
-                .alias('permitted_divisions')
+        divisions = permitted_divisions(self.permissions)
         # modify filters
         if 'status' not in filters:
             filters['status'] = self.statuses
@@ -507,6 +921,110 @@ class PayoutListing(PermissionRequestListing):
             filters['sort'] = 'submit_timestamp'
         return super(PayoutListing, self).requests(filters)
 
+    @classproperty
+    def _load_options(cls):
+        """Load everything shown on the payout page (and in its extended JSON)
+        up front, so the number of queries does not depend on the number of
+        requests shown.
+        """
+        modifiers = db.with_polymorphic(Modifier, '*')
+        active_modifiers = db.with_polymorphic(Modifier, '*')
+        return (
+                db.undefer('details'),
+                db.joinedload('pilot'),
+                db.joinedload('submitter'),
+                db.joinedload('division'),
+                db.subqueryload('actions').joinedload('user'),
+                db.subqueryload(Request.active_modifiers.of_type(
+                        active_modifiers)),
+                db.subqueryload(Request.all_modifiers.of_type(modifiers))\
+                        .joinedload(modifiers.user),
+                db.subqueryload(Request.all_modifiers.of_type(modifiers))\
+                        .joinedload(modifiers.voided_user),
+        )
+
+    def manifest(self, filters, manifest_format):
+        """Respond with the payout manifest for the approved requests matching
+        the filters.
+
+        Requests are grouped by pilot and division, and for each group the
+        manifest has the total payout and the IDs of the requests. The totals
+        are computed in the database with a single ``GROUP BY`` query, and
+        the request IDs are loaded with a second query. The response includes
+        a signed (and timestamped) snapshot of the request IDs, their versions
+        and the total, which can be given to :py:func:`mark_manifest_paid` to
+        mark exactly those requests as paid.
+
+        :param dict filters: The parsed filters.
+        :param str manifest_format: Either ``'csv'`` or ``'json'``.
+        """
+        # Only approved requests can be paid out
+        filters['status'] = set((ActionType.approved,))
+        approved = self.requests(filters)\
+                .order_by(None)\
+                .with_entities(
+                    Request.id.label('request_id'),
+                    Request.pilot_id.label('pilot_id'),
+                    Request.division_id.label('division_id'),
+                    Request.payout.label('payout'),
+                    Request.version.label('version'))\
+                .subquery()
+        groups = db.session.query(
+                    Pilot.id.label('pilot_id'),
+                    Division.id.label('division_id'),
+                    Pilot.name.label('pilot'),
+                    Division.name.label('division'),
+                    db.func.sum(approved.c.payout).label('payout'))\
+                .join(approved, Pilot.id == approved.c.pilot_id)\
+                .join(Division, Division.id == approved.c.division_id)\
+                .group_by(Pilot.id, Pilot.name, Division.id, Division.name)\
+                .order_by(Pilot.name, Division.name)
+        # Concatenating the IDs in the GROUP BY query would be cut short on
+        # MySQL (group_concat_max_len), so they are loaded separately.
+        group_ids = defaultdict(list)
+        versions = {}
+        id_query = db.session.query(approved.c.pilot_id,
+                approved.c.division_id, approved.c.request_id,
+                approved.c.version)\
+                .order_by(approved.c.request_id)
+        for pilot_id, division_id, request_id, version in id_query:
+            group_ids[(pilot_id, division_id)].append(request_id)
+            versions[request_id] = version
+        manifest = []
+        all_ids = []
+        total = PrettyDecimal(0)
+        for group in groups:
+            request_ids = group_ids[(group.pilot_id, group.division_id)]
+            all_ids.extend(request_ids)
+            total += group.payout
+            manifest.append(OrderedDict((
+                (u'pilot', group.pilot),
+                (u'division', group.division),
+                (u'request_count', len(request_ids)),
+                (u'payout', PrettyDecimal(group.payout).currency()),
+                (u'request_ids', request_ids),
+            )))
+        total = PrettyDecimal(total).currency()
+        all_ids.sort()
+        snapshot = _manifest_serializer().dumps({
+            u'ids': all_ids,
+            u'versions': [versions[i] for i in all_ids],
+            u'total': total,
+        })
+        if manifest_format == 'json':
+            return jsonify(manifest=manifest, total=total, snapshot=snapshot)
+        serializer = _CSVSerializer([u'pilot', u'division', u'request_count',
+                u'payout', u'request_ids'])
+        rows = [[u' '.join(map(six.text_type, v)) if isinstance(v, list)
+                 else v for v in six.itervalues(group)] for group in manifest]
+        response = current_app.response_class(
+                serializer.header() + serializer(rows),
+                mimetype='text/csv')
+        response.headers['Content-Disposition'] = \
+                'attachment; filename=manifest.csv'
+        response.headers['X-Manifest-Snapshot'] = snapshot
+        return response
+
     def dispatch_request(self, filters='', **kwargs):
         if hasattr(request, 'json_extended'):
             if isinstance(request.json_extended, bool):
@@ -517,9 +1035,183 @@ class PayoutListing(PermissionRequestListing):
         request.json_extended[Request] = True
         if not current_user.has_permission(self.permissions):
             abort(403)
+        manifest_format = kwargs.pop('manifest_format', None)
+        if manifest_format is not None:
+            return self.manifest(self.parse_filter(filters), manifest_format)
         return super(PayoutListing, self).dispatch_request(
                 filters,
-                form=ActionForm())
+                form=ActionForm(),
+                **kwargs)
+
+
+def _manifest_serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'],
+            salt='payout-manifest')
+
+
+class ManifestPaidForm(Form):
+
+    snapshot = HiddenField(validators=[InputRequired()])
+
+
+@blueprint.route('/pay/manifest/paid', methods=['POST'])
+@fresh_login_required
+def mark_manifest_paid():
+    """Mark every request in a payout manifest snapshot as paid.
+
+    Either all of the requests are marked as paid, or none of them are. If
+    any of the requests have changed (including being marked as paid by this
+    same snapshot before) or the total payout has changed since the manifest
+    was created, nothing is changed and a 409 error is returned. Snapshots
+    older than ``SRP_MANIFEST_MAX_AGE`` seconds are rejected.
+    """
+    form = ManifestPaidForm()
+    if not form.validate():
+        abort(400)
+    try:
+        snapshot = _manifest_serializer().loads(form.snapshot.data,
+                max_age=current_app.config['SRP_MANIFEST_MAX_AGE'])
+    except SignatureExpired:
+        # TRANS: Error message shown when trying to mark the requests in a
+        # TRANS: payout manifest as paid, but the manifest is too old.
+        abort(400, gettext(u"This manifest has expired. Please create a new "
+                           u"manifest."))
+    except BadSignature:
+        abort(400)
+    request_ids = snapshot[u'ids']
+    requests = Request.query.filter(Request.id.in_(request_ids))\
+            .order_by(Request.id)\
+            .all()
+    total = sum((r.payout for r in requests), PrettyDecimal(0))
+    if len(requests) != len(request_ids) or \
+            [r.version for r in requests] != snapshot[u'versions'] or \
+            any(r.status != ActionType.approved for r in requests) or \
+            PrettyDecimal(total).currency() != snapshot[u'total']:
+        # TRANS: Error message shown when trying to mark the requests in a
+        # TRANS: payout manifest as paid, but some of them have been changed
+        # TRANS: since the manifest was made.
+        abort(409, gettext(u"The requests in this manifest have changed. "
+                           u"Please create a new manifest."))
+    try:
+        for srp_request in requests:
+            Action(srp_request, current_user, type_=ActionType.paid)
+        db.session.commit()
+    except ActionError as e:
+        db.session.rollback()
+        abort(403, unicode(e))
+    if request.is_json or request.is_xhr:
+        return jsonify(paid=request_ids)
+    # TRANS: Message shown after marking every request in a payout manifest
+    # TRANS: as paid.
+    flash(gettext(u"Marked %(num)d requests as paid.", num=len(request_ids)),
+            u'info')
+    return redirect(url_for('.list_approved_requests'))
+
+
+class RequestStream(View):
+    """Pushes summaries of changed requests to clients as Server-Sent Events.
+
+    Instead of repeatedly fetching a listing, a client can keep one of these
+    streams open and only refresh the requests it is told have changed. Each
+    event is a JSON object with the ``id``, ``status`` and ``payout`` of a
+    request (or ``deleted`` set to ``true``). Only requests in divisions the
+    subscriber has the listing's permissions in are sent.
+
+    Each stream holds on to a worker for as long as it is open, so the app
+    has to be served by workers that can handle many long-lived connections
+    at once (like gunicorn's ``gevent`` or ``eventlet`` worker classes).
+    Streams are closed after ``SRP_STREAM_LIFETIME`` seconds, and clients
+    reconnect after the delay sent in the ``retry`` field.
+    """
+
+    decorators = [login_required]
+
+    def __init__(self, permissions):
+        """Create a :py:class:`RequestStream`.
+
+        :param tuple permissions: The permissions to filter divisions by.
+        """
+        self.permissions = (PermissionType.admin,) + tuple(permissions)
+
+    @staticmethod
+    def events(subscription, division_ids, keepalive=15, lifetime=None):
+        """Generate the text of the event stream for a subscription.
+
+        :param subscription: The subscription to pull change messages from.
+        :type subscription: :py:class:`~.Subscription`
+        :param set division_ids: Only changes to requests in these divisions
+            are sent.
+        :param keepalive: How many seconds to wait between messages before
+            sending a comment to keep the connection alive.
+        :param lifetime: How many seconds to keep generating events for, or
+            ``None`` to never stop.
+        """
+        if lifetime is not None:
+            deadline = time.time() + lifetime
+        yield u'retry: 5000\n\n'
+        while True:
+            timeout = keepalive
+            if lifetime is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return
+                timeout = min(timeout, remaining)
+            if subscription.overflowed:
+                # Some changes were dropped, have the client reload everything.
+                subscription.overflowed = False
+                yield u'event: resync\ndata: {}\n\n'
+            message = subscription.get(timeout=timeout)
+            if message is None:
+                yield u': keepalive\n\n'
+                continue
+            if message[u'division_id'] not in division_ids:
+                continue
+            yield u'event: request\ndata: {}\n\n'.format(json.dumps(message))
+
+    def dispatch_request(self):
+        if not current_user.has_permission(self.permissions):
+            abort(403)
+        broadcaster = current_app.request_broadcast
+        if request.environ.get('wsgi.multiprocess') and \
+                not getattr(broadcaster.fanout, 'cross_process', True):
+            current_app.logger.error(u"Request change streams need a "
+                    u"SRP_BROADCAST_FANOUT backend reaching every process "
+                    u"when running more than one worker process.")
+            abort(501)
+        divisions = permitted_divisions(self.permissions)
+        division_ids = {row[0] for row in
+                db.session.query(divisions.c.division_id)}
+        # Release the database connection, it isn't needed while streaming.
+        db.session.commit()
+        subscription = broadcaster.subscribe()
+        keepalive = current_app.config['SRP_STREAM_KEEPALIVE']
+        lifetime = current_app.config['SRP_STREAM_LIFETIME']
+        def generate():
+            try:
+                for event in self.events(subscription, division_ids,
+                                         keepalive, lifetime):
+                    yield event
+            finally:
+                broadcaster.unsubscribe(subscription)
+        response = current_app.response_class(generate(),
+                mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        # Keep nginx from buffering the stream
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+
+def add_export_rules(app, path, view):
+    """Add the rules for exporting the requests in a listing as CSV or
+    NDJSON, with or without filters.
+
+    :param app: The application to add the rules to
+    :param str path: The URL path of the listing, ending in a slash
+    :param view: The view function of the listing
+    """
+    export_path = 'export.<any(csv, ndjson):export_format>'
+    app.add_url_rule(path + export_path, view_func=view)
+    app.add_url_rule(path + '<path:filters>/' + export_path, view_func=view)
 
 
 def register_perm_request_listing(app, endpoint, path, permissions, statuses,
@@ -543,6 +1235,7 @@ def register_perm_request_listing(app, endpoint, path, permissions, statuses,
     app.add_url_rule(path, view_func=view)
     app.add_url_rule('{}rss.xml'.format(path), view_func=view)
     app.add_url_rule(path + '<path:filters>', view_func=view)
+    add_export_rules(app, path, view)
 
 
 @blueprint.record
@@ -561,6 +1254,7 @@ def register_class_views(state):
     state.add_url_rule('/personal/', view_func=personal_view)
     state.add_url_rule('/personal/rss.xml', view_func=personal_view)
     state.add_url_rule('/personal/<path:filters>', view_func=personal_view)
+    add_export_rules(state, '/personal/', personal_view)
     # Payout list
     payout_view = PayoutListing.as_view('list_approved_requests')
     payout_url_stub = '/pay/'
@@ -568,6 +1262,14 @@ def register_class_views(state):
     state.add_url_rule(payout_url_stub + 'rss.xml', view_func=payout_view)
     state.add_url_rule(payout_url_stub + '<path:filters>',
             view_func=payout_view)
+    add_export_rules(state, payout_url_stub, payout_view)
+    manifest_path = 'manifest.<any(csv, json):manifest_format>'
+    state.add_url_rule(payout_url_stub + manifest_path, view_func=payout_view)
+    state.add_url_rule(payout_url_stub + '<path:filters>/' + manifest_path,
+            view_func=payout_view)
+    state.add_url_rule(payout_url_stub + 'stream',
+            view_func=RequestStream.as_view('payout_stream',
+                    permissions=(PermissionType.pay,)))
     # Other more generalized listings
     register_perm_request_listing(state, 'list_pending_requests',
             '/pending/', (PermissionType.review, PermissionType.audit),
@@ -605,6 +1307,14 @@ class ValidKillmail(URL):
             else:
                 # Py3 chains the exceptions
                 raise ValidationError
+        except RequestException as e:
+            current_app.logger.warning(u"Unable to retrieve killmail {}: {}"
+                    .format(field.data, e))
+            # TRANS: Error message shown when the site a killmail is from
+            # TRANS: cannot be reached.
+            raise ValidationError(gettext(u"Unable to retrieve %(url)s right "
+                                          u"now, please try again later.",
+                                          url=field.data))
         else:
             if mail.verified:
                 form.killmail = mail
@@ -658,6 +1368,10 @@ class RequestForm(Form):
     submit = SubmitField(lazy_gettext(u'Submit'))
 
     def validate_url(form, field):
+        if current_app.config['SRP_ASYNC_KILLMAILS']:
+            # The killmail is retrieved and verified later by a worker
+            URL()(form, field)
+            return
         failures = set()
         for v in get_killmail_validators():
             try:
@@ -710,6 +1424,20 @@ def submit_request():
         form.division.data = form.division.choices[0][0]
 
     if form.validate_on_submit():
+        if current_app.config['SRP_ASYNC_KILLMAILS']:
+            # Leave retrieving the killmail (and the other checks) to a
+            # worker, see evesrp.submissions
+            division = Division.query.get(form.division.data)
+            submission = KillmailSubmission(current_user, division,
+                    form.url.data, form.details.data)
+            db.session.add(submission)
+            db.session.commit()
+            # TRANS: Message shown after submitting a killmail, when the
+            # TRANS: killmail is checked in the background before the request
+            # TRANS: is made.
+            flash(gettext(u"Your killmail is being verified. The request "
+                          u"will be listed here once it has been."), u'info')
+            return redirect(url_for('.personal_requests'))
         mail = form.killmail
         # Prevent submitting other people's killmails
         pilot = Pilot.query.get(mail.pilot_id)
@@ -724,6 +1452,9 @@ def submit_request():
         # The name 'request' is already used by Flask.
         # Hooray name collisions!
         srp_request = Request.query.get(mail.kill_id)
+        if srp_request is None and restore_request(mail.kill_id):
+            db.session.commit()
+            srp_request = Request.query.get(mail.kill_id)
         if srp_request is None:
             division = Division.query.get(form.division.data)
             srp_request = Request(current_user, form.details.data, division,
@@ -817,6 +1548,34 @@ class AddNote(Form):
             validators=[InputRequired()])
 
 
+def _get_request_or_404(request_id):
+    """Get a :py:class:`~.models.Request` by ID. Archived requests are loaded
+    read only from the archive tables (see
+    :py:func:`~.models.load_archived_request`).
+    """
+    srp_request = Request.query.get(request_id)
+    if srp_request is None:
+        srp_request = load_archived_request(request_id)
+    if srp_request is None:
+        abort(404)
+    return srp_request
+
+
+def _restore_request(srp_request):
+    if not current_user.has_permission((PermissionType.review,
+            PermissionType.pay), srp_request) and \
+            current_user != srp_request.submitter:
+        abort(403)
+    restore_request(srp_request.id)
+    db.session.commit()
+    # TRANS: Message shown after an archived request has been moved back so
+    # TRANS: that it can be changed.
+    flash(gettext(u"Request #%(request_id)s has been restored.",
+            request_id=srp_request.id), u'info')
+    return redirect(url_for('.get_request_details',
+            request_id=srp_request.id))
+
+
 @blueprint.route('/<int:request_id>/', methods=['GET'])
 @login_required
 @varies('Accept')
@@ -835,7 +1594,7 @@ def get_request_details(request_id=None, srp_request=None):
     :type srp_request: :py:class:`~.models.Request`
     """
     if srp_request is None:
-        srp_request = Request.query.get_or_404(request_id)
+        srp_request = _get_request_or_404(request_id)
     # A user should always be able to access their own requests, but others
     # need fresh sessions.
     if current_user != srp_request.submitter and not login_fresh():
@@ -851,8 +1610,12 @@ def get_request_details(request_id=None, srp_request=None):
         template = 'request_detail.html'
     else:
         abort(403)
+    # Archived requests are shown read only
+    if srp_request.archived:
+        template = 'request_detail.html'
     if request.is_json or request.is_xhr:
-        return jsonify(**srp_request._json(True))
+        fields = parse_fields(RequestListing.field_attributes)
+        return jsonify(**srp_request._json(True, fields))
     if request.is_xml:
         return xmlify('request.xml', srp_request=srp_request)
     return render_template(template, srp_request=srp_request,
@@ -1006,10 +1769,20 @@ def modify_request(request_id):
 
     :param int request_id: the ID of the request.
     """
-    srp_request = Request.query.get_or_404(request_id)
+    srp_request = _get_request_or_404(request_id)
     # Force fresh permissions
     if not login_fresh():
         return login_manager.needs_refresh()
+    if srp_request.archived:
+        if request.form['id_'] == 'restore':
+            return _restore_request(srp_request)
+        # TRANS: Error shown when trying to change a request that has been
+        # TRANS: archived without restoring it first.
+        flash(gettext(u"Request #%(request_id)s is archived, and has to be "
+                      u"restored before it can be changed.",
+                      request_id=srp_request.id), u'warning')
+        return redirect(url_for('.get_request_details',
+                request_id=srp_request.id))
     if request.form['id_'] == 'modifier':
         return _add_modifier(srp_request)
     elif request.form['id_'] == 'payout':
@@ -1036,13 +1809,20 @@ class DivisionChange(Form):
 @blueprint.route('/<int:request_id>/division/', methods=['GET', 'POST'])
 @fresh_login_required
 def request_change_division(request_id):
-    srp_request = Request.query.get_or_404(request_id)
+    srp_request = _get_request_or_404(request_id)
     if not current_user.has_permission(PermissionType.review, srp_request) and\
             current_user != srp_request.submitter:
         current_app.logger.warn(u"User '{}' does not have permission to change"
                                 u" request #{}'s division".format(
                                     current_user, srp_request.id))
         abort(403)
+    if srp_request.archived:
+        # TRANS: Error shown when trying to change a request that has been
+        # TRANS: archived without restoring it first.
+        flash(gettext(u"Request #%(request_id)s is archived, and has to be "
+                      u"restored before it can be changed.",
+                      request_id=srp_request.id), u'warning')
+        return redirect(url_for('.get_request_details', request_id=request_id))
     if srp_request.finalized:
         msg = (u"Cannot change request #{}'s division as it is in a finalized"
                u" state").format(srp_request.id)
@@ -56,6 +56,24 @@ class TestGroups(TestApp):
                     User.query.get(4),
                     Group.query.get(20).users)
 
+    def test_sync_groups(self):
+        with self.app.test_request_context():
+            u3 = User.query.get(3)
+            g1 = Group.query.get(10)
+            g2 = Group.query.get(20)
+            g3 = Group('Group Three', 'AuthMethod', id=30)
+            db.session.add(g3)
+            self.assertEqual(u3.groups, {g1, g2})
+            added, removed = u3.sync_groups([g2, g3])
+            self.assertEqual(added, {30})
+            self.assertEqual(removed, {10})
+            self.assertEqual(u3.groups, {g2, g3})
+            self.assertNotIn(u3, g1.users)
+            db.session.commit()
+            # Nothing to do the second time
+            self.assertEqual(u3.sync_groups([g2, g3]), (set(), set()))
+            self.assertEqual(User.query.get(3).groups, {g2, g3})
+
 
 class TestPermissions(TestGroups):
 
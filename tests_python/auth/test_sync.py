@@ -0,0 +1,264 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import json
+import os.path
+import shutil
+import tempfile
+from httmock import HTTMock, urlmatch
+from sqlalchemy import event
+from evesrp import db, init_app
+from evesrp.auth import AuthMethod
+from evesrp.auth.evesso import EveSSO, EveSSOUser, EveSSOGroup
+from evesrp.auth.models import User, Group, Pilot
+from evesrp.auth.sync import sync_users
+from ..util_tests import TestApp, response
+
+
+character_info = """<?xml version='1.0' encoding='UTF-8'?>
+<eveapi version="2">
+  <result>
+    <characterID>{id}</characterID>
+    <corporationID>{corp_id}</corporationID>
+    <corporation>Corporation {corp_id}</corporation>
+    {alliance}
+  </result>
+</eveapi>"""
+
+
+# Character ID: (corporation ID, alliance ID)
+affiliations = {
+    1: (100, 1000),
+    2: (100, 1000),
+    3: (200, None),
+}
+
+
+@urlmatch(netloc=r'api\.eveonline\.com', path=r'.*CharacterInfo.*')
+def character_info_mock(url, request):
+    character_id = int(url.query.split('=')[1])
+    if character_id not in affiliations:
+        return response(status_code=500)
+    corp_id, alliance_id = affiliations[character_id]
+    if alliance_id is None:
+        alliance = ''
+    else:
+        alliance = ('<allianceID>{0}</allianceID>'
+                    '<alliance>Alliance {0}</alliance>').format(alliance_id)
+    return response(content=character_info.format(id=character_id,
+            corp_id=corp_id, alliance=alliance))
+
+
+class TestSyncUsers(TestApp):
+
+    def app_config(self):
+        config = super(TestSyncUsers, self).app_config()
+        # Each thread gets its own connection, so it can't be in memory
+        self.db_dir = tempfile.mkdtemp()
+        config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+                os.path.join(self.db_dir, 'sync.db')
+        return config
+
+    def setUp(self):
+        super(TestSyncUsers, self).setUp()
+        with self.app.app_context():
+            self.sso = EveSSO(client_id='id', client_secret='secret')
+        self.app.auth_methods = [self.sso]
+        with self.app.app_context():
+            for character_id in (1, 2, 3, 4):
+                user = EveSSOUser('User {}'.format(character_id),
+                        'hash{}'.format(character_id), self.sso.name)
+                Pilot(user, 'Pilot {}'.format(character_id), character_id)
+                db.session.add(user)
+            # User 3 was in corporation 100 when they last logged in
+            old_group = EveSSOGroup('Corporation 100', 100, False,
+                    self.sso.name)
+            User.query.filter_by(name='User 3').one().groups.add(old_group)
+            # Users from other auth methods are skipped
+            db.session.add(User('Other User', 'Other'))
+            db.session.commit()
+
+    def tearDown(self):
+        super(TestSyncUsers, self).tearDown()
+        shutil.rmtree(self.db_dir)
+
+    def group_names(self, user_name):
+        user = User.query.filter_by(name=user_name).one()
+        return sorted(group.name for group in user.groups)
+
+    def test_sync(self):
+        with self.app.test_request_context():
+            with HTTMock(character_info_mock):
+                results = list(sync_users(self.app, threads=2,
+                        batch_size=2))
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[-1]['refreshed'], 3)
+        # Character 4's lookup fails, and the other user is not from EVE SSO
+        self.assertEqual(results[-1]['skipped'], 2)
+        with self.app.app_context():
+            self.assertEqual(self.group_names('User 1'),
+                    ['Alliance 1000', 'Corporation 100'])
+            self.assertEqual(self.group_names('User 2'),
+                    ['Alliance 1000', 'Corporation 100'])
+            self.assertEqual(self.group_names('User 3'), ['Corporation 200'])
+            self.assertEqual(self.group_names('User 4'), [])
+            # Only one group per corporation and alliance
+            self.assertEqual(Group.query.count(), 3)
+
+
+class TestBulkSync(TestApp):
+
+    def setUp(self):
+        super(TestBulkSync, self).setUp()
+        self.auth_method = AuthMethod(name='Bulk')
+        with self.app.test_request_context():
+            user = User('Bulk User', self.auth_method.name)
+            Pilot(user, 'Old Pilot', 1)
+            Pilot(None, 'Existing Pilot', 2)
+            old_group = Group('Old Group', self.auth_method.name)
+            kept_group = Group('Kept Group', self.auth_method.name)
+            user.groups.update((old_group, kept_group))
+            # Same name, different auth method
+            db.session.add(Group('New Group', 'Other'))
+            db.session.add(user)
+            db.session.commit()
+
+    def test_sync_user(self):
+        statements = []
+
+        def count(*args):
+            statements.append(args[2])
+        with self.app.test_request_context():
+            user = User.query.filter_by(name='Bulk User').one()
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                pilots = self.auth_method.get_or_create_pilots({
+                    2: 'Existing Pilot',
+                    '3': 'New Pilot',
+                    4: 'Another New Pilot',
+                })
+                groups = self.auth_method.get_or_create_groups(
+                        ['Kept Group', 'New Group'])
+                self.auth_method.sync_user(user, pilots, groups)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+            # One query (or batch) for each step, not per pilot or group
+            self.assertLessEqual(len(statements), 10)
+            user = User.query.filter_by(name='Bulk User').one()
+            self.assertEqual(sorted(p.id for p in user.pilots), [2, 3, 4])
+            self.assertIsNone(Pilot.query.get(1).user)
+            self.assertEqual(sorted(g.name for g in user.groups),
+                    ['Kept Group', 'New Group'])
+            self.assertEqual(Group.query.filter_by(name='New Group').count(),
+                    2)
+
+
+class TestEveSSOGroups(TestApp):
+
+    def setUp(self):
+        super(TestEveSSOGroups, self).setUp()
+        with self.app.app_context():
+            self.sso = EveSSO(client_id='id', client_secret='secret')
+            db.session.add(EveSSOGroup('Corporation 100', 100, False,
+                    self.sso.name))
+            db.session.commit()
+
+    def test_affiliation_groups(self):
+        statements = []
+
+        def count(*args):
+            statements.append(args[2])
+        with self.app.test_request_context():
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                groups = self.sso._affiliation_groups([
+                    (100, 'Corporation 100', False),
+                    (1000, 'Alliance 1000', True),
+                ])
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+            # One query for all of the groups, and the new one is not
+            # committed
+            self.assertEqual(len(statements), 1)
+            self.assertEqual([g.name for g in groups],
+                    ['Corporation 100', 'Alliance 1000'])
+            self.assertIsNotNone(groups[0].id)
+            self.assertIn(groups[1], db.session.new)
+
+    def test_shared_cache(self):
+        with self.app.test_request_context():
+            db.session.add(EveSSOGroup('Alliance 1000', 1000, True,
+                    self.sso.name))
+            for character_id in (1, 2):
+                user = EveSSOUser('User {}'.format(character_id),
+                        'hash{}'.format(character_id), self.sso.name)
+                Pilot(user, 'Pilot {}'.format(character_id), character_id)
+                db.session.add(user)
+            db.session.commit()
+        lookups = []
+
+        def count(conn, cursor, statement, *args):
+            if 'ccp_id IN' in statement:
+                lookups.append(statement)
+        cache = {}
+        event.listen(db.get_engine(self.app), 'before_cursor_execute', count)
+        try:
+            # Characters 1 and 2 are in the same corporation and alliance
+            for name in ('User 1', 'User 2'):
+                with self.app.test_request_context():
+                    user = User.query.filter_by(name=name).one()
+                    with HTTMock(character_info_mock):
+                        self.assertTrue(self.sso.refresh(user, cache=cache))
+                    db.session.commit()
+        finally:
+            event.remove(db.get_engine(self.app), 'before_cursor_execute',
+                    count)
+        self.assertEqual(len(lookups), 1)
+        with self.app.test_request_context():
+            for name in ('User 1', 'User 2'):
+                user = User.query.filter_by(name=name).one()
+                self.assertEqual(sorted(g.name for g in user.groups),
+                        ['Alliance 1000', 'Corporation 100'])
+
+
+@urlmatch(netloc=r'login\.eveonline\.com', path=r'/oauth/token')
+def token_mock(url, request):
+    return response(content=json.dumps({
+        'access_token': 'access',
+        'token_type': 'Bearer',
+        'expires_in': 1200,
+        'refresh_token': 'refresh',
+    }), headers={'Content-Type': 'application/json'}, request=request)
+
+
+@urlmatch(netloc=r'login\.eveonline\.com', path=r'/oauth/verify')
+def verify_mock(url, request):
+    return response(content=json.dumps({
+        'CharacterID': 1,
+        'CharacterName': 'Pilot 1',
+        'CharacterOwnerHash': 'hash1',
+    }), headers={'Content-Type': 'application/json'}, request=request)
+
+
+class TestEveSSOLogin(TestApp):
+
+    def setUp(self):
+        super(TestEveSSOLogin, self).setUp()
+        with self.app.app_context():
+            self.sso = EveSSO(client_id='id', client_secret='secret')
+        self.app.config['SRP_AUTH_METHODS'] = [self.sso]
+        init_app(self.app)
+
+    def test_first_login(self):
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['state'] = 'state'
+        with HTTMock(token_mock, verify_mock, character_info_mock):
+            resp = client.get('/login/{}/?code=code&state=state'.format(
+                    self.sso.safe_name), base_url='https://localhost')
+        self.assertEqual(resp.status_code, 302)
+        with self.app.app_context():
+            user = EveSSOUser.query.filter_by(owner_hash='hash1').one()
+            self.assertEqual(user.name, 'Pilot 1')
+            self.assertEqual([p.id for p in user.pilots], [1])
+            self.assertEqual(sorted(g.name for g in user.groups),
+                    ['Alliance 1000', 'Corporation 100'])
@@ -0,0 +1,84 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from sqlalchemy import event
+from evesrp import db
+from evesrp.auth.models import Group
+from evesrp.auth.user_cache import UserCache
+from ..util_tests import TestLogin
+
+
+class TestUserCache(TestLogin):
+
+    def setUp(self):
+        super(TestUserCache, self).setUp()
+        with self.app.test_request_context():
+            self.user_id = self.normal_user.id
+
+    def count_loads(self, cache=None, generation=0):
+        if cache is None:
+            cache = self.app.user_cache
+        statements = []
+
+        def count(*args):
+            statements.append(args[2])
+        with self.app.test_request_context():
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                user = cache.load(self.user_id, generation)
+                name = user.name
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+        self.assertEqual(name, self.normal_name)
+        return len(statements)
+
+    def test_cached(self):
+        self.assertEqual(self.count_loads(), 1)
+        self.assertEqual(self.count_loads(), 0)
+        # A new session generation is loaded again
+        self.assertEqual(self.count_loads(generation=1), 1)
+
+    def test_column_change(self):
+        self.count_loads()
+        with self.app.test_request_context():
+            self.normal_user.admin = True
+            db.session.commit()
+        self.assertEqual(self.count_loads(), 1)
+        with self.app.test_request_context():
+            user = self.app.user_cache.load(self.user_id)
+            self.assertTrue(user.admin)
+
+    def test_group_change(self):
+        self.count_loads()
+        with self.app.test_request_context():
+            group = Group('Group', self.default_authmethod.name)
+            db.session.add(group)
+            self.normal_user.sync_groups([group])
+            db.session.commit()
+        self.assertEqual(self.count_loads(), 1)
+
+    def test_rollback(self):
+        self.count_loads()
+        with self.app.test_request_context():
+            self.normal_user.name = 'Changed'
+            db.session.flush()
+            db.session.rollback()
+        self.count_loads()
+        self.assertEqual(self.count_loads(), 0)
+
+    def test_expired(self):
+        cache = UserCache(ttl=-1)
+        self.assertEqual(self.count_loads(cache), 1)
+        self.assertEqual(self.count_loads(cache), 1)
+
+    def test_disabled(self):
+        cache = UserCache(ttl=0)
+        self.assertEqual(self.count_loads(cache), 1)
+        self.assertEqual(self.count_loads(cache), 1)
+
+    def test_login(self):
+        client = self.login()
+        resp = client.get('/request/personal/')
+        self.assertIn(self.normal_name, resp.get_data(as_text=True))
+        # The user is loaded from the cache for later requests
+        with self.app.test_request_context():
+            self.assertEqual(len(self.app.user_cache._snapshots), 1)
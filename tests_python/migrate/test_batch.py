@@ -0,0 +1,79 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from unittest import TestCase
+import sqlalchemy as sa
+from evesrp.migrate.batch import run_batched, checkpoints
+
+
+class TestRunBatched(TestCase):
+
+    def setUp(self):
+        self.engine = sa.create_engine('sqlite://')
+        self.conn = self.engine.connect()
+        metadata = sa.MetaData()
+        self.table = sa.Table('item', metadata,
+                sa.Column('id', sa.Integer, primary_key=True),
+                sa.Column('value', sa.Integer, nullable=True))
+        metadata.create_all(self.conn)
+        self.conn.execute(self.table.insert(),
+                [{'id': i} for i in range(1, 26)])
+        self.ranges = []
+
+    def tearDown(self):
+        self.conn.close()
+
+    def fill(self, bind, start, end):
+        self.ranges.append((start, end))
+        return bind.execute(self.table.update()\
+                .where(self.table.c.id >= start)\
+                .where(self.table.c.id < end)\
+                .values(value=self.table.c.id * 2)).rowcount
+
+    def missing(self):
+        return self.conn.execute(sa.select([sa.func.count()])\
+                .where(self.table.c.value == None)).scalar()
+
+    def test_batches(self):
+        rows = run_batched(self.conn, 'fill', self.table, self.fill,
+                batch_size=10)
+        self.assertEqual(rows, 25)
+        self.assertEqual(self.ranges, [(1, 11), (11, 21), (21, 26)])
+        self.assertEqual(self.missing(), 0)
+        # The checkpoint is removed once finished
+        self.assertEqual(self.conn.execute(checkpoints.select()).fetchall(),
+                [])
+
+    def test_sparse_keys(self):
+        self.conn.execute(self.table.insert(),
+                [{'id': i * 1000000} for i in range(1, 6)])
+        rows = run_batched(self.conn, 'fill', self.table, self.fill,
+                batch_size=10)
+        self.assertEqual(rows, 30)
+        # The ranges are found from the keys, instead of covering the gap up
+        # to 5000000 ten keys at a time
+        self.assertEqual(self.ranges, [(1, 11), (11, 21), (21, 5000001)])
+        self.assertEqual(self.missing(), 0)
+
+    def test_resume(self):
+        def failing(bind, start, end):
+            if start > 1:
+                raise RuntimeError
+            return self.fill(bind, start, end)
+        with self.assertRaises(RuntimeError):
+            run_batched(self.conn, 'fill', self.table, failing, batch_size=10)
+        # The first batch was committed
+        self.assertEqual(self.missing(), 15)
+        self.ranges = []
+        rows = run_batched(self.conn, 'fill', self.table, self.fill,
+                batch_size=10)
+        self.assertEqual(rows, 25)
+        self.assertEqual(self.ranges, [(11, 21), (21, 26)])
+        self.assertEqual(self.missing(), 0)
+
+    def test_outer_transaction(self):
+        trans = self.conn.begin()
+        with self.assertRaises(RuntimeError):
+            run_batched(self.conn, 'fill', self.table, self.fill,
+                    batch_size=10)
+        trans.rollback()
+        self.assertEqual(self.ranges, [])
@@ -1,7 +1,16 @@
 from __future__ import absolute_import
+import gzip
+from io import BytesIO
+import mimetypes
+import os
+import os.path
+import shutil
+import tempfile
 from bs4 import BeautifulSoup
 from .util_tests import TestApp
 from evesrp import init_app
+from evesrp.versioned_static import static_file, compress_static, \
+        StaticManifest, MANIFEST_NAME, IMMUTABLE_MAX_AGE
 
 
 class TestFileHashes(TestApp):
@@ -31,3 +40,106 @@ class TestFileHashes(TestApp):
         init_app(self.app)
         index_resp = self.client.get('/')
         self._test_static_files(index_resp)
+
+
+class TestStaticManifest(TestApp):
+
+    def app_config(self):
+        config = super(TestStaticManifest, self).app_config()
+        config['SRP_STATIC_FILE_HASH'] = True
+        return config
+
+    def setUp(self):
+        super(TestStaticManifest, self).setUp()
+        self.static_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.static_dir, 'js'))
+        self.script = b'var answer = 42;\n' * 100
+        with open(os.path.join(self.static_dir, 'js', 'app.js'), 'wb') as f:
+            f.write(self.script)
+        with open(os.path.join(self.static_dir, 'js', 'app.js.map'),
+                'wb') as f:
+            f.write(b'{}')
+        self.app.static_folder = self.static_dir
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        super(TestStaticManifest, self).tearDown()
+        shutil.rmtree(self.static_dir)
+
+    def hashed_url(self, filename):
+        with self.app.test_request_context():
+            return static_file(filename)
+
+    def test_build(self):
+        manifest = StaticManifest.build(self.static_dir)
+        self.assertEqual(list(manifest.files), ['js/app.js'])
+        hashed = manifest.hashed('js/app.js')
+        self.assertRegexpMatches(hashed, r'^js/app\.[0-9a-f]{8}\.js$')
+        self.assertEqual(manifest.original(hashed), 'js/app.js')
+        self.assertEqual(manifest.original(hashed + '.map'), 'js/app.js.map')
+        self.assertIsNone(manifest.original('js/app.01234567.js'))
+
+    def test_startup_manifest(self):
+        init_app(self.app)
+        url = self.hashed_url('js/app.js')
+        self.assertRegexpMatches(url, r'^/static/js/app\.[0-9a-f]{8}\.js$')
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_data(), self.script)
+        self.assertIn('immutable', resp.headers['Cache-Control'])
+        self.assertEqual(resp.cache_control.max_age, IMMUTABLE_MAX_AGE)
+        resp.close()
+        resp = self.client.get(url + '.map')
+        self.assertEqual(resp.get_data(), b'{}')
+        resp.close()
+        # Unknown hashes and files are not found
+        resp = self.client.get('/static/js/app.01234567.js')
+        self.assertEqual(resp.status_code, 404)
+        # Unhashed names still work, but are not cached forever
+        resp = self.client.get('/static/js/app.js')
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn('immutable', resp.headers.get('Cache-Control', ''))
+        resp.close()
+
+    def test_saved_manifest(self):
+        manifest = StaticManifest.build(self.static_dir)
+        compress_static(self.static_dir, manifest)
+        self.assertEqual(manifest.compressed, set(['js/app.js']))
+        manifest_path = os.path.join(self.static_dir, MANIFEST_NAME)
+        manifest.save(manifest_path)
+        # Make sure the manifest is newer than the files it lists
+        mtime = os.path.getmtime(manifest_path)
+        os.utime(manifest_path, (mtime + 10, mtime + 10))
+        init_app(self.app)
+        url = self.hashed_url('js/app.js')
+        self.assertEqual(url, '/static/' + manifest.hashed('js/app.js'))
+        resp = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.mimetype, mimetypes.guess_type('app.js')[0])
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertEqual(gzip.GzipFile(fileobj=BytesIO(resp.get_data()))
+                .read(), self.script)
+        resp.close()
+        resp = self.client.get(url)
+        self.assertNotIn('Content-Encoding', resp.headers)
+        resp.close()
+
+    def test_stale_manifest(self):
+        manifest = StaticManifest.build(self.static_dir)
+        compress_static(self.static_dir, manifest)
+        manifest_path = os.path.join(self.static_dir, MANIFEST_NAME)
+        manifest.save(manifest_path)
+        # Change a file after the manifest (and gzipped copy) were written
+        path = os.path.join(self.static_dir, 'js', 'app.js')
+        with open(path, 'ab') as f:
+            f.write(b'changed();\n')
+        mtime = os.path.getmtime(manifest_path)
+        os.utime(path, (mtime + 10, mtime + 10))
+        init_app(self.app)
+        url = self.hashed_url('js/app.js')
+        self.assertNotEqual(url, '/static/' + manifest.hashed('js/app.js'))
+        # The stale gzipped copy is not used
+        resp = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(resp.get_data(), self.script + b'changed();\n')
+        resp.close()
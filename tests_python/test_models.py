@@ -5,10 +5,12 @@ from decimal import Decimal
 from .util_tests import TestLogin
 from evesrp import db
 from evesrp.models import ActionType, ActionError, Action, Request,\
-        Modifier, AbsoluteModifier, RelativeModifier, ModifierError
+        Modifier, AbsoluteModifier, RelativeModifier, ModifierError,\
+        Corporation, recalculate_payouts
 from evesrp.auth import PermissionType
 from evesrp.auth.models import Pilot, Division, Permission
 from evesrp.util import utc
+from evesrp.migrate.batch import run_batched
 
 
 class TestModels(TestLogin):
@@ -162,6 +164,119 @@ class TestActionStatus(TestModels):
             self.assertEqual(self.request.status, ActionType.evaluating)
 
 
+class TestRequestVersion(TestModels):
+
+    def test_initial_version(self):
+        with self.app.test_request_context():
+            self.assertEqual(self.request.version, 1)
+
+    # The version is incremented on every flush a request is changed in, so
+    # only check that it increases.
+
+    def test_action_increments(self):
+        with self.app.test_request_context():
+            self.add_action(ActionType.approved)
+            self.assertGreater(self.request.version, 1)
+
+    def test_modifier_increments(self):
+        with self.app.test_request_context():
+            self.add_modifier(10)
+            version = self.request.version
+            self.assertGreater(version, 1)
+            self.add_modifier(Decimal('0.1'), absolute=False)
+            self.assertGreater(self.request.version, version)
+
+
+class TestRecalculatePayouts(TestModels):
+
+    def test_recalculate(self):
+        with self.app.test_request_context():
+            self.add_modifier(10)
+            self.add_modifier(Decimal('0.1'), absolute=False)
+            srp_request = self.request
+            expected = srp_request.payout
+            version = srp_request.version
+            table = Request.__table__
+            db.session.execute(table.update().values(payout=Decimal(0)))
+            db.session.commit()
+            conn = db.engine.connect()
+            try:
+                updated = run_batched(conn, 'payouts', table,
+                        recalculate_payouts, batch_size=10)
+                self.assertEqual(updated, 1)
+                # Nothing is left to fix the second time
+                updated = run_batched(conn, 'payouts', table,
+                        recalculate_payouts, batch_size=10)
+                self.assertEqual(updated, 0)
+            finally:
+                conn.close()
+            db.session.expire_all()
+            srp_request = self.request
+            self.assertEqual(srp_request.payout, expected)
+            self.assertEqual(srp_request.version, version + 1)
+
+
+class TestRequestNames(TestModels):
+
+    def add_request(self, **kwargs):
+        data = dict(
+                ship_type='Erebus',
+                corporation='Ever Flow',
+                killmail_url='http://example.com',
+                kill_timestamp=dt.datetime(2012, 3, 25, 0, 44, 0,
+                    tzinfo=utc),
+                system='92D-OI',
+                constellation='XHYS-O',
+                region='Venal',
+                pilot_id=133741)
+        data.update(kwargs)
+        srp_request = Request(self.normal_user, 'Details',
+                Division.query.first(), data.items())
+        db.session.commit()
+        return srp_request.id
+
+    def matching(self, attr, *names):
+        return set(r.id for r in
+                Request.query.filter(Request.name_clause(attr, names)))
+
+    def test_static_names(self):
+        with self.app.test_request_context():
+            # A ship that has been renamed since the killmail
+            renamed = self.add_request(ship_type='Old Erebus',
+                    ship_type_id=671)
+            other = self.add_request(ship_type='Rifter', ship_type_id=587)
+            unknown = self.add_request(ship_type='Prototype')
+            self.assertIsNone(Request.query.get(unknown).ship_type_id)
+            self.assertEqual(self.matching('ship_type', 'Erebus'),
+                    {self.request.id, renamed})
+            self.assertEqual(self.matching('ship_type', 'Rifter'), {other})
+            self.assertEqual(self.matching('ship_type', 'Prototype'),
+                    {unknown})
+            self.assertEqual(Request.distinct_names('ship_type'),
+                    {'Erebus', 'Rifter', 'Prototype'})
+
+    def test_static_names_without_id(self):
+        with self.app.test_request_context():
+            # A request from before the ID columns were backfilled
+            old = self.add_request(ship_type='Rifter')
+            db.session.execute(Request.__table__.update()\
+                    .where(Request.__table__.c.id == old)\
+                    .values(ship_type_id=None))
+            db.session.commit()
+            self.assertEqual(self.matching('ship_type', 'Rifter'), {old})
+
+    def test_organization_names(self):
+        with self.app.test_request_context():
+            corporation = Corporation.lookup(98000001, 'Ever Flow')
+            resolved = self.add_request(corporation_id=corporation.id)
+            self.assertEqual(self.matching('corporation', 'Ever Flow'),
+                    {self.request.id, resolved})
+            self.assertEqual(self.matching('corporation', 'Other Corp'),
+                    set())
+            self.assertEqual(Request.distinct_names('corporation'),
+                    {'Ever Flow'})
+
+
 class TestDelete(TestModels):
 
     def test_delete_action(self):
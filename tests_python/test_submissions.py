@@ -0,0 +1,169 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import datetime as dt
+from decimal import Decimal
+import re
+from requests.exceptions import ConnectionError
+from evesrp import db, submissions
+from evesrp.killmail import Killmail
+from evesrp.models import Request, KillmailSubmission, SubmissionStatus
+from evesrp.auth import PermissionType
+from evesrp.auth.models import Pilot, Division, Permission
+from evesrp.util import utc
+from .util_tests import TestLogin
+
+
+class FakeKillmail(Killmail):
+
+    # Set to make retrieving killmails fail
+    unreachable = False
+
+    def __init__(self, url):
+        match = re.match(r'https://kills\.example\.com/(\d+)/$', url)
+        if match is None:
+            raise ValueError("'{}' is not a test killmail.".format(url))
+        if self.unreachable:
+            raise ConnectionError("kills.example.com is down")
+        kill_id = int(match.group(1))
+        # Odd kills are lost by someone else's pilot
+        pilot_id = 2 if kill_id % 2 else 1
+        super(FakeKillmail, self).__init__(kill_id=kill_id, pilot_id=pilot_id,
+                pilot='Pilot {}'.format(pilot_id),
+                corp='Center of Applied Studies', ship='Revenant',
+                system='Jita', constellation='Kimotoro', region='The Forge',
+                timestamp=dt.datetime(2015, 1, 1, tzinfo=utc),
+                value=Decimal(1000000), url=url, verified=True)
+
+
+class TestAsyncSubmission(TestLogin):
+
+    def app_config(self):
+        config = super(TestAsyncSubmission, self).app_config()
+        config['SRP_ASYNC_KILLMAILS'] = True
+        config['SRP_KILLMAIL_RETRIES'] = 3
+        return config
+
+    def setUp(self):
+        super(TestAsyncSubmission, self).setUp()
+        self.app.killmail_sources = [FakeKillmail]
+        FakeKillmail.unreachable = False
+        with self.app.test_request_context():
+            division = Division('Division 1')
+            Permission(division, PermissionType.submit, self.normal_user)
+            Pilot(self.normal_user, 'Pilot 1', 1)
+            Pilot(self.admin_user, 'Pilot 2', 2)
+            db.session.add(division)
+            db.session.commit()
+            self.division_id = division.id
+
+    def submit(self, kill_id):
+        client = self.login()
+        return client.post('/request/add/', follow_redirects=True, data={
+            'url': 'https://kills.example.com/{}/'.format(kill_id),
+            'details': 'Foo',
+            'division': self.division_id,
+            'submit': True,
+        })
+
+    def submission(self):
+        return KillmailSubmission.query.one()
+
+    def make_due(self):
+        KillmailSubmission.query.update({'next_attempt':
+                dt.datetime.now(utc) - dt.timedelta(seconds=1)})
+        db.session.commit()
+
+    def test_submit_queues(self):
+        resp = self.submit(10)
+        self.assertIn('being verified', resp.get_data(as_text=True))
+        self.assertIn('kills.example.com/10/', resp.get_data(as_text=True))
+        with self.app.test_request_context():
+            self.assertEqual(Request.query.count(), 0)
+            submission = self.submission()
+            self.assertEqual(submission.status, SubmissionStatus.verifying)
+            self.assertEqual(submission.details, 'Foo')
+
+    def test_process(self):
+        self.submit(10)
+        with self.app.test_request_context():
+            self.assertEqual(submissions.process_due(), 1)
+            submission = self.submission()
+            self.assertEqual(submission.status, SubmissionStatus.submitted)
+            self.assertEqual(submission.request_id, 10)
+            srp_request = Request.query.get(10)
+            self.assertEqual(srp_request.details, 'Foo')
+            self.assertEqual(srp_request.submitter.id, self.normal_user.id)
+            # Nothing left to do
+            self.assertEqual(submissions.process_due(), 0)
+
+    def test_claimed_once(self):
+        self.submit(10)
+        with self.app.test_request_context():
+            submission_id = self.submission().id
+            self.assertTrue(submissions.claim(submission_id))
+            self.assertFalse(submissions.claim(submission_id))
+            self.assertEqual(submissions.due_submissions(), [])
+
+    def test_other_pilot(self):
+        self.submit(11)
+        with self.app.test_request_context():
+            submissions.process_due()
+            submission = self.submission()
+            self.assertEqual(submission.status, SubmissionStatus.failed)
+            self.assertIn('characters you control', submission.last_error)
+            self.assertEqual(Request.query.count(), 0)
+
+    def test_duplicate(self):
+        self.submit(10)
+        self.submit(10)
+        with self.app.test_request_context():
+            submissions.process_due()
+            statuses = sorted(s.status.value for s in
+                    KillmailSubmission.query)
+            self.assertEqual(statuses, ['failed', 'submitted'])
+            for submission in KillmailSubmission.query:
+                self.assertEqual(submission.request_id, 10)
+
+    def test_invalid_url(self):
+        self.submit('foo')
+        with self.app.test_request_context():
+            submissions.process_due()
+            submission = self.submission()
+            self.assertEqual(submission.status, SubmissionStatus.failed)
+            self.assertIn('not a test killmail', submission.last_error)
+
+    def test_retry(self):
+        FakeKillmail.unreachable = True
+        self.submit(10)
+        with self.app.test_request_context():
+            now = dt.datetime.now(utc)
+            submissions.process_due()
+            submission = self.submission()
+            self.assertEqual(submission.status, SubmissionStatus.verifying)
+            self.assertEqual(submission.attempts, 1)
+            self.assertIn('down', submission.last_error)
+            next_attempt = submission.next_attempt
+            if next_attempt.tzinfo is None:
+                next_attempt = next_attempt.replace(tzinfo=utc)
+            self.assertGreater(next_attempt, now + dt.timedelta(seconds=14))
+            # Not due yet
+            self.assertEqual(submissions.process_due(), 0)
+            # Succeeds once the site is back
+            FakeKillmail.unreachable = False
+            self.make_due()
+            submissions.process_due()
+            submission = self.submission()
+            self.assertEqual(submission.status, SubmissionStatus.submitted)
+            self.assertEqual(submission.attempts, 2)
+
+    def test_retries_exhausted(self):
+        FakeKillmail.unreachable = True
+        self.submit(10)
+        with self.app.test_request_context():
+            for attempt in range(3):
+                self.make_due()
+                submissions.process_due()
+            submission = self.submission()
+            self.assertEqual(submission.status, SubmissionStatus.failed)
+            self.assertIn('try again later', submission.last_error)
+            self.assertEqual(submissions.due_submissions(), [])
@@ -1,6 +1,6 @@
 from __future__ import unicode_literals
 from unittest import TestCase
-from evesrp.transformers import Transformer
+from evesrp.transformers import Transformer, from_spec
 try:
     from unittest.mock import MagicMock
 except ImportError:
@@ -25,3 +25,12 @@ class TestTransformer(TestCase):
 
     def test_transform(self):
         self.assertEqual(self.transformer('bar'), 'foo/bar')
+
+
+class TestTransformerSpec(TestCase):
+
+    def test_round_trip(self):
+        transformer = Transformer('Foo', 'foo/{}')
+        spec = transformer.spec
+        self.assertEqual(spec['type'], 'evesrp.transformers.Transformer')
+        self.assertEqual(from_spec(spec), transformer)
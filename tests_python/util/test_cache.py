@@ -0,0 +1,64 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from unittest import TestCase
+from jinja2 import Environment
+from evesrp.util.cache import LRUCache, FragmentCache, FragmentCacheExtension
+from ..util_tests import TestApp
+
+
+class TestLRUCache(TestCase):
+
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        # Touch 'a' so 'b' is the least recently used
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(len(cache), 2)
+
+
+class TestFragmentCache(TestCase):
+
+    def test_shared_store(self):
+        class DictStore(dict):
+            def set(self, key, value, timeout=None):
+                self[key] = value
+        shared = DictStore()
+        first = FragmentCache(shared=shared)
+        second = FragmentCache(shared=shared)
+        first.set('key', 'value')
+        self.assertEqual(second.get('key'), 'value')
+
+
+class TestFragmentCacheExtension(TestApp):
+
+    def setUp(self):
+        super(TestFragmentCacheExtension, self).setUp()
+        self.env = Environment(extensions=[FragmentCacheExtension])
+        self.env.fragment_cache = FragmentCache()
+        self.template = self.env.from_string(
+                "{% cache 'test', item.id, item.version %}"
+                "{{ item.name }}"
+                "{% endcache %}")
+
+    def render(self, **item):
+        with self.app.test_request_context():
+            return self.template.render(item=item)
+
+    def test_cached(self):
+        self.assertEqual(self.render(id=1, version=1, name='Foo'), 'Foo')
+        # Same key, so the cached fragment is used
+        self.assertEqual(self.render(id=1, version=1, name='Bar'), 'Foo')
+
+    def test_version_change(self):
+        self.assertEqual(self.render(id=1, version=1, name='Foo'), 'Foo')
+        self.assertEqual(self.render(id=1, version=2, name='Bar'), 'Bar')
+
+    def test_no_cache(self):
+        self.env.fragment_cache = None
+        self.assertEqual(self.render(id=1, version=1, name='Foo'), 'Foo')
+        self.assertEqual(self.render(id=1, version=1, name='Bar'), 'Bar')
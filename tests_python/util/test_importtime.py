@@ -0,0 +1,43 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import sys
+from unittest import TestCase, skipIf
+from evesrp.util.importtime import parse_importtime, profile_imports, \
+        imported_modules
+
+
+create_app = ("import evesrp\n"
+        "evesrp.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://',"
+        "'SRP_USER_AGENT_EMAIL': 'testing@example.com'})")
+
+
+class TestImportTime(TestCase):
+
+    def test_parse(self):
+        output = '\n'.join((
+            'import time: self [us] | cumulative | imported package',
+            'import time:       309 |        309 |   evesrp.routing',
+            'import time:      1228 |       1228 |       evesrp.util.crest',
+            'import time:      1917 |     323176 | evesrp',
+            'Traceback (most recent call last):',
+        ))
+        times = parse_importtime(output)
+        self.assertEqual([t.module for t in times],
+                ['evesrp.routing', 'evesrp.util.crest', 'evesrp'])
+        self.assertEqual(times[2].self_time, 1917)
+        self.assertEqual(times[2].cumulative, 323176)
+
+    @skipIf(sys.version_info < (3, 7), "-X importtime requires Python 3.7")
+    def test_profile(self):
+        times = profile_imports(create_app)
+        modules = set(t.module for t in times)
+        self.assertIn('evesrp.views.requests', modules)
+        self.assertNotIn('evesrp.static_data', modules)
+
+    def test_static_data_lazy(self):
+        modules = imported_modules(create_app)
+        self.assertIn('evesrp.views.requests', modules)
+        # Large or optional modules are only imported when used
+        self.assertNotIn('evesrp.static_data', modules)
+        self.assertNotIn('evesrp.auth.bravecore', modules)
+        self.assertNotIn('evesrp.auth.testauth', modules)
@@ -0,0 +1,53 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from decimal import Decimal
+from babel import numbers
+from flask import render_template_string
+from ..util_tests import TestApp
+from evesrp.util import locale
+
+
+class TestFormatters(TestApp):
+
+    def test_same_as_babel(self):
+        for locale_name in ('en_US', 'de_DE'):
+            formatter = locale.formatter(locale_name)
+            for value in (Decimal('1234567.891'), Decimal('-12.5'), 0):
+                self.assertEqual(formatter.currency(value),
+                        numbers.format_decimal(value, format='#,##0.00;-#',
+                            locale=locale_name))
+                self.assertEqual(formatter.number(value),
+                        numbers.format_number(value, locale=locale_name))
+            self.assertEqual(formatter.percent(Decimal('0.25')),
+                    numbers.format_percent(Decimal('0.25'),
+                        locale=locale_name))
+
+    def test_formatter_cached(self):
+        self.assertIs(locale.formatter('en_US'), locale.formatter('en_US'))
+        self.assertIsNot(locale.formatter('en_US'),
+                locale.formatter('en_GB'))
+
+    def test_currencyfmt_list(self):
+        with self.app.test_request_context():
+            rendered = render_template_string(
+                    "{{ payouts|currencyfmt_list|join('|') }}",
+                    payouts=[Decimal('1000000'), Decimal('2.5')])
+        self.assertEqual(rendered, '1,000,000.00|2.50')
+
+
+class TestLocales(TestApp):
+
+    def app_config(self):
+        config = super(TestLocales, self).app_config()
+        config['SRP_LOCALES'] = ['en_GB', 'xx_XX']
+        return config
+
+    def test_enabled_locales(self):
+        with self.app.test_request_context():
+            enabled = [str(l) for l in locale.enabled_locales()]
+        available = self.app.available_locales
+        if 'en_GB' in available:
+            self.assertEqual(enabled, ['en_GB'])
+        else:
+            self.assertEqual(enabled, [])
+        self.assertEqual(self.app.enabled_locale_names, frozenset(enabled))
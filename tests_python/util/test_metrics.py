@@ -0,0 +1,142 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import datetime as dt
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from unittest import TestCase
+from evesrp.util import metrics
+from evesrp.util.metrics import Registry
+from ..util_tests import TestLogin
+
+
+class TestRegistry(TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+        self.counter = self.registry.counter('test_total', 'Test counter.',
+                ('kind',))
+        self.histogram = self.registry.histogram('test_seconds',
+                'Test histogram.', buckets=(0.1, 1))
+
+    def test_render(self):
+        self.counter.inc(kind='a')
+        self.counter.inc(2, kind='a')
+        self.histogram.observe(0.05)
+        self.histogram.observe(0.5)
+        self.histogram.observe(5)
+        lines = self.registry.render().splitlines()
+        self.assertIn('# TYPE test_total counter', lines)
+        self.assertIn('test_total{kind="a"} 3.0', lines)
+        self.assertIn('test_seconds_bucket{le="0.1"} 1.0', lines)
+        self.assertIn('test_seconds_bucket{le="1.0"} 2.0', lines)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 3.0', lines)
+        self.assertIn('test_seconds_count 3.0', lines)
+
+    def test_threads(self):
+        def work():
+            for i in range(100):
+                self.counter.inc(kind='b')
+        threads = [threading.Thread(target=work) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.counter.collect(), {('b',): 400})
+
+    def test_multiprocess(self):
+        directory = tempfile.mkdtemp()
+        try:
+            self.registry.configure(directory)
+            self.counter.inc(kind='a')
+            self.registry.flush(force=True)
+            # Pretend the file was written by another worker
+            shutil.move(self.registry._path(os.getpid()),
+                    self.registry._path(os.getppid()))
+            self.counter.inc(kind='a')
+            self.assertIn('test_total{kind="a"} 3.0',
+                    self.registry.render().splitlines())
+        finally:
+            shutil.rmtree(directory)
+
+    def test_exited_worker(self):
+        directory = tempfile.mkdtemp()
+        try:
+            self.registry.configure(directory)
+            self.counter.inc(kind='a')
+            self.registry.flush(force=True)
+            exited = subprocess.Popen([sys.executable, '-c', ''])
+            exited.wait()
+            path = self.registry._path(exited.pid)
+            shutil.move(self.registry._path(os.getpid()), path)
+            self.assertIn('test_total{kind="a"} 1.0',
+                    self.registry.render().splitlines())
+            self.assertFalse(os.path.exists(path))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_thread_shards_reused(self):
+        def work():
+            self.counter.inc(kind='c')
+        for i in range(50):
+            thread = threading.Thread(target=work)
+            thread.start()
+            thread.join()
+        self.assertEqual(self.counter.collect(), {('c',): 50})
+        self.assertLess(len(self.counter._values.shards()), 50)
+
+
+class TestMetricsView(TestLogin):
+
+    def app_config(self):
+        config = super(TestMetricsView, self).app_config()
+        config['SRP_METRICS_TOKEN'] = 'scrape-token'
+        return config
+
+    def test_token_access(self):
+        client = self.app.test_client()
+        client.get('/request/personal/')
+        resp = client.get('/metrics',
+                headers={'Authorization': 'Bearer scrape-token'})
+        self.assertEqual(resp.status_code, 200)
+        data = resp.get_data(as_text=True)
+        self.assertIn('evesrp_request_duration_seconds_count', data)
+        self.assertIn('endpoint="requests.personal_requests"', data)
+
+    def test_restricted(self):
+        client = self.app.test_client()
+        self.assertEqual(client.get('/metrics').status_code, 403)
+        self.assertEqual(client.get('/metrics',
+                headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+        # Local addresses are not trusted on their own
+        self.assertEqual(client.get('/metrics',
+                environ_base={'REMOTE_ADDR': '127.0.0.1'}).status_code, 403)
+        client = self.login(self.admin_name)
+        self.assertEqual(client.get('/metrics').status_code, 200)
+
+    def test_allowed_ips(self):
+        self.app.config['SRP_METRICS_ALLOWED_IPS'] = ['10.0.0.5']
+        client = self.app.test_client()
+        headers = {'Authorization': 'Bearer scrape-token'}
+        self.assertEqual(client.get('/metrics', headers=headers,
+                environ_base={'REMOTE_ADDR': '10.0.0.6'}).status_code, 403)
+        self.assertEqual(client.get('/metrics', headers=headers,
+                environ_base={'REMOTE_ADDR': '10.0.0.5'}).status_code, 200)
+
+
+class TestHTTPMetrics(TestCase):
+
+    def test_response_hook(self):
+        class Response(object):
+            url = 'https://esi.tech.ccp.is/v1/killmails/1/abc/'
+            elapsed = dt.timedelta(milliseconds=20)
+            status_code = 200
+        before = metrics.http_client_responses.collect().get(
+                ('esi.tech.ccp.is', '200'), 0)
+        metrics.record_http_response(Response())
+        after = metrics.http_client_responses.collect()[
+                ('esi.tech.ccp.is', '200')]
+        self.assertEqual(after - before, 1)
@@ -0,0 +1,87 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import json
+import logging
+from unittest import TestCase
+from evesrp.util.sqlstats import DbStats, normalize
+from ..views.requests.test_lists import TestRequestList
+
+
+class TestNormalize(TestCase):
+
+    def test_literals(self):
+        self.assertEqual(
+                normalize("SELECT * FROM pilot WHERE id = 5 AND name = 'A'"),
+                'SELECT * FROM pilot WHERE id = ? AND name = ?')
+
+    def test_in_lists(self):
+        self.assertEqual(normalize('SELECT id FROM request\n'
+                    'WHERE id IN (?, ?, ?)'),
+                normalize('SELECT id FROM request WHERE id IN (?)'))
+
+    def test_repeated(self):
+        stats = DbStats()
+        for i in range(3):
+            stats.add_query('SELECT name FROM pilot WHERE id = {}'.format(i),
+                    0.001, 'site')
+        stats.add_query('SELECT name FROM division', 0.001, 'site')
+        self.assertEqual(stats.total_queries, 4)
+        repeated = stats.repeated(3)
+        self.assertEqual(len(repeated), 1)
+        self.assertEqual(repeated[0].count, 3)
+        self.assertEqual(dict(repeated[0].call_sites), {'site': 3})
+
+
+class TestRequestProfiling(TestRequestList):
+
+    def test_server_timing(self):
+        client = self.login(self.admin_name)
+        resp = client.get('/request/pending/')
+        self.assertIn('Server-Timing', resp.headers)
+        self.assertTrue(resp.headers['Server-Timing'].startswith('db;dur='))
+
+    def test_server_timing_admin_only(self):
+        client = self.login(self.normal_name)
+        resp = client.get('/request/personal/')
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn('Server-Timing', resp.headers)
+        resp = self.app.test_client().get('/login/')
+        self.assertNotIn('Server-Timing', resp.headers)
+
+    def test_debug_endpoint(self):
+        client = self.login(self.admin_name)
+        client.get('/request/pending/')
+        resp = client.get('/api/debug/sql/',
+                headers={'Accept': 'application/json'})
+        self.assertEqual(resp.status_code, 200)
+        profiles = json.loads(resp.get_data(as_text=True))['requests']
+        listing = [p for p in profiles if p['path'] == '/request/pending/']
+        self.assertEqual(len(listing), 1)
+        statements = listing[0]['statements']
+        self.assertGreater(len(statements), 0)
+        self.assertTrue(any(site['call_site'].startswith('evesrp.')
+                for statement in statements
+                for site in statement['call_sites']))
+
+    def test_debug_endpoint_admin_only(self):
+        client = self.login(self.normal_name)
+        resp = client.get('/api/debug/sql/',
+                headers={'Accept': 'application/json'})
+        self.assertEqual(resp.status_code, 403)
+
+    def test_slow_statements_explained(self):
+        self.app.config['SRP_SQL_SLOW_THRESHOLD'] = 0
+        client = self.login(self.admin_name)
+        messages = []
+        handler = logging.Handler()
+        handler.emit = lambda record: messages.append(record.getMessage())
+        logger = logging.getLogger('evesrp.util.sqlstats')
+        logger.addHandler(handler)
+        try:
+            client.get('/request/pending/')
+        finally:
+            logger.removeHandler(handler)
+        slow = [m for m in messages if m.startswith('Slow statement')]
+        self.assertGreater(len(slow), 0)
+        for message in slow:
+            self.assertNotIn('EXPLAIN failed', message)
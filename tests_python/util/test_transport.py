@@ -0,0 +1,79 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from unittest import TestCase
+from httmock import HTTMock, all_requests
+import requests
+from requests.adapters import HTTPAdapter
+from evesrp.util.transport import TransportSession, CircuitBreaker,\
+        ErrorBudget, CircuitOpenError, ErrorBudgetExhausted
+from ..util_tests import response
+
+
+class TestTransportSession(TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.session = TransportSession(retries=2, backoff=0,
+                circuit_breaker=CircuitBreaker(threshold=3, reset_timeout=60),
+                error_budget=ErrorBudget(floor=5, max_pause=0),
+                esi_hosts=('esi.example.com',))
+
+    def mock(self, *statuses, **kwargs):
+        statuses = list(statuses)
+        headers = kwargs.get('headers', {})
+        @all_requests
+        def handler(url, request):
+            self.calls.append(request)
+            return response(status_code=statuses.pop(0), content='{}',
+                    headers=headers)
+        return HTTMock(handler)
+
+    def test_default_timeout(self):
+        sent = []
+        class RecordingAdapter(HTTPAdapter):
+            def send(self, request, **kwargs):
+                sent.append(kwargs)
+                return response(status_code=200, content='{}')
+        self.session.mount('https://', RecordingAdapter())
+        self.session.get('https://zkillboard.com/api/')
+        self.assertEqual(sent[0]['timeout'], self.session.timeout)
+        self.session.get('https://zkillboard.com/api/', timeout=1)
+        self.assertEqual(sent[1]['timeout'], 1)
+
+    def test_retry_server_errors(self):
+        with self.mock(503, 502, 200):
+            resp = self.session.get('https://zkillboard.com/api/')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(self.calls), 3)
+
+    def test_no_retry_post(self):
+        with self.mock(503, 200):
+            resp = self.session.post('https://zkillboard.com/api/')
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_circuit_breaker(self):
+        with self.mock(500, 500, 500):
+            resp = self.session.get('https://zkillboard.com/api/')
+        self.assertEqual(resp.status_code, 500)
+        with self.mock(200):
+            self.assertRaises(CircuitOpenError, self.session.get,
+                    'https://zkillboard.com/api/')
+            # Other hosts are not affected
+            self.session.get('https://esi.example.com/')
+        self.assertEqual(len(self.calls), 4)
+
+    def test_error_budget(self):
+        headers = {
+            'X-ESI-Error-Limit-Remain': '5',
+            'X-ESI-Error-Limit-Reset': '30',
+        }
+        with self.mock(404, headers=headers):
+            self.session.get('https://esi.example.com/v1/killmails/1/')
+        with self.mock(200):
+            self.assertRaises(ErrorBudgetExhausted, self.session.get,
+                    'https://esi.example.com/v1/killmails/1/')
+            self.assertTrue(isinstance(ErrorBudgetExhausted(),
+                    requests.exceptions.RequestException))
+            # Hosts other than ESI are not limited
+            self.session.get('https://zkillboard.com/api/')
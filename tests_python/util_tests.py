@@ -17,7 +17,7 @@ from flask_wtf import Form
 
 class TestApp(TestCase):
 
-    def setUp(self):
+    def app_config(self):
         config = {
             'SECRET_KEY': 'testing',
             'SRP_USER_AGENT_EMAIL': 'testing@example.com',
@@ -26,7 +26,10 @@ class TestApp(TestCase):
         # Default to an ephemeral SQLite DB for testing unless given another
         # database to connect to.
         config['SQLALCHEMY_DATABASE_URI'] = env.get('DB', 'sqlite:///')
-        self.app = create_app(config)
+        return config
+
+    def setUp(self):
+        self.app = create_app(self.app_config())
         db.create_all(app=self.app)
 
     def tearDown(self):
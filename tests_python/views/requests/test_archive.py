@@ -0,0 +1,126 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import datetime as dt
+from flask import json
+from sqlalchemy import event
+from evesrp import db
+from evesrp.models import Request, ActionType, Action, RequestChange,\
+        archive_requests, request_archive, action_archive
+from . import test_lists
+
+
+class TestArchivedRequestLists(test_lists.TestTableRequestLists):
+
+    def setUp(self):
+        super(TestArchivedRequestLists, self).setUp()
+        with self.app.test_request_context():
+            for srp_request in Request.query.filter(Request.finalized):
+                Action(srp_request, self.admin_user, 'Done',
+                        type_=ActionType.comment)
+            db.session.commit()
+            cutoff = dt.datetime.utcnow() + dt.timedelta(days=1)
+            self.assertEqual(sum(archive_requests(cutoff, batch_size=3)), 4)
+
+    def union_queries(self, client, path):
+        statements = []
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+        engine = db.get_engine(self.app)
+        event.listen(engine, 'after_cursor_execute', record)
+        try:
+            resp = client.get(path, follow_redirects=True)
+            self.assertEqual(resp.status_code, 200)
+        finally:
+            event.remove(engine, 'after_cursor_execute', record)
+        return [s for s in statements if 'UNION ALL' in s]
+
+    def test_archived_rows(self):
+        with self.app.test_request_context():
+            self.assertEqual(Request.query.filter(Request.finalized).count(),
+                    0)
+            self.assertEqual(db.session.query(request_archive).count(), 4)
+            self.assertEqual(db.session.query(action_archive).count(), 4)
+
+    def test_pending_skips_archive(self):
+        client = self.login(self.admin_name)
+        self.assertEqual(self.union_queries(client, '/request/pending/'), [])
+
+    def test_newer_timestamp_skips_archive(self):
+        client = self.login(self.admin_name)
+        tomorrow = dt.datetime.utcnow() + dt.timedelta(days=1)
+        path = '/request/personal/submit_timestamp/>{}/'.format(
+                tomorrow.strftime('%Y-%m-%d'))
+        self.assertEqual(self.union_queries(client, path), [])
+
+    def test_export_includes_archive(self):
+        client = self.login(self.admin_name)
+        resp = client.get('/request/all/export.ndjson')
+        self.assertEqual(resp.status_code, 200)
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 14)
+
+    def archived_id(self):
+        with self.app.test_request_context():
+            return db.session.query(request_archive.c.id).first()[0]
+
+    def test_view_read_only(self):
+        request_id = self.archived_id()
+        client = self.login(self.admin_name)
+        resp = client.get('/request/{}/'.format(request_id))
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('restoreForm', resp.get_data(as_text=True))
+        self.assertNotIn('actionForm', resp.get_data(as_text=True))
+        with self.app.test_request_context():
+            self.assertIsNone(Request.query.get(request_id))
+            self.assertEqual(db.session.query(request_archive).count(), 4)
+
+    def test_modify_archived(self):
+        request_id = self.archived_id()
+        client = self.login(self.admin_name)
+        resp = client.post('/request/{}/'.format(request_id),
+                data={'id_': 'comment', 'note': 'Nope'})
+        self.assertEqual(resp.status_code, 302)
+        with self.app.test_request_context():
+            self.assertIsNone(Request.query.get(request_id))
+            self.assertEqual(db.session.query(action_archive)\
+                    .filter_by(request_id=request_id).count(), 1)
+
+    def test_restore(self):
+        request_id = self.archived_id()
+        with self.app.test_request_context():
+            last_change = db.session.query(db.func.max(RequestChange.id))\
+                    .scalar()
+        client = self.login(self.admin_name)
+        resp = client.post('/request/{}/'.format(request_id),
+                data={'id_': 'restore'})
+        self.assertEqual(resp.status_code, 302)
+        with self.app.test_request_context():
+            srp_request = Request.query.get(request_id)
+            self.assertIsNotNone(srp_request)
+            self.assertEqual(len(srp_request.actions), 1)
+            self.assertEqual(db.session.query(request_archive).count(), 3)
+            changes = RequestChange.query\
+                    .filter(RequestChange.id > last_change).all()
+            self.assertEqual([c.request_id for c in changes], [request_id])
+            # Archived once and restored once
+            self.assertGreaterEqual(srp_request.version, 2)
+
+    def test_changes_report_archived(self):
+        request_id = self.archived_id()
+        client = self.login(self.admin_name)
+        self.app.config['SRP_CHANGES_SETTLE_SECONDS'] = 0
+        resp = client.get('/api/requests/changes?since=0')
+        changes = json.loads(resp.get_data(as_text=True))['changes']
+        changes = dict((c['id'], c) for c in changes)
+        self.assertTrue(changes[request_id]['archived'])
+        self.assertNotIn('deleted', changes[request_id])
+
+    def test_batch_includes_archived(self):
+        request_id = self.archived_id()
+        client = self.login(self.admin_name)
+        resp = client.get('/api/requests/?ids={}'.format(request_id))
+        details = json.loads(resp.get_data(as_text=True))
+        self.assertEqual(len(details), 1)
+        self.assertTrue(details[0]['archived'])
+        self.assertEqual(details[0]['valid_actions'], [])
+        self.assertEqual(len(details[0]['actions']), 1)
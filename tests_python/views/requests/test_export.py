@@ -0,0 +1,75 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import csv
+import gzip
+import io
+import json
+from decimal import Decimal
+from evesrp import db
+from evesrp.models import Request, ActionType, AbsoluteModifier,\
+        RelativeModifier
+from .test_lists import TestRequestList
+
+
+class TestRequestExport(TestRequestList):
+
+    def get_export(self, client, path, **kwargs):
+        resp = client.get(path, **kwargs)
+        self.assertEqual(resp.status_code, 200)
+        return resp
+
+    def test_csv(self):
+        client = self.login(self.admin_name)
+        resp = self.get_export(client, '/request/all/export.csv')
+        self.assertEqual(resp.mimetype, 'text/csv')
+        rows = list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+        self.assertEqual(len(rows), 14)
+        self.assertEqual(rows[0]['pilot'], 'Generic Pilot')
+        self.assertIn(rows[0]['division'], ('Division 1', 'Division 2'))
+
+    def test_filtered_ndjson(self):
+        client = self.login(self.admin_name)
+        resp = self.get_export(client,
+                '/request/all/status/paid/export.ndjson')
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 2)
+        for line in lines:
+            self.assertEqual(json.loads(line)['status'], 'paid')
+
+    def test_personal_export(self):
+        client = self.login(self.normal_name)
+        resp = self.get_export(client, '/request/personal/export.ndjson')
+        self.assertEqual(len(resp.get_data(as_text=True).splitlines()), 7)
+
+    def test_modifiers(self):
+        with self.app.test_request_context():
+            srp_request = Request.query.filter_by(
+                    status=ActionType.evaluating).first()
+            request_id = srp_request.id
+            AbsoluteModifier(srp_request, self.admin_user, '', 1000)
+            RelativeModifier(srp_request, self.admin_user, '', Decimal('0.5'))
+            voided = AbsoluteModifier(srp_request, self.admin_user, '', 50)
+            voided.void(self.admin_user)
+            db.session.commit()
+        client = self.login(self.admin_name)
+        resp = self.get_export(client, '/request/all/export.ndjson')
+        exported = [json.loads(l) for l in
+                resp.get_data(as_text=True).splitlines()]
+        exported = {e['id']: e for e in exported}
+        self.assertEqual(Decimal(exported[request_id]['absolute_modifiers']),
+                Decimal(1000))
+        self.assertEqual(Decimal(exported[request_id]['relative_modifiers']),
+                Decimal('0.5'))
+
+    def test_gzip(self):
+        client = self.login(self.admin_name)
+        resp = self.get_export(client, '/request/all/export.csv',
+                headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        data = gzip.GzipFile(fileobj=io.BytesIO(resp.get_data())).read()
+        self.assertEqual(len(data.decode('utf-8').splitlines()), 15)
+
+    def test_permissions(self):
+        client = self.login(self.normal_name)
+        resp = client.get('/request/all/export.csv')
+        self.assertEqual(resp.status_code, 403)
@@ -0,0 +1,65 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import xml.etree.ElementTree as ET
+from evesrp import db
+from evesrp.models import Request, Action, ActionType
+from .test_lists import TestRequestList
+
+
+class TestRequestFeed(TestRequestList):
+
+    def get_feed(self, client, path='/request/pending/rss.xml', **kwargs):
+        resp = client.get(path, **kwargs)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'application/rss+xml')
+        return resp
+
+    def items(self, resp):
+        root = ET.fromstring(resp.get_data())
+        return root.findall('./channel/item')
+
+    def test_feed_items(self):
+        client = self.login(self.admin_name)
+        items = self.items(self.get_feed(client))
+        self.assertEqual(len(items), 10)
+        with self.app.test_request_context():
+            for item in items:
+                request_id, _, action_id = item.find('guid').text\
+                        .partition('-')
+                srp_request = Request.query.get(int(request_id))
+                self.assertIn(srp_request.status, ActionType.pending)
+                if srp_request.actions:
+                    self.assertEqual(int(action_id),
+                            srp_request.actions[0].id)
+                else:
+                    self.assertEqual(action_id, '')
+                self.assertEqual(item.find('category').text,
+                        srp_request.division.name)
+
+    def test_personal_feed(self):
+        client = self.login(self.normal_name)
+        items = self.items(self.get_feed(client, '/request/personal/rss.xml'))
+        self.assertEqual(len(items), 7)
+
+    def test_conditional_requests(self):
+        client = self.login(self.admin_name)
+        resp = self.get_feed(client)
+        etag = resp.headers['ETag']
+        resp = client.get('/request/pending/rss.xml',
+                headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+
+    def test_cached_until_changed(self):
+        client = self.login(self.admin_name)
+        self.get_feed(client)
+        self.assertEqual(len(self.app.feed_cache), 1)
+        etag = self.get_feed(client).headers['ETag']
+        self.assertEqual(len(self.app.feed_cache), 1)
+        with self.app.test_request_context():
+            srp_request = Request.query.filter_by(
+                    status=ActionType.evaluating).first()
+            Action(srp_request, self.admin_user, type_=ActionType.rejected)
+            db.session.commit()
+        resp = self.get_feed(client, headers={'If-None-Match': etag})
+        self.assertEqual(len(self.items(resp)), 9)
+        self.assertNotEqual(resp.headers['ETag'], etag)
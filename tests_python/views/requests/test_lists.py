@@ -1,9 +1,13 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 import datetime as dt
+from decimal import Decimal
 from bs4 import BeautifulSoup
+from flask import json
 from evesrp import db
-from evesrp.models import Request, ActionType
+from sqlalchemy import event
+from evesrp.models import Request, ActionType, Action, AbsoluteModifier,\
+        RelativeModifier
 from evesrp.auth import PermissionType
 from evesrp.auth.models import Pilot, Division, Permission
 from ...util_tests import TestLogin
@@ -104,3 +108,62 @@ class TestPayoutList(TestRequestList):
 
     def test_payout(self):
         self.elevated_list_checker('/request/pay/', 4)
+
+    def test_id_filter(self):
+        with self.app.test_request_context():
+            approved = Request.query.filter_by(status=ActionType.approved)\
+                    .first().id
+            evaluating = Request.query.filter_by(
+                    status=ActionType.evaluating).first().id
+        self.accessible_list_checker(self.admin_name,
+                '/request/pay/id/{}'.format(approved), 1)
+        self.accessible_list_checker(self.admin_name,
+                '/request/pay/id/{}'.format(evaluating), 0)
+
+    def count_queries(self, client, path):
+        queries = []
+        def count_query(*args):
+            queries.append(args[2])
+        engine = db.get_engine(self.app)
+        event.listen(engine, 'after_cursor_execute', count_query)
+        try:
+            resp = client.get(path)
+            self.assertEqual(resp.status_code, 200)
+        finally:
+            event.remove(engine, 'after_cursor_execute', count_query)
+        return len(queries)
+
+    def add_approved_requests(self, count):
+        with self.app.test_request_context():
+            division = Division.query.first()
+            for i in range(count):
+                srp_request = Request(self.admin_user, 'Details', division,
+                        self.sample_request_data.items(),
+                        killmail_url='http://paxswill.com',
+                        status=ActionType.evaluating)
+                AbsoluteModifier(srp_request, self.admin_user, 'Bonus', 1000)
+                voided = RelativeModifier(srp_request, self.admin_user,
+                        'Penalty', Decimal('-0.1'))
+                voided.void(self.admin_user)
+                Action(srp_request, self.admin_user, 'Approved',
+                        ActionType.approved)
+                db.session.add(srp_request)
+            db.session.commit()
+
+    def test_constant_queries(self):
+        client = self.login(self.admin_name)
+        # Load the division transformers into the cache first
+        self.count_queries(client, '/request/pay/')
+        few = self.count_queries(client, '/request/pay/')
+        few_json = self.count_queries(client, '/request/pay/?fmt=json')
+        self.add_approved_requests(10)
+        many = self.count_queries(client, '/request/pay/')
+        self.assertEqual(few, many)
+        # Including the valid actions in the extended JSON
+        many_json = self.count_queries(client, '/request/pay/?fmt=json')
+        self.assertEqual(few_json, many_json)
+        resp = client.get('/request/pay/?fmt=json')
+        requests = json.loads(resp.get_data(as_text=True))['requests']
+        for request_json in requests:
+            self.assertEqual(set(request_json['valid_actions']),
+                    {'evaluating', 'paid'})
@@ -0,0 +1,114 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import csv
+import io
+import json
+from decimal import Decimal
+from evesrp import db
+from evesrp.models import Request, ActionType, Action
+from .test_lists import TestRequestList
+
+
+class TestPayoutManifest(TestRequestList):
+
+    def setUp(self):
+        super(TestPayoutManifest, self).setUp()
+        with self.app.test_request_context():
+            approved = Request.query.filter_by(status=ActionType.approved)
+            approved.update({'payout': Decimal('1000000')},
+                    synchronize_session=False)
+            db.session.commit()
+            self.approved_ids = sorted(r.id for r in approved)
+
+    def get_manifest(self, client):
+        resp = client.get('/request/pay/manifest.json')
+        self.assertEqual(resp.status_code, 200)
+        return json.loads(resp.get_data(as_text=True))
+
+    def test_json_manifest(self):
+        client = self.login(self.admin_name)
+        data = self.get_manifest(client)
+        self.assertEqual(len(data['manifest']), 2)
+        self.assertEqual(data['total'], '4000000.00')
+        request_ids = []
+        for group in data['manifest']:
+            self.assertEqual(group['pilot'], 'Generic Pilot')
+            self.assertEqual(group['request_count'], 2)
+            self.assertEqual(group['payout'], '2000000.00')
+            request_ids.extend(group['request_ids'])
+        self.assertEqual(sorted(request_ids), self.approved_ids)
+
+    def test_csv_manifest(self):
+        client = self.login(self.admin_name)
+        resp = client.get('/request/pay/manifest.csv')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('X-Manifest-Snapshot', resp.headers)
+        rows = list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['request_count'], '2')
+
+    def test_permissions(self):
+        client = self.login(self.normal_name)
+        resp = client.get('/request/pay/manifest.json')
+        self.assertEqual(resp.status_code, 403)
+
+    def test_mark_paid(self):
+        client = self.login(self.admin_name)
+        snapshot = self.get_manifest(client)['snapshot']
+        resp = client.post('/request/pay/manifest/paid',
+                data={'snapshot': snapshot}, headers={'Accept':
+                    'application/json'})
+        self.assertEqual(resp.status_code, 200)
+        with self.app.test_request_context():
+            statuses = set(r.status for r in
+                    Request.query.filter(Request.id.in_(self.approved_ids)))
+            self.assertEqual(statuses, {ActionType.paid})
+
+    def test_stale_snapshot(self):
+        client = self.login(self.admin_name)
+        snapshot = self.get_manifest(client)['snapshot']
+        with self.app.test_request_context():
+            srp_request = Request.query.get(self.approved_ids[0])
+            Action(srp_request, self.admin_user, type_=ActionType.evaluating)
+            db.session.commit()
+        resp = client.post('/request/pay/manifest/paid',
+                data={'snapshot': snapshot})
+        self.assertEqual(resp.status_code, 409)
+        with self.app.test_request_context():
+            paid = Request.query.filter_by(status=ActionType.paid).count()
+            # Only the two requests that were already paid
+            self.assertEqual(paid, 2)
+
+    def test_tampered_snapshot(self):
+        client = self.login(self.admin_name)
+        snapshot = self.get_manifest(client)['snapshot']
+        resp = client.post('/request/pay/manifest/paid',
+                data={'snapshot': snapshot + 'x'})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_replayed_snapshot(self):
+        client = self.login(self.admin_name)
+        snapshot = self.get_manifest(client)['snapshot']
+        resp = client.post('/request/pay/manifest/paid',
+                data={'snapshot': snapshot})
+        self.assertEqual(resp.status_code, 302)
+        # Approve the requests again, the old manifest still can't be used
+        with self.app.test_request_context():
+            for srp_request in Request.query.filter(
+                    Request.id.in_(self.approved_ids)):
+                Action(srp_request, self.admin_user,
+                        type_=ActionType.evaluating)
+                Action(srp_request, self.admin_user,
+                        type_=ActionType.approved)
+            db.session.commit()
+        resp = client.post('/request/pay/manifest/paid',
+                data={'snapshot': snapshot})
+        self.assertEqual(resp.status_code, 409)
+
+    def test_expired_snapshot(self):
+        client = self.login(self.admin_name)
+        snapshot = self.get_manifest(client)['snapshot']
+        self.app.config['SRP_MANIFEST_MAX_AGE'] = -1
+        resp = client.post('/request/pay/manifest/paid',
+                data={'snapshot': snapshot})
+        self.assertEqual(resp.status_code, 400)
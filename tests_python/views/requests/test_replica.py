@@ -0,0 +1,80 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import os.path
+import shutil
+import tempfile
+from bs4 import BeautifulSoup
+from evesrp import db
+from evesrp.models import Request, ActionType
+from evesrp.auth.models import Division
+from .test_lists import TestRequestList
+
+
+class TestReadReplica(TestRequestList):
+
+    def app_config(self):
+        self.db_dir = tempfile.mkdtemp()
+        primary = os.path.join(self.db_dir, 'primary.db')
+        replica = os.path.join(self.db_dir, 'replica.db')
+        config = super(TestReadReplica, self).app_config()
+        config.update({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + primary,
+            'SQLALCHEMY_BINDS': {
+                'replica': 'sqlite:///' + replica,
+            },
+            'SRP_READ_REPLICA_BIND': 'replica',
+            'SRP_READ_REPLICA_PIN_SECONDS': 0,
+        })
+        return config
+
+    def setUp(self):
+        super(TestReadReplica, self).setUp()
+        # Take a snapshot of the primary as the replica, then add a request
+        # to the primary that the (lagging) replica does not have.
+        with self.app.app_context():
+            db.session.remove()
+            db.get_engine(self.app).dispose()
+            shutil.copy(os.path.join(self.db_dir, 'primary.db'),
+                    os.path.join(self.db_dir, 'replica.db'))
+        with self.app.test_request_context():
+            division = Division.query.filter_by(name='Division 1').one()
+            db.session.add(Request(self.normal_user, 'Not replicated',
+                    division, self.sample_request_data.items(),
+                    killmail_url='http://paxswill.com',
+                    status=ActionType.evaluating))
+            db.session.commit()
+
+    def tearDown(self):
+        super(TestReadReplica, self).tearDown()
+        with self.app.app_context():
+            db.get_engine(self.app, bind='replica').dispose()
+        shutil.rmtree(self.db_dir)
+
+    def count_requests(self, data):
+        soup = BeautifulSoup(data, 'html.parser')
+        return len(soup.find_all('td', attrs={'data-attribute': 'status'}))
+
+    def test_listing_reads_replica(self):
+        self.accessible_list_checker(self.normal_name, '/request/personal/', 7)
+
+    def test_other_blueprints_read_primary(self):
+        self.app.config['SRP_READ_REPLICA_BLUEPRINTS'] = []
+        self.accessible_list_checker(self.normal_name, '/request/personal/', 8)
+
+    def test_pinned_after_post(self):
+        self.app.config['SRP_READ_REPLICA_PIN_SECONDS'] = 60
+        # Logging in is a POST, which pins the user to the primary
+        self.accessible_list_checker(self.normal_name, '/request/personal/', 8)
+
+    def test_writes_use_primary(self):
+        with self.app.test_request_context():
+            request_id = Request.query.filter_by(
+                    details='Not replicated').one().id
+        client = self.login(self.admin_name)
+        resp = client.post('/request/{}/'.format(request_id),
+                data={'id_': 'action', 'type_': 'approved', 'note': ''},
+                follow_redirects=True)
+        self.assertEqual(resp.status_code, 200)
+        with self.app.test_request_context():
+            srp_request = Request.query.get(request_id)
+            self.assertEqual(srp_request.status, ActionType.approved)
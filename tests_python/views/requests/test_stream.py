@@ -0,0 +1,90 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import json
+from evesrp import db
+from evesrp.models import Request, Action, ActionType
+from evesrp.util.broadcast import Subscription
+from evesrp.views.requests import RequestStream
+from .test_lists import TestRequestList
+
+
+class TestRequestChangeBroadcast(TestRequestList):
+
+    def test_commit_publishes(self):
+        with self.app.test_request_context():
+            subscription = self.app.request_broadcast.subscribe()
+            srp_request = Request.query.filter_by(
+                    status=ActionType.evaluating).first()
+            Action(srp_request, self.admin_user, type_=ActionType.approved)
+            # Nothing is sent until the transaction is committed
+            self.assertIsNone(subscription.get(timeout=0))
+            db.session.commit()
+            message = subscription.get(timeout=0)
+            self.assertIsNotNone(message)
+            self.assertEqual(message['id'], srp_request.id)
+            self.assertEqual(message['status'], 'approved')
+            self.assertEqual(message['division_id'], srp_request.division_id)
+            self.assertIsNone(subscription.get(timeout=0))
+
+    def test_rollback_discards(self):
+        with self.app.test_request_context():
+            subscription = self.app.request_broadcast.subscribe()
+            srp_request = Request.query.filter_by(
+                    status=ActionType.evaluating).first()
+            Action(srp_request, self.admin_user, type_=ActionType.approved)
+            db.session.flush()
+            db.session.rollback()
+            self.assertIsNone(subscription.get(timeout=0))
+
+    def test_stream_permissions(self):
+        client = self.login(self.normal_name)
+        resp = client.get('/request/pay/stream')
+        self.assertEqual(resp.status_code, 403)
+        client = self.login(self.admin_name)
+        resp = client.get('/request/pay/stream')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'text/event-stream')
+        resp.close()
+
+    def test_local_fanout_multiprocess(self):
+        client = self.login(self.admin_name)
+        resp = client.get('/request/pay/stream',
+                environ_overrides={'wsgi.multiprocess': True})
+        self.assertEqual(resp.status_code, 501)
+
+
+class TestRequestStreamEvents(TestRequestList):
+
+    def test_division_filter(self):
+        subscription = Subscription()
+        subscription.put([
+            {'id': 1, 'division_id': 1, 'submitter_id': 1,
+             'status': 'approved'},
+            {'id': 2, 'division_id': 2, 'submitter_id': 1,
+             'status': 'approved'},
+        ])
+        events = RequestStream.events(subscription, division_ids={2},
+                keepalive=0)
+        self.assertEqual(next(events), 'retry: 5000\n\n')
+        event = next(events)
+        self.assertTrue(event.startswith('event: request\n'))
+        data = json.loads(event.split('data: ', 1)[1])
+        self.assertEqual(data['id'], 2)
+        self.assertEqual(next(events), ': keepalive\n\n')
+
+    def test_overflow_resync(self):
+        subscription = Subscription(maxsize=1)
+        subscription.put([
+            {'id': 1, 'division_id': 1, 'submitter_id': 1},
+            {'id': 2, 'division_id': 1, 'submitter_id': 1},
+        ])
+        events = RequestStream.events(subscription, {1}, keepalive=0)
+        next(events)
+        self.assertEqual(next(events), 'event: resync\ndata: {}\n\n')
+
+    def test_lifetime(self):
+        events = RequestStream.events(Subscription(), {1}, keepalive=0,
+                lifetime=0)
+        # The client is told how long to wait before reconnecting, then the
+        # stream ends.
+        self.assertEqual(list(events), ['retry: 5000\n\n'])
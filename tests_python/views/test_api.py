@@ -0,0 +1,307 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import datetime as dt
+import json
+from sqlalchemy import event
+from evesrp import db
+from evesrp.models import Request, Action, ActionType, RequestChange, \
+        archive_requests, request_archive
+from evesrp.util.datetime import utc
+from .requests.test_lists import TestRequestList
+
+
+class TestRequestChanges(TestRequestList):
+
+    def setUp(self):
+        super(TestRequestChanges, self).setUp()
+        self.app.config['SRP_CHANGES_SETTLE_SECONDS'] = 0
+
+    def get_changes(self, client, since=0, **kwargs):
+        kwargs['since'] = since
+        resp = client.get('/api/requests/changes', query_string=kwargs)
+        self.assertEqual(resp.status_code, 200)
+        return json.loads(resp.get_data(as_text=True))
+
+    def test_initial_sync(self):
+        client = self.login(self.admin_name)
+        data = self.get_changes(client)
+        self.assertEqual(len(data['changes']), 14)
+        self.assertFalse(data['more'])
+        # Nothing further has changed
+        data = self.get_changes(client, data['cursor'])
+        self.assertEqual(len(data['changes']), 0)
+
+    def test_own_requests(self):
+        client = self.login(self.normal_name)
+        data = self.get_changes(client)
+        self.assertEqual(len(data['changes']), 7)
+
+    def test_batches(self):
+        client = self.login(self.admin_name)
+        data = self.get_changes(client, limit=5)
+        self.assertEqual(len(data['changes']), 5)
+        self.assertTrue(data['more'])
+        seen = set(c['id'] for c in data['changes'])
+        while data['more']:
+            data = self.get_changes(client, data['cursor'], limit=5)
+            seen.update(c['id'] for c in data['changes'])
+        self.assertEqual(len(seen), 14)
+
+    def test_incremental_changes(self):
+        client = self.login(self.admin_name)
+        cursor = self.get_changes(client)['cursor']
+        with self.app.test_request_context():
+            srp_request = Request.query.filter_by(
+                    status=ActionType.evaluating).first()
+            request_id = srp_request.id
+            Action(srp_request, self.admin_user, type_=ActionType.approved)
+            db.session.commit()
+        data = self.get_changes(client, cursor)
+        self.assertEqual(len(data['changes']), 1)
+        change = data['changes'][0]
+        self.assertEqual(change['id'], request_id)
+        self.assertEqual(change['status'], 'approved')
+        # The whole request is sent again, including the new action
+        with self.app.test_request_context():
+            action_count = Action.query.filter_by(
+                    request_id=request_id).count()
+        self.assertEqual(len(change['actions']), action_count)
+        self.assertEqual(change['actions'][-1]['type'], 'approved')
+
+    def test_seeded_batches(self):
+        # The migration adding the change log gives every existing request
+        # one entry, all with the same timestamp.
+        with self.app.test_request_context():
+            RequestChange.query.delete()
+            now = dt.datetime.now(utc) - dt.timedelta(seconds=1)
+            action_counts = {}
+            for srp_request in Request.query.order_by(Request.id):
+                db.session.add(RequestChange(request_id=srp_request.id,
+                        division_id=srp_request.division_id,
+                        submitter_id=srp_request.submitter_id,
+                        deleted=False, timestamp=now))
+                action_counts[srp_request.id] = len(srp_request.actions)
+            db.session.commit()
+        client = self.login(self.admin_name)
+        data = {'cursor': 0, 'more': True}
+        batches = 0
+        sent_counts = {}
+        while data['more']:
+            data = self.get_changes(client, data['cursor'], limit=4)
+            batches += 1
+            for change in data['changes']:
+                sent_counts[change['id']] = len(change['actions'])
+        self.assertGreater(batches, 1)
+        # Every request is sent with its whole history, not just the first
+        # batch.
+        self.assertEqual(sent_counts, action_counts)
+
+    def test_cursor_keeps_later_changes(self):
+        client = self.login(self.admin_name)
+        cursor = self.get_changes(client)['cursor']
+        with self.app.test_request_context():
+            first, second = Request.query.filter_by(
+                    status=ActionType.evaluating).limit(2).all()
+            first_id, second_id = first.id, second.id
+            for request_id, action_type in ((first_id, ActionType.incomplete),
+                    (second_id, ActionType.incomplete),
+                    (first_id, ActionType.evaluating)):
+                srp_request = Request.query.get(request_id)
+                Action(srp_request, self.admin_user, type_=action_type)
+                db.session.commit()
+        sent = []
+        data = {'cursor': cursor, 'more': True}
+        while data['more']:
+            data = self.get_changes(client, data['cursor'], limit=1)
+            sent.extend(data['changes'])
+        # The first request is sent again after the second one, with both of
+        # its new actions.
+        sent_ids = [c['id'] for c in sent]
+        self.assertLess(sent_ids.index(first_id), sent_ids.index(second_id))
+        self.assertEqual(sent_ids[-1], first_id)
+        last = sent[-1]
+        self.assertEqual([a['type'] for a in last['actions']][-2:],
+                ['incomplete', 'evaluating'])
+
+    def test_tombstones(self):
+        client = self.login(self.admin_name)
+        cursor = self.get_changes(client)['cursor']
+        with self.app.test_request_context():
+            srp_request = Request.query.first()
+            request_id = srp_request.id
+            db.session.delete(srp_request)
+            db.session.commit()
+        data = self.get_changes(client, cursor)
+        self.assertEqual(data['changes'],
+                [{'id': request_id, 'deleted': True}])
+
+
+class TestRequestBatch(TestRequestList):
+
+    def setUp(self):
+        super(TestRequestBatch, self).setUp()
+        with self.app.test_request_context():
+            self.request_ids = [r.id for r in
+                    Request.query.order_by(Request.id.desc())]
+            self.normal_ids = [r.id for r in
+                    Request.query.filter_by(submitter=self.normal_user)]
+
+    def get_batch(self, client, ids):
+        resp = client.get('/api/requests/',
+                query_string={'ids': ','.join(str(i) for i in ids)})
+        self.assertEqual(resp.status_code, 200)
+        return json.loads(resp.get_data(as_text=True))
+
+    def test_batch_order(self):
+        client = self.login(self.admin_name)
+        data = self.get_batch(client, self.request_ids)
+        self.assertEqual([r['id'] for r in data], self.request_ids)
+        for detail in data:
+            for key in ('actions', 'modifiers', 'valid_actions',
+                    'transformed', 'pilot', 'division'):
+                self.assertIn(key, detail)
+
+    def test_batch_permissions(self):
+        client = self.login(self.normal_name)
+        data = self.get_batch(client, self.request_ids)
+        self.assertEqual(set(r['id'] for r in data), set(self.normal_ids))
+
+    def test_batch_limit(self):
+        client = self.login(self.admin_name)
+        self.app.config['SRP_BATCH_REQUEST_LIMIT'] = 5
+        resp = client.get('/api/requests/',
+                query_string={'ids': ','.join(str(i) for i in range(6))})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_constant_queries(self):
+        with self.app.test_request_context():
+            cutoff = dt.datetime.utcnow() + dt.timedelta(days=1)
+            self.assertGreater(sum(archive_requests(cutoff)), 1)
+            hot_ids = [r.id for r in Request.query]
+            archived_ids = [r.id for r in
+                    db.session.query(request_archive.c.id)]
+        # IDs that are not in either table
+        unknown_ids = [max(self.request_ids) + i for i in range(1, 6)]
+        client = self.login(self.admin_name)
+        queries = []
+        def count_query(*args):
+            queries.append(args[2])
+        engine = db.get_engine(self.app)
+        event.listen(engine, 'after_cursor_execute', count_query)
+        try:
+            data = self.get_batch(client,
+                    hot_ids[:1] + archived_ids[:1] + unknown_ids[:1])
+            self.assertEqual(len(data), 2)
+            few = len(queries)
+            del queries[:]
+            data = self.get_batch(client,
+                    hot_ids + archived_ids + unknown_ids)
+            self.assertEqual(len(data), len(hot_ids) + len(archived_ids))
+            many = len(queries)
+        finally:
+            event.remove(engine, 'after_cursor_execute', count_query)
+        self.assertEqual(few, many)
+
+
+class TestSparseFields(TestRequestList):
+
+    def get_json(self, client, path, **kwargs):
+        kwargs['fmt'] = 'json'
+        resp = client.get(path, query_string=kwargs, follow_redirects=True)
+        self.assertEqual(resp.status_code, 200)
+        return json.loads(resp.get_data(as_text=True))
+
+    def test_listing_fields(self):
+        client = self.login(self.admin_name)
+        data = self.get_json(client, '/request/all/',
+                fields='status,payout')
+        self.assertEqual(len(data['requests']), 14)
+        for request_json in data['requests']:
+            self.assertEqual(set(request_json.keys()),
+                    {'id', 'status', 'payout'})
+
+    def test_relationship_fields(self):
+        client = self.login(self.admin_name)
+        data = self.get_json(client, '/request/all/', fields='pilot,href')
+        for request_json in data['requests']:
+            self.assertEqual(set(request_json.keys()), {'id', 'pilot', 'href'})
+            self.assertEqual(request_json['pilot']['name'], 'Generic Pilot')
+
+    def test_unknown_field(self):
+        client = self.login(self.admin_name)
+        resp = client.get('/request/all/',
+                query_string={'fmt': 'json', 'fields': 'id,bogus'})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_filter_fields(self):
+        client = self.login(self.admin_name)
+        data = self.get_json(client, '/api/filter/request/',
+                fields='division,ship')
+        self.assertEqual(len(data['requests']), 14)
+        for request_json in data['requests']:
+            self.assertEqual(set(request_json.keys()),
+                    {'id', 'division', 'ship'})
+
+    def test_detail_fields(self):
+        client = self.login(self.admin_name)
+        with self.app.test_request_context():
+            request_id = Request.query.first().id
+        data = self.get_json(client, '/request/{}/'.format(request_id),
+                fields='status,valid_actions')
+        self.assertIn('valid_actions', data)
+        self.assertIn('status', data)
+        self.assertNotIn('actions', data)
+        self.assertNotIn('pilot', data)
+
+
+class TestColumnarListing(TestRequestList):
+
+    def get_columnar(self, client, path, **kwargs):
+        kwargs['layout'] = 'columnar'
+        resp = client.get(path, query_string=kwargs)
+        self.assertEqual(resp.status_code, 200)
+        return json.loads(resp.get_data(as_text=True))
+
+    def decode(self, data):
+        """Turn a columnar response back into a list of dicts."""
+        dictionaries = {key: [] for key in data['dictionary_fields']}
+        rows = []
+        for chunk in data['chunks']:
+            for key, values in chunk['dictionaries'].items():
+                dictionaries[key].extend(values)
+            for index in range(chunk['count']):
+                row = {}
+                for key, column in chunk['columns'].items():
+                    value = column[index]
+                    if key in dictionaries:
+                        value = dictionaries[key][value]
+                    row[key] = value
+                rows.append(row)
+        return rows
+
+    def test_matches_row_layout(self):
+        client = self.login(self.admin_name)
+        self.app.config['SRP_COLUMNAR_CHUNK_SIZE'] = 4
+        data = self.get_columnar(client, '/api/filter/request/')
+        self.assertEqual(len(data['chunks']), 4)
+        resp = client.get('/api/filter/request/')
+        expected = json.loads(resp.get_data(as_text=True))['requests']
+        self.assertEqual(self.decode(data), expected)
+
+    def test_dictionaries_not_repeated(self):
+        client = self.login(self.admin_name)
+        self.app.config['SRP_COLUMNAR_CHUNK_SIZE'] = 2
+        data = self.get_columnar(client, '/api/filter/request/',
+                fields='pilot')
+        self.assertEqual(data['fields'], ['id', 'pilot'])
+        pilots = []
+        for chunk in data['chunks']:
+            pilots.extend(chunk['dictionaries'].get('pilot', []))
+        self.assertEqual(pilots, ['Generic Pilot'])
+
+    def test_personal_columnar(self):
+        client = self.login(self.normal_name)
+        data = self.get_columnar(client, '/api/filter/request/personal/',
+                fields='ship,division')
+        rows = self.decode(data)
+        self.assertEqual(len(rows), 7)
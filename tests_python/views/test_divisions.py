@@ -113,3 +113,21 @@ class TestDivisionDetails(TestLogin):
         with self.app.test_request_context():
             division = Division.query.get(1)
             self.assertIsNone(division.transformers.get('ship_type', None))
+
+    def test_transformer_cache_invalidated(self):
+        with self.app.test_request_context():
+            division = Division.query.get(1)
+            self.assertEqual(division.transformer_map, {})
+            generation = division.transformer_generation
+        client = self.login(self.admin_name)
+        resp = client.post('/division/1/', follow_redirects=True, data={
+                'transformer': 'Test Transformer',
+                'attribute': 'ship_type',
+                'form_id': 'transformer',
+        })
+        self.assertEqual(resp.status_code, 200)
+        with self.app.test_request_context():
+            division = Division.query.get(1)
+            self.assertGreater(division.transformer_generation, generation)
+            self.assertEqual(division.transformer_map, {'ship_type':
+                    self.app.url_transformers['ship_type']['Test Transformer']})